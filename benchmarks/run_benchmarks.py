@@ -0,0 +1,516 @@
+"""Benchmarks of the rrc pipeline stages on the tutorial PDFs.
+
+Times the import of the rrc modules, PDF extraction (pdfplumber, PdfReader and auto), chunking, document store embedding and
+end-to-end run_query latency, and writes the results to a JSON file. The model stages use
+small, randomly initialized stand-in models built from the workload itself, so the benchmarks
+run offline on CPU. Results can be compared with a previous run to catch regressions.
+
+Usage (from the repository top level dir):
+    python benchmarks/run_benchmarks.py --output benchmark_results.json
+    python benchmarks/run_benchmarks.py --output new.json --baseline benchmark_results.json
+"""
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from glob import glob
+
+# run from a checkout without installing rrc
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+from rrc import instrumentation
+from rrc.text_extraction import PDFExtractor, ArticleIndex
+
+DEFAULT_PDF_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tutorials", "articles")
+
+STAGES = ("import", "extraction", "chunking", "embedding", "query")
+
+# modules timed by the import stage, and the heavy libraries an extraction worker should not load
+IMPORT_MODULES = ("rrc", "rrc.text_extraction", "rrc.run_session")
+HEAVY_MODULES = ("torch", "transformers", "haystack", "faiss", "pandas", "pyzotero", "sklearn")
+
+# metrics compared against a baseline, and whether higher values are better
+TRACKED_METRICS = {
+    "import.rrc.seconds": False,
+    "import.text_extraction.seconds": False,
+    "import.text_extraction.peak_rss_mb": False,
+    "extraction.pdfplumber.pages_per_second": True,
+    "extraction.PdfReader.pages_per_second": True,
+    "extraction.auto.pages_per_second": True,
+    "extraction.auto.fallback_rate": False,
+    "extraction.pdfplumber.peak_rss_mb": False,
+    "extraction.PdfReader.peak_rss_mb": False,
+    "chunking.cold_chunks_per_second": True,
+    "chunking.warm_chunks_per_second": True,
+    "embedding.chunks_per_second": True,
+    "query.cold_seconds": False,
+    "query.warm_seconds": False,
+}
+
+# embedding size of the stand-in encoders, the document store of RapidReviewSession is 768-dimensional
+STAND_IN_EMBEDDING_DIM = 768
+
+PROMPT = "Answer the question using the documents. Documents: {join(documents)} Question: {query} Answer:"
+QUERY = "What methods were used to model patient flow?"
+
+
+def _peak_rss_mb():
+    """
+    Returns the peak resident set size of the current process in MB, or None if unknown.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on Linux
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / (1 << 10)
+
+
+# runs in a fresh interpreter that has imported nothing of rrc or of this script
+_IMPORT_SCRIPT = """
+import importlib, json, sys, time
+sys.path.insert(0, {root!r})
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def peak_rss_mb():
+    # VmHWM starts over at exec, ru_maxrss on Linux keeps the peak of the parent process
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / (1 << 10)
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / (1 << 10)
+
+rss_before = peak_rss_mb()
+start = time.perf_counter()
+importlib.import_module({module!r})
+seconds = time.perf_counter() - start
+print(json.dumps({{
+    "seconds": seconds,
+    "peak_rss_mb": peak_rss_mb(),
+    "rss_before_mb": rss_before,
+    "heavy_modules": [name for name in {heavy!r} if name in sys.modules]
+}}))
+"""
+
+
+def bench_import(modules=IMPORT_MODULES, repeats=3):
+    """
+    Times the import of rrc modules, each in a fresh interpreter, and reports the peak RSS and
+    the heavy libraries loaded along the way. Modules whose dependencies are missing report the error.
+
+    :param modules: Modules to import.
+    :param repeats: Number of imports per module, the fastest one is reported.
+    :return: Dictionary of results per module, keyed by the module name without the "rrc." prefix.
+    """
+    root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    results = {}
+    for module in modules:
+        script = _IMPORT_SCRIPT.format(root=root_dir, module=module, heavy=HEAVY_MODULES)
+        runs = []
+        for _ in range(repeats):
+            process = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True)
+            if process.returncode:
+                runs = [{"error": process.stderr.strip().splitlines()[-1]}]
+                break
+            runs.append(json.loads(process.stdout.strip().splitlines()[-1]))
+        result = min(runs, key=lambda run: run.get("seconds", 0))
+        results[module.split(".", 1)[1] if "." in module else module] = result
+        if "error" in result:
+            print(f"[import] {module}: {result['error']}")
+        else:
+            print(f"[import] {module}: {result['seconds']:.3f}s, {result['peak_rss_mb'] or 0:.0f} MB peak RSS, "
+                  f"heavy modules: {', '.join(result['heavy_modules']) or 'none'}")
+    return results
+
+
+# runs in a fresh process, so the peak RSS only covers one extractor
+def _extraction_worker(extractor, pdf_dir, conn):
+    pdf_extractor = PDFExtractor(pdf_dir)
+    paths = sorted(path for path in pdf_extractor.paths if path.endswith(".pdf"))
+    rss_before = _peak_rss_mb()
+    pages = 0
+    pdfplumber_pages = 0
+    failed = []
+    # per-page spans break the time down into parsing, table detection and text extraction
+    tracer = instrumentation.enable_tracing()
+    start = time.perf_counter()
+    for path in paths:
+        try:
+            for page in pdf_extractor.iter_pages(extractor=extractor, path=path):
+                pages += 1
+                pdfplumber_pages += page["extractor"] == "pdfplumber"
+        except Exception as e:
+            failed.append((os.path.basename(path), str(e)))
+    seconds = time.perf_counter() - start
+    spans = tracer.summary()["spans"]
+    conn.send({
+        "pdfs": len(paths),
+        "pages": pages,
+        "pdfplumber_pages": pdfplumber_pages,
+        # share of the pages "auto" hands to pdfplumber
+        "fallback_rate": pdfplumber_pages / pages if pages else 0.0,
+        "failed": failed,
+        "seconds": seconds,
+        "pages_per_second": pages / seconds if seconds else 0.0,
+        "stage_seconds": {
+            name.split(".", 1)[1]: spans[name]["seconds"]
+            for name in ("extract.parse", "extract.find_tables", "extract.text") if name in spans
+        },
+        "peak_rss_mb": _peak_rss_mb(),
+        "rss_before_mb": rss_before
+    })
+    conn.close()
+
+
+def bench_extraction(pdf_dir, extractors=("pdfplumber", "PdfReader", "auto")):
+    """
+    Times page-level extraction of every PDF in pdf_dir, each extractor in its own process.
+
+    :param pdf_dir: Directory of the PDF workload.
+    :param extractors: Extractors to benchmark.
+    :return: Dictionary of results per extractor.
+    """
+    ctx = mp.get_context("spawn")
+    results = {}
+    for extractor in extractors:
+        parent_conn, child_conn = ctx.Pipe(duplex=False)
+        process = ctx.Process(target=_extraction_worker, args=(extractor, pdf_dir, child_conn))
+        process.start()
+        child_conn.close()
+        results[extractor] = parent_conn.recv()
+        process.join()
+        print(f"[extraction] {extractor}: {results[extractor]['pages_per_second']:.1f} pages/s")
+    return results
+
+
+def build_corpus(pdf_dir, work_dir):
+    """
+    Extracts the workload once with PdfReader, as the source directory of the session stages.
+
+    :return: Tuple of the directory of the extracted JSON files and the list of article ids.
+    """
+    corpus_dir = os.path.join(work_dir, "articles")
+    os.makedirs(corpus_dir, exist_ok=True)
+    PDFExtractor(pdf_dir).mass_extract("PdfReader", dest_dir=corpus_dir)
+    article_ids = sorted(ArticleIndex(corpus_dir))
+    return corpus_dir, article_ids
+
+
+def build_stand_in_models(corpus_dir, model_dir, vocab_size=4000, max_length=512):
+    """
+    Builds small, randomly initialized DPR encoders and a GPT-2 generator, with tokenizers
+    trained on the extracted corpus. Models already in model_dir are reused.
+
+    :param corpus_dir: Directory of the extracted JSON files.
+    :param model_dir: Directory where the models are saved.
+    :return: Tuple of the query encoder, context encoder and generator model paths.
+    """
+    from tokenizers import BertWordPieceTokenizer, ByteLevelBPETokenizer
+    from transformers import (
+        BertTokenizerFast, DPRConfig, DPRContextEncoder, DPRQuestionEncoder,
+        GPT2Config, GPT2LMHeadModel, GPT2TokenizerFast)
+
+    query_path = os.path.join(model_dir, "dpr-question-encoder")
+    context_path = os.path.join(model_dir, "dpr-context-encoder")
+    qa_path = os.path.join(model_dir, "gpt2-generator")
+    if all(os.path.exists(os.path.join(path, "config.json")) for path in (query_path, context_path, qa_path)):
+        with open(os.path.join(query_path, "config.json")) as file:
+            # stand-ins of an earlier, smaller embedding size are rebuilt
+            if json.load(file).get("hidden_size") == STAND_IN_EMBEDDING_DIM:
+                return query_path, context_path, qa_path
+
+    texts = []
+    for path in glob(os.path.join(corpus_dir, "*.json")):
+        with open(path) as file:
+            data = json.load(file)
+        if isinstance(data, dict):
+            texts.append(data["extracted_text"])
+
+    wordpiece = BertWordPieceTokenizer(lowercase=True)
+    wordpiece.train_from_iterator(texts, vocab_size=vocab_size)
+    ret_tokenizer = BertTokenizerFast(
+        tokenizer_object=wordpiece._tokenizer,
+        unk_token="[UNK]", sep_token="[SEP]", pad_token="[PAD]", cls_token="[CLS]", mask_token="[MASK]",
+        model_max_length=max_length)
+    dpr_config = DPRConfig(
+        vocab_size=len(ret_tokenizer), hidden_size=STAND_IN_EMBEDDING_DIM, num_hidden_layers=2, num_attention_heads=2,
+        intermediate_size=128, max_position_embeddings=max_length)
+    for encoder_class, path in ((DPRQuestionEncoder, query_path), (DPRContextEncoder, context_path)):
+        encoder_class(dpr_config).save_pretrained(path)
+        ret_tokenizer.save_pretrained(path)
+
+    bpe = ByteLevelBPETokenizer()
+    bpe.train_from_iterator(texts, vocab_size=vocab_size, special_tokens=["<|endoftext|>"])
+    qa_tokenizer = GPT2TokenizerFast(
+        tokenizer_object=bpe._tokenizer,
+        bos_token="<|endoftext|>", eos_token="<|endoftext|>", unk_token="<|endoftext|>",
+        model_max_length=max_length)
+    gpt2_config = GPT2Config(
+        vocab_size=len(qa_tokenizer), n_positions=max_length, n_embd=64, n_layer=2, n_head=2,
+        bos_token_id=qa_tokenizer.bos_token_id, eos_token_id=qa_tokenizer.eos_token_id)
+    GPT2LMHeadModel(gpt2_config).save_pretrained(qa_path)
+    qa_tokenizer.save_pretrained(qa_path)
+    return query_path, context_path, qa_path
+
+
+def _session(corpus_dir, store_dir, models, qa_model_kwargs, embedding_kwargs=None):
+    from rrc.run_session import RapidReviewSession
+
+    os.makedirs(store_dir, exist_ok=True)
+    return RapidReviewSession(
+        src_dir=corpus_dir,
+        ret_models=models[:2],
+        qa_model=models[2],
+        use_gpu=False,
+        index_path=os.path.join(store_dir, "index.faiss"),
+        config_path=os.path.join(store_dir, "config.json"),
+        sql_url=f"sqlite:///{os.path.join(store_dir, 'documents.db')}",
+        qa_model_kwargs=qa_model_kwargs,
+        **(embedding_kwargs or {}))
+
+
+def bench_chunking(session, article_ids, top_k):
+    """
+    Times _chunk_articles over all articles, with a cold and then a warm tokenization cache.
+
+    :return: Dictionary of chunking results.
+    """
+    session._get_context_size(PROMPT, QUERY)
+    session.ret_top_k = top_k
+    session._get_chunk_size()
+    params = {"retriever": {"filters": {"article_id": article_ids}, "top_k": top_k}}
+    session.token_cache.clear()
+    results = {"articles": len(article_ids), "chunk_size": session.chunk_size}
+    for run in ("cold", "warm"):
+        start = time.perf_counter()
+        documents = session._chunk_articles(params)
+        seconds = time.perf_counter() - start
+        results["chunks"] = len(documents)
+        results[f"{run}_seconds"] = seconds
+        results[f"{run}_chunks_per_second"] = len(documents) / seconds if seconds else 0.0
+    print(f"[chunking] {results['cold_chunks_per_second']:.1f} chunks/s cold, "
+          f"{results['warm_chunks_per_second']:.1f} chunks/s warm")
+    return results, documents
+
+
+def bench_embedding(session, documents, store_dir):
+    """
+    Times writing and embedding the chunks in a fresh document store.
+
+    :return: Dictionary of embedding results.
+    """
+    from rrc.run_session import FilteredFAISSDocumentStore
+
+    os.makedirs(store_dir, exist_ok=True)
+    session.document_store = FilteredFAISSDocumentStore(
+        sql_url=f"sqlite:///{os.path.join(store_dir, 'documents.db')}")
+    load_start = time.perf_counter()
+    retriever = session._get_retriever()
+    load_seconds = time.perf_counter() - load_start
+    start = time.perf_counter()
+    session.document_store.write_documents(documents)
+    session.document_store.update_embeddings(retriever=retriever, update_existing_embeddings=False)
+    seconds = time.perf_counter() - start
+    results = {
+        "chunks": len(documents),
+        "retriever_load_seconds": load_seconds,
+        "seconds": seconds,
+        "chunks_per_second": len(documents) / seconds if seconds else 0.0,
+        "batch_size": retriever.batch_size,
+        "padding_ratio": retriever.get_throughput("passages")["padding_ratio"]
+    }
+    print(f"[embedding] {results['chunks_per_second']:.1f} chunks/s")
+    return results
+
+
+def bench_query(session, article_ids, top_k, repeats):
+    """
+    Times run_query end to end on a fresh session: the first query loads the models and indexes
+    the article, the following ones run warm.
+
+    :return: Dictionary of query results.
+    """
+    from rrc.caching import AnswerCache
+
+    params = {"retriever": {"filters": {"article_id": article_ids[0]}, "top_k": top_k}}
+    # warm queries generate every answer, a repeated query is then served by the answer cache
+    answer_cache, session.answer_cache = session.answer_cache or AnswerCache(), None
+    for _ in range(1 + repeats):
+        session.run_query(PROMPT, QUERY, params)
+    session.answer_cache = answer_cache
+    for _ in range(2):
+        session.run_query(PROMPT, QUERY, params)
+    timings = session.get_model_timings()
+    warm = [query["seconds"] for query in timings["queries"][1:1 + repeats]]
+    results = {
+        "cold_seconds": timings["queries"][0]["seconds"],
+        "warm_seconds": sum(warm) / len(warm) if warm else None,
+        "cached_seconds": timings["queries"][-1]["seconds"],
+        "queries": timings["queries"],
+        "models": [
+            {**model, "model": str(model["model"])} for model in timings["models"]
+        ]
+    }
+    print(f"[query] {results['cold_seconds']:.2f}s cold, {results['warm_seconds']:.2f}s warm, "
+          f"{results['cached_seconds']:.2f}s cached")
+    return results
+
+
+def _environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    versions = {}
+    for package in ("pdfplumber", "PyPDF2", "transformers", "torch", "haystack", "faiss", "numpy"):
+        try:
+            versions[package] = getattr(__import__(package), "__version__", None)
+        except ImportError:
+            versions[package] = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "versions": versions
+    }
+
+
+def _lookup(results, metric):
+    value = results
+    for key in metric.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compares the tracked metrics of results with a baseline run.
+
+    :param results: Results of this run.
+    :param baseline: Results of the baseline run.
+    :param tolerance: Relative change beyond which a metric counts as a regression, e.g. 0.2.
+    :return: List of regressions as dictionaries with the metric, baseline and current values.
+    """
+    regressions = []
+    for metric, higher_is_better in TRACKED_METRICS.items():
+        current, previous = _lookup(results, metric), _lookup(baseline, metric)
+        if current is None or not previous:
+            continue
+        change = (current - previous) / previous
+        if (-change if higher_is_better else change) > tolerance:
+            regressions.append({"metric": metric, "baseline": previous, "current": current, "change": change})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdf-dir", default=DEFAULT_PDF_DIR, help="Directory of the PDF workload.")
+    parser.add_argument("--output", default="benchmark_results.json", help="Path of the JSON results.")
+    parser.add_argument("--stages", default=",".join(STAGES), help="Comma-separated stages to run.")
+    parser.add_argument("--work-dir", default=None, help="Directory for the corpus, models and stores. "
+                        "If not set, a temporary directory is used.")
+    parser.add_argument("--ret-models", nargs=2, default=None, metavar=("QUERY_MODEL", "CONTEXT_MODEL"),
+                        help="Retriever models to use instead of the stand-in models.")
+    parser.add_argument("--qa-model", default=None, help="Generator model to use instead of the stand-in model.")
+    parser.add_argument("--top-k", type=int, default=3, help="Retriever top_k.")
+    parser.add_argument("--repeats", type=int, default=3, help="Number of warm queries.")
+    parser.add_argument("--embedding-batch-size", type=int, default=16, help="Retriever batch size.")
+    parser.add_argument("--embedding-threads", type=int, default=None, help="torch threads used while embedding.")
+    parser.add_argument("--quantize-embeddings", action="store_true",
+                        help="Run the retriever encoders with dynamic int8 quantization.")
+    parser.add_argument("--baseline", default=None, help="Results of a previous run to compare with.")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Relative change beyond which a metric counts as a regression.")
+    args = parser.parse_args(argv)
+
+    stages = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"Unknown stages: {', '.join(sorted(unknown))}. Stages must be in {', '.join(STAGES)}.")
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="rrc_bench_")
+    # imports are timed before this process loads the heavy libraries (e.g. in _environment),
+    # as fresh interpreters may start from the peak RSS of their parent
+    import_results = bench_import() if "import" in stages else None
+    results = {"environment": _environment(), "workload": {"pdf_dir": os.path.abspath(args.pdf_dir)}}
+
+    if import_results is not None:
+        results["import"] = import_results
+
+    if "extraction" in stages:
+        results["extraction"] = bench_extraction(args.pdf_dir)
+
+    if set(stages) & {"chunking", "embedding", "query"}:
+        corpus_dir, article_ids = build_corpus(args.pdf_dir, work_dir)
+        results["workload"]["articles"] = len(article_ids)
+        if args.ret_models and args.qa_model:
+            models, qa_model_kwargs = (*args.ret_models, args.qa_model), None
+        else:
+            stand_ins = build_stand_in_models(corpus_dir, os.path.join(work_dir, "models"))
+            models = (*(args.ret_models or stand_ins[:2]), args.qa_model or stand_ins[2])
+            qa_model_kwargs = None if args.qa_model else {"task_name": "text-generation"}
+        results["workload"]["models"] = list(models)
+        embedding_kwargs = {
+            "embedding_batch_size": args.embedding_batch_size,
+            "embedding_threads": args.embedding_threads,
+            "quantize_embeddings": args.quantize_embeddings
+        }
+        results["workload"]["embedding"] = embedding_kwargs
+
+        session = _session(
+            corpus_dir, os.path.join(work_dir, "store_chunking"), models, qa_model_kwargs, embedding_kwargs)
+        results["chunking"], documents = bench_chunking(session, article_ids, args.top_k)
+        if "embedding" in stages:
+            results["embedding"] = bench_embedding(
+                session, documents, os.path.join(work_dir, "store_embedding"))
+        if "query" in stages:
+            # a new session, so the first query pays for loading the models
+            session = _session(
+                corpus_dir, os.path.join(work_dir, "store_query"), models, qa_model_kwargs, embedding_kwargs)
+            results["query"] = bench_query(session, article_ids, args.top_k, args.repeats)
+        if "chunking" not in stages:
+            del results["chunking"]
+
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=4)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression['metric']}: {regression['baseline']:.4g} -> "
+                  f"{regression['current']:.4g} ({regression['change']:+.0%})")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
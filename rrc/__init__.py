@@ -1,4 +1,17 @@
-from rrc import run_session
-from rrc import text_extraction
-from rrc import analysis
-from rrc import qa_encoding 
\ No newline at end of file
+"""Submodules are imported on first access, e.g. rrc.run_session or from rrc import run_session,
+so a worker that only extracts PDFs does not load transformers, haystack or FAISS.
+"""
+
+import importlib
+
+__all__ = ["instrumentation", "run_session", "text_extraction", "corpus", "analysis", "qa_encoding"]
+
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
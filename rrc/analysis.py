@@ -1,5 +1,399 @@
 """This module contains scripts that are necessary for the analysis of encoded data
 from review articles. Encoded data may either be full texts, abstracts, or answers obtained from
 the qa_encoding pipeline.
+
+Themes are found by clustering the context embeddings already computed for the chunks (answers
+are represented by the embeddings of the chunks they were generated from, so nothing is embedded
+twice) and described by the TF-IDF keywords of their texts. Data is consumed in batches, so large
+corpora and answer sets are never held in memory as Python lists.
 """
 
+import json
+import os
+
+import faiss
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute
+import pyarrow.feather
+from scipy import sparse
+from sklearn.feature_extraction.text import CountVectorizer
+
+
+def iter_corpus_chunks(corpus, model, batch_size=10_000):
+    """
+    Yields the embedded chunks of a CorpusStore in batches. The memory-mapped embedding table is
+    sliced record batch by record batch, so only the ids are read up front and only one batch of
+    vectors and texts is materialized at a time. Later embeddings and chunks with the same id
+    supersede earlier ones, as in CorpusStore.load_embeddings.
+
+    :param corpus: CorpusStore holding chunks and their embeddings.
+    :param model: Name of the context embedding model of the embeddings.
+    :param batch_size: Maximum number of chunks per batch.
+        If not set, default 10_000
+    :return: Generator of (ids, embeddings, texts) tuples.
+    """
+    embeddings = corpus.load_table("embeddings")
+    chunks = corpus.load_table("chunks", columns=["id", "content"])
+    if not embeddings.num_rows or not chunks.num_rows:
+        return
+    ids = embeddings["id"].to_numpy(zero_copy_only=False)
+    keep = pa.compute.equal(embeddings["model"], model).to_numpy(zero_copy_only=False)
+    model_rows = np.flatnonzero(keep)
+    keep[model_rows[pd.Index(ids[model_rows]).duplicated(keep="last")]] = False
+    chunk_ids = pd.Index(chunks["id"].to_numpy(zero_copy_only=False))
+    chunk_rows = np.flatnonzero(~chunk_ids.duplicated(keep="last"))
+    chunk_ids = chunk_ids[chunk_rows]
+
+    offset = 0
+    for record_batch in embeddings.select(["embedding"]).to_batches(max_chunksize=batch_size):
+        n_rows = record_batch.num_rows
+        batch_ids = ids[offset: offset + n_rows]
+        rows = chunk_ids.get_indexer(batch_ids)
+        selected = keep[offset: offset + n_rows] & (rows >= 0)
+        offset += n_rows
+        if not selected.any():
+            continue
+        embedding = record_batch.column(0)
+        # a view of the memory-mapped batch, copied only for the selected rows
+        vectors = embedding.flatten().to_numpy().reshape(n_rows, embedding.type.list_size)
+        yield (
+            batch_ids[selected],
+            vectors[selected],
+            chunks["content"].take(chunk_rows[rows[selected]]).to_pylist())
+
+
+def answer_embeddings(documents, ids, embeddings):
+    """
+    Represents answers by the score-weighted mean embedding of the chunks they were generated from.
+
+    :param documents: Retrieved Documents of each answer, e.g. the "documents" column of run_batch.
+    :param ids: Document ids of the stored chunk embeddings.
+    :param embeddings: 2-D array of the stored chunk embeddings, one row per id.
+    :return: 2-D float32 array, one row per answer (zeros if none of its chunks is embedded).
+    """
+    answer_rows, chunk_ids, weights = [], [], []
+    for row, answer_documents in enumerate(documents):
+        for document in answer_documents:
+            answer_rows.append(row)
+            chunk_ids.append(document.id)
+            weights.append(document.score if document.score is not None else 1.0)
+    answer_rows = np.asarray(answer_rows, dtype=np.int64)
+    positions = pd.Index(ids).get_indexer(chunk_ids)
+    found = positions >= 0
+    weights = sparse.csr_matrix(
+        (np.asarray(weights, dtype=np.float32)[found], (answer_rows[found], positions[found])),
+        shape=(len(documents), len(ids)))
+    totals = np.asarray(weights.sum(axis=1)).ravel()
+    totals[totals == 0] = 1
+    return (weights @ embeddings / totals[:, None]).astype(np.float32)
+
+
+def iter_answers(results, ids, embeddings, batch_size=10_000):
+    """
+    Yields answers in batches with the embeddings of the chunks they were generated from.
+
+    :param results: DataFrame or iterable of result dictionaries (e.g. run_batch(..., stream=True))
+        with answer and documents, and optionally query and article_id.
+    :param ids: Document ids of the stored chunk embeddings.
+    :param embeddings: 2-D array of the stored chunk embeddings, one row per id.
+    :param batch_size: Number of answers per batch.
+        If not set, default 10_000
+    :return: Generator of (ids, embeddings, texts) tuples, the ids being "<article_id>|<query>".
+    """
+    if isinstance(results, pd.DataFrame):
+        results = results.to_dict("records")
+    batch = []
+    for result in results:
+        if result.get("answer") is None:
+            continue
+        batch.append(result)
+        if len(batch) == batch_size:
+            yield _answer_batch(batch, ids, embeddings)
+            batch = []
+    if batch:
+        yield _answer_batch(batch, ids, embeddings)
+
+
+def _answer_batch(batch, ids, embeddings):
+    answer_ids = np.asarray(
+        [f"{result.get('article_id')}|{result.get('query')}" for result in batch], dtype=object)
+    vectors = answer_embeddings([result["documents"] for result in batch], ids, embeddings)
+    return answer_ids, vectors, [str(result["answer"]) for result in batch]
+
+
+class ThemeModel():
+    """
+    ThemeModel clusters embedded texts (chunks or answers) into themes with spherical k-means in
+    FAISS and describes each theme by the TF-IDF keywords of its texts. The term counts of each theme
+    are kept as a sparse matrix, so keywords are computed without holding the texts. New articles or
+    answers can be added with update: they are assigned to the nearest theme, whose centroid moves
+    to the running mean of its members.
+    """
+    def __init__(
+        self,
+        n_themes: int = 20,
+        n_keywords: int = 10,
+        n_iter: int = 25,
+        train_size: int = 50_000,
+        stop_words: str = "english",
+        seed: int = 0
+    ):
+        """
+        Creates a ThemeModel instance.
+
+        :param n_themes: The number of themes (k-means clusters).
+            If not set, default 20
+        :param n_keywords: The number of keywords reported per theme.
+            If not set, default 10
+        :param n_iter: The number of k-means iterations.
+            If not set, default 25
+        :param train_size: The number of embeddings, taken from the first batches, that k-means is trained on.
+            If not set, default 50_000
+        :param stop_words: Stop words excluded from the keywords, as in scikit-learn's CountVectorizer.
+            If not set, default "english"
+        :param seed: Seed of k-means.
+            If not set, default 0
+        """
+        self.n_themes = n_themes
+        self.n_keywords = n_keywords
+        self.n_iter = n_iter
+        self.train_size = train_size
+        self.stop_words = stop_words
+        self.seed = seed
+        self.centroids = None
+        self.sizes = np.zeros(n_themes, dtype=np.int64)
+        # vocabulary grows with each batch, theme-term counts and document frequencies follow it
+        self.vocabulary = {}
+        self.terms = []
+        self.theme_terms = sparse.csr_matrix((n_themes, 0), dtype=np.float64)
+        self.document_frequency = np.zeros(0, dtype=np.int64)
+        self.n_documents = 0
+        self._ids = []
+        self._themes = []
+        self._scores = []
+        self._index = None
+
+    @staticmethod
+    def _normalized(embeddings):
+        embeddings = np.array(embeddings, dtype=np.float32, order="C")
+        faiss.normalize_L2(embeddings)
+        return embeddings
+
+    def _set_centroids(self, centroids):
+        self.centroids = self._normalized(centroids)
+        self._index = faiss.IndexFlatIP(self.centroids.shape[1])
+        self._index.add(self.centroids)
+
+    def assign(self, embeddings):
+        """
+        Returns the nearest theme of each embedding and its cosine similarity to the theme centroid.
+
+        :param embeddings: 2-D array of embeddings.
+        :return: Tuple of the 1-D arrays of themes and scores.
+        """
+        if self._index is None:
+            raise RuntimeError("Fit the ThemeModel before assigning themes.")
+        scores, themes = self._index.search(self._normalized(embeddings), 1)
+        return themes[:, 0], scores[:, 0]
+
+    def _count_terms(self, texts):
+        """
+        Returns the sparse term counts of texts over the model's vocabulary, extending it with new terms.
+        """
+        vectorizer = CountVectorizer(stop_words=self.stop_words)
+        try:
+            counts = vectorizer.fit_transform(["" if text is None else text for text in texts])
+        except ValueError:  # only stop words or empty texts
+            return sparse.csr_matrix((len(texts), len(self.terms)))
+        mapping = np.empty(len(vectorizer.vocabulary_), dtype=np.int64)
+        for term, column in vectorizer.vocabulary_.items():
+            if term not in self.vocabulary:
+                self.vocabulary[term] = len(self.terms)
+                self.terms.append(term)
+            mapping[column] = self.vocabulary[term]
+        counts = counts.tocsr()
+        return sparse.csr_matrix(
+            (counts.data, mapping[counts.indices], counts.indptr), shape=(len(texts), len(self.terms)))
+
+    def _absorb(self, ids, embeddings, texts, move_centroids):
+        themes, scores = self.assign(embeddings)
+        if move_centroids:
+            # running mean of each theme's members, re-normalized for the spherical k-means
+            members = sparse.csr_matrix(
+                (np.ones(len(themes)), (themes, np.arange(len(themes)))), shape=(self.n_themes, len(themes)))
+            sums = members @ self._normalized(embeddings)
+            counts = np.bincount(themes, minlength=self.n_themes)
+            moved = counts > 0
+            self.centroids[moved] = (
+                self.centroids[moved] * self.sizes[moved, None] + sums[moved]
+            ) / (self.sizes[moved] + counts[moved])[:, None]
+            self._set_centroids(self.centroids)
+        self.sizes += np.bincount(themes, minlength=self.n_themes)
+
+        counts = self._count_terms(texts)
+        self.theme_terms.resize((self.n_themes, len(self.terms)))
+        self.theme_terms = self.theme_terms + sparse.csr_matrix(
+            (np.ones(len(themes)), (themes, np.arange(len(themes)))), shape=(self.n_themes, len(themes))
+        ) @ counts
+        self.document_frequency = np.concatenate([
+            self.document_frequency, np.zeros(len(self.terms) - len(self.document_frequency), dtype=np.int64)])
+        self.document_frequency += np.asarray((counts > 0).sum(axis=0)).ravel().astype(np.int64)
+        self.n_documents += len(themes)
+
+        self._ids.append(np.asarray(ids, dtype=object))
+        self._themes.append(themes)
+        self._scores.append(scores)
+
+    def fit(self, batches):
+        """
+        Trains k-means on the embeddings of the first batches (up to train_size), then assigns
+        every batch to its theme and counts the terms of each theme.
+
+        :param batches: Iterable of (ids, embeddings, texts) tuples, e.g. iter_corpus_chunks or iter_answers.
+        :return: self.
+        """
+        batches = iter(batches)
+        buffered, n_buffered = [], 0
+        for batch in batches:
+            buffered.append(batch)
+            n_buffered += len(batch[1])
+            if n_buffered >= self.train_size:
+                break
+        if n_buffered < self.n_themes:
+            raise ValueError(f"At least {self.n_themes} embeddings are needed to find {self.n_themes} themes.")
+        sample = self._normalized(np.concatenate([embeddings for _, embeddings, _ in buffered])[:self.train_size])
+        kmeans = faiss.Kmeans(
+            sample.shape[1], self.n_themes, niter=self.n_iter, spherical=True, seed=self.seed, verbose=False)
+        kmeans.train(sample)
+        del sample
+        self._set_centroids(kmeans.centroids)
+        for batch in buffered:
+            self._absorb(*batch, move_centroids=False)
+        del buffered
+        for batch in batches:
+            self._absorb(*batch, move_centroids=False)
+        return self
+
+    def update(self, batches):
+        """
+        Adds new embedded texts, e.g. the chunks or answers of newly added articles. Each is assigned
+        to the nearest theme and the centroids move to the running mean of their members.
+
+        :param batches: Iterable of (ids, embeddings, texts) tuples.
+        :return: self.
+        """
+        if self._index is None:
+            return self.fit(batches)
+        for batch in batches:
+            self._absorb(*batch, move_centroids=True)
+        return self
+
+    def keywords(self, theme=None):
+        """
+        Returns the top TF-IDF keywords of each theme. Term frequencies are the term counts of the
+        theme's texts, inverse document frequencies are computed over all texts.
+
+        :param theme: The theme to describe.
+            If not set, default None (all themes)
+        :return: List of (term, weight) tuples, or a dictionary of them per theme.
+        """
+        idf = np.log((1 + self.n_documents) / (1 + self.document_frequency)) + 1
+        themes = range(self.n_themes) if theme is None else [theme]
+        keywords = {}
+        for row in themes:
+            start, end = self.theme_terms.indptr[row], self.theme_terms.indptr[row + 1]
+            columns = self.theme_terms.indices[start:end]
+            counts = self.theme_terms.data[start:end]
+            weights = counts / counts.sum() * idf[columns] if len(counts) else counts
+            top = np.argsort(-weights)[:self.n_keywords]
+            keywords[row] = [(self.terms[columns[position]], float(weights[position])) for position in top]
+        return keywords if theme is None else keywords[theme]
+
+    def labels(self):
+        """
+        Returns the theme of every text absorbed so far.
+
+        :return: DataFrame of id, theme and score (cosine similarity to the theme centroid at assignment).
+        """
+        if not self._ids:
+            return pd.DataFrame(columns=["id", "theme", "score"])
+        return pd.DataFrame({
+            "id": np.concatenate(self._ids),
+            "theme": np.concatenate(self._themes),
+            "score": np.concatenate(self._scores)
+        })
+
+    def summary(self):
+        """
+        Returns the size and keywords of each theme.
+
+        :return: DataFrame of theme, size and keywords.
+        """
+        keywords = self.keywords()
+        return pd.DataFrame({
+            "theme": np.arange(self.n_themes),
+            "size": self.sizes,
+            "keywords": [[term for term, _ in keywords[theme]] for theme in range(self.n_themes)]
+        })
+
+    def save(self, model_dir):
+        """
+        Saves the centroids, theme sizes, term counts, vocabulary and labels, e.g. to update
+        the themes with new articles in a later session.
+
+        :param model_dir: Directory of the saved model.
+        """
+        os.makedirs(model_dir, exist_ok=True)
+        labels = self.labels()
+        np.savez(
+            os.path.join(model_dir, "themes.npz"),
+            centroids=self.centroids,
+            sizes=self.sizes,
+            document_frequency=self.document_frequency,
+            label_themes=labels["theme"].to_numpy(dtype=np.int64),
+            label_scores=labels["score"].to_numpy(dtype=np.float32))
+        sparse.save_npz(os.path.join(model_dir, "theme_terms.npz"), self.theme_terms.tocsr())
+        pyarrow.feather.write_feather(
+            pa.table({"id": pa.array(labels["id"].astype(str).tolist(), type=pa.string())}),
+            os.path.join(model_dir, "label_ids.arrow"))
+        with open(os.path.join(model_dir, "themes.json"), "w") as file:
+            json.dump({
+                "n_themes": self.n_themes,
+                "n_keywords": self.n_keywords,
+                "n_iter": self.n_iter,
+                "train_size": self.train_size,
+                "stop_words": self.stop_words,
+                "seed": self.seed,
+                "n_documents": self.n_documents,
+                "terms": self.terms
+            }, file)
+
+    @classmethod
+    def load(cls, model_dir):
+        """
+        Loads a ThemeModel saved with save.
+
+        :param model_dir: Directory of the saved model.
+        :return: ThemeModel instance.
+        """
+        with open(os.path.join(model_dir, "themes.json")) as file:
+            config = json.load(file)
+        terms = config.pop("terms")
+        n_documents = config.pop("n_documents")
+        model = cls(**config)
+        arrays = np.load(os.path.join(model_dir, "themes.npz"))
+        model._set_centroids(arrays["centroids"])
+        model.sizes = arrays["sizes"]
+        model.document_frequency = arrays["document_frequency"]
+        model.theme_terms = sparse.load_npz(os.path.join(model_dir, "theme_terms.npz")).tocsr()
+        model.terms = terms
+        model.vocabulary = {term: column for column, term in enumerate(terms)}
+        model.n_documents = n_documents
+        label_ids = pyarrow.feather.read_table(os.path.join(model_dir, "label_ids.arrow"))["id"].to_numpy(zero_copy_only=False)
+        if len(label_ids):
+            model._ids = [label_ids.astype(object)]
+            model._themes = [arrays["label_themes"]]
+            model._scores = [arrays["label_scores"]]
+        return model
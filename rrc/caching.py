@@ -0,0 +1,328 @@
+"""This module contains the caches shared across a review session, so that repeated
+questions on the same articles do not pay again for work that was already done.
+"""
+
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import re
+import time
+
+import numpy as np
+
+from rrc import instrumentation
+
+
+class TokenCache():
+    """
+    TokenCache is a size-bounded, least-recently-used cache of tokenizer outputs. Entries are keyed
+    by the tokenizer name and the hash of the text, so the same text is tokenized once per tokenizer
+    for the lifetime of a session. Token IDs and token offset mappings can optionally be persisted
+    to disk, which lets long article texts skip tokenization across sessions as well.
+    """
+    def __init__(
+        self,
+        max_tokens: int = 5_000_000,
+        cache_dir: str = None
+    ):
+        """
+        Creates a TokenCache instance.
+
+        :param max_tokens: The maximum number of token IDs held in memory. Least recently used
+            entries are evicted first.
+            If not set, default 5_000_000
+        :param cache_dir: Directory where persisted token IDs are stored.
+            If not set, default None (nothing is persisted)
+        """
+        self.max_tokens = max_tokens
+        self.cache_dir = cache_dir
+        self.n_tokens = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def _key(self, tokenizer, text, kind):
+        return (tokenizer.name_or_path, kind, hashlib.sha256(text.encode("utf-8")).hexdigest())
+
+    def _persist_path(self, key):
+        tokenizer_name, kind, text_hash = key
+        tokenizer_dir = re.sub(r"[^A-Za-z0-9_.-]", "_", tokenizer_name)
+        return os.path.join(self.cache_dir, tokenizer_dir, f"{text_hash}.{kind}.npy")
+
+    def _store(self, key, value):
+        self._entries[key] = value
+        self.n_tokens += len(value)
+        # evict least recently used entries, always keeping the newest one
+        while self.n_tokens > self.max_tokens and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self.n_tokens -= len(evicted)
+
+    def _lookup(self, key, persist):
+        """
+        Returns the cached value of key from memory or disk, or None on a miss.
+        """
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+        if persist and self.cache_dir and os.path.exists(self._persist_path(key)):
+            self.hits += 1
+            value = np.load(self._persist_path(key))
+            self._store(key, value)
+            return value
+        self.misses += 1
+        return None
+
+    def _insert(self, key, value, persist):
+        if persist and self.cache_dir:
+            persist_path = self._persist_path(key)
+            os.makedirs(os.path.dirname(persist_path), exist_ok=True)
+            np.save(persist_path, value)
+        self._store(key, value)
+
+    def input_ids(self, tokenizer, text, persist=False):
+        """
+        Returns the token IDs of text, including special tokens, as produced by tokenizer(text).
+
+        :param tokenizer: Hugging Face tokenizer.
+        :param text: Text to tokenize.
+        :param persist: Whether to persist the token IDs in cache_dir, e.g. for article texts.
+        :return: Token IDs as a 1-D int32 array.
+        """
+        key = self._key(tokenizer, text, "input_ids")
+        input_ids = self._lookup(key, persist)
+        if input_ids is None:
+            with instrumentation.span("tokenize", texts=1):
+                input_ids = np.asarray(tokenizer(text)["input_ids"], dtype=np.int32)
+            instrumentation.count("tokens", len(input_ids))
+            self._insert(key, input_ids, persist)
+        return input_ids
+
+    def offsets_batch(self, tokenizer, texts, persist=False):
+        """
+        Returns the character offsets of the tokens of each text, without special tokens.
+        Texts missing from the cache are tokenized together in a single batched call.
+        Requires a fast tokenizer.
+
+        :param tokenizer: Hugging Face fast tokenizer.
+        :param texts: Texts to tokenize.
+        :param persist: Whether to persist the offsets in cache_dir, e.g. for article texts.
+        :return: List of (tokens, 2) int32 arrays of start and end character offsets.
+        """
+        keys = [self._key(tokenizer, text, "offsets") for text in texts]
+        offsets = [self._lookup(key, persist) for key in keys]
+        missing = [position for position, value in enumerate(offsets) if value is None]
+        if missing:
+            with instrumentation.span("tokenize", texts=len(missing)):
+                encodings = tokenizer(
+                    [texts[position] for position in missing],
+                    add_special_tokens=False,
+                    return_offsets_mapping=True,
+                    return_attention_mask=False,
+                    return_token_type_ids=False)
+            instrumentation.count("tokens", sum(len(offsets) for offsets in encodings["offset_mapping"]))
+            for position, offset_mapping in zip(missing, encodings["offset_mapping"]):
+                value = np.asarray(offset_mapping, dtype=np.int32).reshape(-1, 2)
+                self._insert(keys[position], value, persist)
+                offsets[position] = value
+        return offsets
+
+    def n_input_ids(self, tokenizer, text):
+        """
+        Returns the number of tokens of text, including special tokens.
+        """
+        return len(self.input_ids(tokenizer, text))
+
+    def clear(self):
+        """
+        Empties the in-memory cache. Persisted token IDs are kept.
+        """
+        self._entries.clear()
+        self.n_tokens = 0
+
+
+class ModelCache():
+    """
+    ModelCache holds the models loaded during a session, e.g. tokenizers, the retriever and the
+    PromptNode. Entries are keyed by the kind of component, the model name and the device, so each
+    model is loaded from disk once and reused by every later query. The time taken by each cold load
+    and the number of warm reuses are recorded, which shows that the loading cost is paid once.
+    """
+    def __init__(self):
+        """
+        Creates a ModelCache instance.
+        """
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._stats = {}
+
+    def get(self, kind, model_name, device, loader):
+        """
+        Returns the cached component, calling loader to create it on the first request.
+
+        :param kind: The kind of component, e.g. "tokenizer", "retriever" or "prompt_node".
+        :param model_name: The name of the model, or a tuple of names for multi-model components.
+        :param device: The device the component runs on, e.g. "cpu" or "cuda".
+        :param loader: Callable without arguments that loads the component.
+        :return: The cached component.
+        """
+        key = (kind, model_name, device)
+        if key in self._entries:
+            self.hits += 1
+            self._stats[key]["warm_hits"] += 1
+            return self._entries[key]
+        self.misses += 1
+        start = time.perf_counter()
+        with instrumentation.span("load_model", kind=kind, model=str(model_name), device=device):
+            component = loader()
+        self._entries[key] = component
+        self._stats[key] = {"load_seconds": time.perf_counter() - start, "warm_hits": 0}
+        return component
+
+    def stats(self):
+        """
+        Returns the cold load time and the number of warm reuses of each cached component.
+
+        :return: List of dictionaries with kind, model, device, load_seconds and warm_hits.
+        """
+        return [
+            {"kind": kind, "model": model_name, "device": device, **stats}
+            for (kind, model_name, device), stats in self._stats.items()
+        ]
+
+    def clear(self):
+        """
+        Drops all cached components, e.g. to free memory. They are loaded again on next use.
+        """
+        self._entries.clear()
+        self._stats.clear()
+
+
+class AnswerCache():
+    """
+    AnswerCache is a size-bounded, least-recently-used cache of generated answers. Entries are keyed
+    by the hash of everything the answer depends on (prompt, query, article, the ids of the
+    retrieved chunks, the generator model and its settings), so any change to these inputs misses
+    the cache instead of returning a stale answer. Answers can optionally be persisted to disk, so
+    re-running a question set in a later session only generates the answers whose inputs changed.
+    Cached values must be JSON serializable.
+    """
+    def __init__(
+        self,
+        max_entries: int = 10_000,
+        cache_dir: str = None,
+        max_disk_entries: int = None
+    ):
+        """
+        Creates an AnswerCache instance.
+
+        :param max_entries: The maximum number of answers held in memory. Least recently used
+            entries are evicted first.
+            If not set, default 10_000
+        :param cache_dir: Directory where answers are persisted as JSON files.
+            If not set, default None (nothing is persisted)
+        :param max_disk_entries: The maximum number of persisted answers. Least recently used
+            files are removed first.
+            If not set, default None (unbounded)
+        """
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.max_disk_entries = max_disk_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._n_disk_entries = None
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(**inputs):
+        """
+        Returns the cache key of the inputs an answer depends on.
+
+        :param inputs: JSON serializable inputs, e.g. prompt, query, article_id, chunk_ids, model.
+        :return: Hex digest.
+        """
+        return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def _persist_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _store(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key):
+        """
+        Returns the cached value of key from memory or disk, or None on a miss.
+        """
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+        if self.cache_dir and os.path.exists(self._persist_path(key)):
+            with open(self._persist_path(key)) as file:
+                value = json.load(file)
+            # the modification time orders persisted answers by last use
+            os.utime(self._persist_path(key))
+            self.hits += 1
+            self._store(key, value)
+            return value
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        """
+        Caches value under key, persisting it if cache_dir is set.
+        """
+        self._store(key, value)
+        if not self.cache_dir:
+            return
+        persist_path = self._persist_path(key)
+        is_new = not os.path.exists(persist_path)
+        with open(persist_path + ".partial", "w") as file:
+            json.dump(value, file)
+        os.replace(persist_path + ".partial", persist_path)
+        if self.max_disk_entries is not None and is_new:
+            if self._n_disk_entries is None:
+                self._n_disk_entries = len(self._persisted())
+            else:
+                self._n_disk_entries += 1
+            if self._n_disk_entries > self.max_disk_entries:
+                self._prune()
+
+    def _persisted(self):
+        return [
+            os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir) if name.endswith(".json")
+        ]
+
+    def _prune(self):
+        # removes down to 90% of the bound, so the directory is not listed on every insert
+        paths = sorted(self._persisted(), key=os.path.getmtime)
+        n_remove = len(paths) - int(self.max_disk_entries * 0.9)
+        for path in paths[:max(n_remove, 0)]:
+            os.remove(path)
+        self._n_disk_entries = len(paths) - max(n_remove, 0)
+
+    def stats(self):
+        """
+        Returns the number of hits, misses and in-memory entries.
+        """
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+    def clear(self, persisted=False):
+        """
+        Empties the in-memory cache.
+
+        :param persisted: Whether to also remove the persisted answers.
+            If not set, default False
+        """
+        self._entries.clear()
+        if persisted and self.cache_dir:
+            for path in self._persisted():
+                os.remove(path)
+            self._n_disk_entries = 0
@@ -0,0 +1,217 @@
+"""This module contains the chunker used to split article texts into retriever-sized passages.
+"""
+
+import re
+
+import numpy as np
+
+from rrc.caching import TokenCache
+
+SENTENCE_END_CHARS = ".!?"
+
+# code points of the whitespace characters (str.isspace), the last one is U+3000
+WHITESPACE_CODE_POINTS = np.array([code for code in range(0x3001) if chr(code).isspace()], dtype=np.uint32)
+
+
+class TokenChunker():
+    """
+    TokenChunker splits texts into chunks of at most chunk_size tokens of the given tokenizer.
+    Chunks are cut on the original text through the tokenizer's offset mappings, so no chunk
+    is decoded from token IDs and tokenized again downstream. Chunks start and end on word
+    boundaries, so tokenizing a chunk again yields the same tokens and never more than chunk_size.
+    Consecutive chunks may overlap, and chunk ends may be moved back to the last sentence boundary
+    within the chunk.
+
+    Slow (non Rust based) tokenizers have no offset mappings, in which case chunks are decoded
+    from fixed windows of token IDs instead.
+    """
+    def __init__(
+        self,
+        tokenizer,
+        chunk_size: int,
+        overlap: int = 0,
+        snap_to_sentence: bool = False,
+        min_snap_ratio: float = 0.5,
+        token_cache: TokenCache = None
+    ):
+        """
+        Creates a TokenChunker instance.
+
+        :param tokenizer: Hugging Face tokenizer whose tokens are counted, i.e. the retriever tokenizer.
+        :param chunk_size: The maximum number of tokens per chunk, excluding special tokens.
+        :param overlap: The number of tokens shared by consecutive chunks. Must be smaller than chunk_size.
+            If not set, default 0
+        :param snap_to_sentence: Whether to end chunks on the last sentence boundary within the chunk.
+            If not set, default False
+        :param min_snap_ratio: The minimum share of chunk_size a chunk keeps when snapped to a sentence
+            boundary. Chunks without a boundary past this point are cut at chunk_size.
+            If not set, default 0.5
+        :param token_cache: Cache of offset mappings, e.g. the session's TokenCache.
+            If not set, default None (a private cache is used)
+        """
+        if chunk_size < 1:
+            raise ValueError(f"Chunk size must be positive, got {chunk_size}.")
+        if not 0 <= overlap < chunk_size:
+            raise ValueError(
+                f"Overlap ({overlap}) must be at least 0 and smaller than the chunk size ({chunk_size}).")
+        self.tokenizer = tokenizer
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.snap_to_sentence = snap_to_sentence
+        self.min_snap_ratio = min_snap_ratio
+        self.token_cache = token_cache if token_cache is not None else TokenCache()
+        # number of chunks produced so far per token count (chunks never exceed chunk_size), for chunk_stats
+        self.length_counts = np.zeros(chunk_size + 1, dtype=np.int64)
+
+    def _sentence_ends(self, text, offsets):
+        """
+        Flags the tokens that end a sentence, i.e. end on one of SENTENCE_END_CHARS followed by
+        whitespace or by the end of the text.
+        """
+        ends = np.zeros(len(offsets), dtype=bool)
+        boundaries = np.array(
+            [match.end() for match in re.finditer(rf"[{re.escape(SENTENCE_END_CHARS)}](?=\s|$)", text)],
+            dtype=np.int64)
+        if len(boundaries) and len(offsets):
+            ends = np.isin(offsets[:, 1], boundaries)
+        return ends
+
+    def _word_starts(self, text, offsets):
+        """
+        Flags the tokens that start a word, i.e. the first token and the tokens that follow
+        whitespace (or characters the tokenizer skipped). Subword and punctuation tokens attached
+        to the preceding token are not flagged.
+        """
+        starts = np.zeros(len(offsets), dtype=bool)
+        if not len(offsets):
+            return starts
+        code_points = np.frombuffer(text.encode("utf-32-le", "surrogatepass"), dtype=np.uint32)
+        preceding = code_points[np.maximum(offsets[1:, 0] - 1, 0)]
+        starts[0] = True
+        starts[1:] = (offsets[1:, 0] > offsets[:-1, 1]) | np.isin(preceding, WHITESPACE_CODE_POINTS)
+        return starts
+
+    def _windows(self, n_tokens, sentence_ends=None, word_starts=None, fits=None):
+        """
+        Yields the (start, end) token positions of the chunks of a text with n_tokens tokens.
+        With word_starts, cuts are moved back to the last word start, unless a single word
+        spans more than the last (1 - min_snap_ratio) of the chunk. Chunks still cut inside a
+        word (e.g. in text without spaces) are shortened until fits(start, end) holds.
+        """
+        start = 0
+        min_length = max(1, int(self.chunk_size * self.min_snap_ratio))
+        while start < n_tokens:
+            end = min(start + self.chunk_size, n_tokens)
+            if sentence_ends is not None and end < n_tokens:
+                boundaries = np.flatnonzero(sentence_ends[start + min_length - 1: end])
+                if len(boundaries):
+                    end = start + min_length + int(boundaries[-1])
+            if word_starts is not None and end < n_tokens and not word_starts[end]:
+                boundaries = np.flatnonzero(word_starts[start + min_length: end])
+                if len(boundaries):
+                    end = start + min_length + int(boundaries[-1])
+            if fits is not None and not (word_starts[start] and (end == n_tokens or word_starts[end])):
+                # a cut inside a word may tokenize into more tokens on its own
+                while end - start > 1 and not fits(start, end):
+                    end -= 1
+            yield start, end
+            if end >= n_tokens:
+                break
+            # always move forward, even when a snapped chunk is shorter than the overlap
+            next_start = max(end - self.overlap, start + 1)
+            if word_starts is not None and not word_starts[next_start]:
+                boundaries = np.flatnonzero(word_starts[start + 1: next_start])
+                # without a word start in the overlap, the next chunk starts where this one ends
+                next_start = start + 1 + int(boundaries[-1]) if len(boundaries) else end
+            start = next_start
+
+    def _chunk_text(self, text, offsets):
+        chunks = []
+        sentence_ends = self._sentence_ends(text, offsets) if self.snap_to_sentence else None
+        word_starts = self._word_starts(text, offsets)
+
+        def fits(start, end):
+            chunk_text = text[int(offsets[start, 0]):int(offsets[end - 1, 1])]
+            return len(self.tokenizer(chunk_text, add_special_tokens=False)["input_ids"]) <= self.chunk_size
+
+        for start, end in self._windows(len(offsets), sentence_ends, word_starts, fits):
+            start_char, end_char = int(offsets[start, 0]), int(offsets[end - 1, 1])
+            chunks.append({
+                "text": text[start_char:end_char],
+                "start_char": start_char,
+                "end_char": end_char,
+                "n_tokens": end - start
+            })
+        return chunks
+
+    def _chunk_decoded(self, text):
+        """
+        Fallback for slow tokenizers: decodes fixed windows of token IDs.
+        """
+        input_ids = self.token_cache.input_ids(self.tokenizer, text, persist=True)
+        special_ids = set(self.tokenizer.all_special_ids)
+        input_ids = np.array([token for token in input_ids if token not in special_ids], dtype=np.int32)
+        return [
+            {
+                "text": self.tokenizer.decode(input_ids[start:end]),
+                "start_char": None,
+                "end_char": None,
+                "n_tokens": end - start
+            }
+            for start, end in self._windows(len(input_ids))
+        ]
+
+    def chunk_batch(self, texts):
+        """
+        Chunks texts. Texts whose offset mappings are not cached yet are tokenized together
+        in a single batched tokenizer call.
+
+        :param texts: List of texts, e.g. the extracted texts of several articles.
+        :return: One list of chunks per text. Each chunk is a dictionary with the chunk text,
+            its start and end character positions in the original text and its number of tokens.
+        """
+        if self.tokenizer.is_fast:
+            offsets = self.token_cache.offsets_batch(self.tokenizer, texts, persist=True)
+            chunks = [self._chunk_text(text, text_offsets) for text, text_offsets in zip(texts, offsets)]
+        else:
+            chunks = [self._chunk_decoded(text) for text in texts]
+        lengths = np.array([chunk["n_tokens"] for text_chunks in chunks for chunk in text_chunks], dtype=np.int64)
+        self.length_counts += np.bincount(lengths, minlength=self.chunk_size + 1)
+        return chunks
+
+    def chunk(self, text):
+        """
+        Chunks a single text. See chunk_batch.
+        """
+        return self.chunk_batch([text])[0]
+
+    def chunk_stats(self):
+        """
+        Returns statistics of the number of tokens of the chunks produced so far.
+
+        :return: Dictionary with the number of chunks and the mean, min, max and percentiles of chunk sizes.
+        """
+        n_chunks = int(self.length_counts.sum())
+        if not n_chunks:
+            return {"chunks": 0}
+        lengths = np.flatnonzero(self.length_counts)
+        cumulative_counts = np.cumsum(self.length_counts[lengths])
+
+        def percentile(q):
+            # linear interpolation between the closest ranks, as np.percentile on the lengths themselves
+            rank = q / 100 * (n_chunks - 1)
+            below = int(rank)
+            low, high = lengths[np.searchsorted(cumulative_counts, [below, min(below + 1, n_chunks - 1)], side="right")]
+            return float(low + (high - low) * (rank - below))
+
+        return {
+            "chunks": n_chunks,
+            "mean": float(lengths @ self.length_counts[lengths] / n_chunks),
+            "min": int(lengths[0]),
+            "p5": percentile(5),
+            "p50": percentile(50),
+            "p95": percentile(95),
+            "max": int(lengths[-1]),
+            "chunk_size": self.chunk_size,
+            "overlap": self.overlap
+        }
@@ -0,0 +1,325 @@
+"""This module contains the columnar corpus store that holds extracted articles, reference manager
+metadata, chunks and embeddings of a review in a single directory of Arrow files.
+"""
+
+import json
+import os
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute
+import pyarrow.ipc
+import pyarrow.parquet as pq
+
+# tables of the corpus, each a subdirectory of Arrow IPC part files
+CORPUS_TABLES = ("articles", "metadata", "chunks", "embeddings")
+
+# columns of the articles table written by PDFExtractor, other columns hold joined metadata
+ARTICLE_SCHEMA = pa.schema([
+    ("article_id", pa.string()),
+    ("extracted_text", pa.large_string()),
+    ("source_path", pa.string()),
+    ("extractor", pa.string()),
+])
+
+CHUNK_SCHEMA = pa.schema([
+    ("id", pa.string()),
+    ("chunk_id", pa.string()),
+    ("article_id", pa.string()),
+    ("chunk_key", pa.string()),
+    ("content", pa.large_string()),
+    ("start_char", pa.int64()),
+    ("end_char", pa.int64()),
+])
+
+
+def _to_string(value):
+    """
+    Converts a metadata value to a string column value. Missing values become None and nested
+    values (e.g. Zotero creators or tags) are stored as JSON.
+    """
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    if isinstance(value, (dict, list, tuple)):
+        return json.dumps(value)
+    return str(value)
+
+
+def _concat(tables):
+    try:
+        return pa.concat_tables(tables, promote_options="default")
+    except TypeError:  # pyarrow < 14
+        return pa.concat_tables(tables, promote=True)
+
+
+class CorpusStore():
+    """
+    CorpusStore keeps the articles, reference manager metadata, chunks and embeddings of a review
+    as columnar tables. Each table is a directory of Arrow IPC files: appends write a new part file,
+    and tables are loaded memory-mapped, so opening a large corpus does not parse or copy any text.
+    Article rows are joined with the stored metadata by key when they are written, and articles
+    written again (e.g. after re-extraction) supersede the earlier rows with the same article_id.
+
+    CorpusStore can replace the extracted JSON directory of a RapidReviewSession, as it offers the
+    same load and path lookups as ArticleIndex.
+    """
+    def __init__(
+        self,
+        corpus_dir: str,
+        metadata_key: str = "key"
+    ):
+        """
+        Creates (or opens) a CorpusStore instance.
+
+        :param corpus_dir: Directory of the corpus.
+        :param metadata_key: Column joining articles to metadata, e.g. the Zotero item key.
+            If not set, default "key"
+        """
+        self.corpus_dir = corpus_dir
+        self.metadata_key = metadata_key
+        for table in CORPUS_TABLES:
+            os.makedirs(os.path.join(corpus_dir, table), exist_ok=True)
+        # loaded tables and the article_id -> row lookup, dropped on append
+        self._tables = {}
+        self._article_rows = None
+        self._metadata_rows = None
+
+    def _part_paths(self, table):
+        table_dir = os.path.join(self.corpus_dir, table)
+        return sorted(
+            os.path.join(table_dir, name) for name in os.listdir(table_dir) if name.endswith(".arrow"))
+
+    def append(self, table, data):
+        """
+        Appends rows to a table as a new part file.
+
+        :param table: Name of the table, one of CORPUS_TABLES.
+        :param data: Rows as a pyarrow Table, a DataFrame or a list of dictionaries.
+        :return: Number of rows written.
+        """
+        if table not in CORPUS_TABLES:
+            raise ValueError(f"Table must be one of {', '.join(CORPUS_TABLES)}, got '{table}'.")
+        if isinstance(data, pd.DataFrame):
+            data = pa.Table.from_pandas(data, preserve_index=False)
+        elif not isinstance(data, pa.Table):
+            data = pa.Table.from_pylist(list(data))
+        if not data.num_rows:
+            return 0
+        # part names sort in write order, so later rows supersede earlier ones
+        part_path = os.path.join(self.corpus_dir, table, f"part-{time.time_ns():020d}-{uuid.uuid4().hex[:8]}.arrow")
+        with pa.OSFile(part_path + ".partial", "wb") as sink:
+            with pa.ipc.new_file(sink, data.schema) as writer:
+                writer.write_table(data)
+        os.replace(part_path + ".partial", part_path)
+        self._tables.pop(table, None)
+        if table == "articles":
+            self._article_rows = None
+        if table == "metadata":
+            self._metadata_rows = None
+        return data.num_rows
+
+    def load_table(self, table, columns=None):
+        """
+        Loads a table memory-mapped. Only the requested columns are materialized by later reads,
+        e.g. the analysis stage can scan titles without touching article texts.
+
+        :param table: Name of the table, one of CORPUS_TABLES.
+        :param columns: Columns to select.
+            If not set, default None (all columns)
+        :return: pyarrow Table (empty if nothing was written yet).
+        """
+        if table not in self._tables:
+            parts = [
+                pa.ipc.open_file(pa.memory_map(part_path, "r")).read_all()
+                for part_path in self._part_paths(table)
+            ]
+            self._tables[table] = _concat(parts) if parts else pa.table({})
+        loaded = self._tables[table]
+        if columns is not None:
+            loaded = loaded.select([column for column in columns if column in loaded.column_names])
+        return loaded
+
+    def add_metadata(self, items):
+        """
+        Appends reference manager metadata, e.g. the items written by ZoteroAPIMetaExtractor.
+        Nested values are stored as JSON strings.
+
+        :param items: List of metadata dictionaries or a DataFrame, with a metadata_key column.
+        :return: Number of rows written.
+        """
+        records = items.to_dict("records") if isinstance(items, pd.DataFrame) else list(items)
+        columns = list(dict.fromkeys(column for record in records for column in record))
+        return self.append("metadata", pa.table({
+            column: pa.array([_to_string(record.get(column)) for record in records], type=pa.string())
+            for column in columns
+        }))
+
+    def _metadata_by_key(self):
+        if self._metadata_rows is None:
+            metadata = self.load_table("metadata")
+            self._metadata_rows = {}
+            if self.metadata_key in metadata.column_names:
+                # later rows supersede earlier ones
+                self._metadata_rows = {record[self.metadata_key]: record for record in metadata.to_pylist()}
+        return self._metadata_rows
+
+    def add_articles(self, records):
+        """
+        Appends extracted articles. Records whose metadata_key matches stored metadata are joined
+        with it; values in the record take precedence.
+
+        :param records: List of dictionaries with article_id and extracted_text, and optionally
+            source_path, extractor, the metadata_key and other metadata.
+        :return: Number of rows written.
+        """
+        records = list(records)
+        if not records:
+            return 0
+        metadata = self._metadata_by_key()
+        joined = []
+        for record in records:
+            row = dict(metadata.get(record.get(self.metadata_key), {}))
+            row.update({key: value for key, value in record.items() if _to_string(value) is not None})
+            joined.append(row)
+        columns = {field.name: pa.array([row.get(field.name) for row in joined], type=field.type)
+                   for field in ARTICLE_SCHEMA}
+        for column in dict.fromkeys(column for row in joined for column in row):
+            if column not in columns:
+                columns[column] = pa.array([_to_string(row.get(column)) for row in joined], type=pa.string())
+        return self.append("articles", pa.table(columns))
+
+    def add_chunks(self, documents):
+        """
+        Appends chunks, e.g. the Documents produced by RapidReviewSession._chunk_articles.
+
+        :param documents: List of haystack Documents.
+        :return: Number of rows written.
+        """
+        return self.append("chunks", pa.Table.from_pylist([
+            {
+                "id": document.id,
+                "chunk_id": document.meta.get("chunk_id"),
+                "article_id": document.meta.get("article_id"),
+                "chunk_key": document.meta.get("chunk_key"),
+                "content": document.content,
+                "start_char": document.meta.get("start_char"),
+                "end_char": document.meta.get("end_char"),
+            }
+            for document in documents
+        ], schema=CHUNK_SCHEMA))
+
+    def add_embeddings(self, ids, embeddings, model):
+        """
+        Appends embeddings of chunks.
+
+        :param ids: Document ids of the chunks.
+        :param embeddings: 2-D array of embeddings, one row per id.
+        :param model: Name of the embedding model.
+        :return: Number of rows written.
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if not len(embeddings):
+            return 0
+        flat = pa.array(embeddings.reshape(-1), type=pa.float32())
+        return self.append("embeddings", pa.table({
+            "id": pa.array(list(ids), type=pa.string()),
+            "model": pa.array([model] * len(embeddings), type=pa.string()),
+            "embedding": pa.FixedSizeListArray.from_arrays(flat, embeddings.shape[1]),
+        }))
+
+    def load_embeddings(self, model):
+        """
+        Loads the embeddings of a model, later rows superseding earlier ones with the same id.
+
+        :param model: Name of the embedding model.
+        :return: Tuple of the list of ids and the 2-D float32 array of embeddings.
+        """
+        table = self.load_table("embeddings")
+        if not table.num_rows:
+            return [], np.zeros((0, 0), dtype=np.float32)
+        table = table.filter(pa.compute.equal(table["model"], model))
+        ids = table["id"].to_pylist()
+        positions = list({id_: position for position, id_ in enumerate(ids)}.values())
+        embedding = table["embedding"].combine_chunks()
+        vectors = embedding.flatten().to_numpy().reshape(len(ids), embedding.type.list_size)
+        return [ids[position] for position in positions], vectors[positions]
+
+    def _rows(self):
+        if self._article_rows is None:
+            article_ids = self.load_table("articles", columns=["article_id"])
+            self._article_rows = {}
+            if article_ids.num_columns:
+                for row, article_id in enumerate(article_ids["article_id"].to_pylist()):
+                    self._article_rows[article_id] = row
+        return self._article_rows
+
+    # ArticleIndex interface, used by RapidReviewSession
+    def load(self, article_id):
+        """
+        Loads an article by its ID.
+
+        :param article_id: The ID of the article.
+        :return: Dictionary with article_id, extracted_text and the non-missing metadata, or None.
+        """
+        row = self._rows().get(article_id)
+        if row is None:
+            return None
+        record = self.load_table("articles").slice(row, 1).to_pylist()[0]
+        return {key: value for key, value in record.items() if value is not None}
+
+    def path(self, article_id):
+        """
+        Returns the source PDF path of an article, or None if the article is not in the corpus.
+        """
+        row = self._rows().get(article_id)
+        if row is None:
+            return None
+        return self.load_table("articles", columns=["source_path"])["source_path"][row].as_py()
+
+    def __contains__(self, article_id):
+        return article_id in self._rows()
+
+    def __len__(self):
+        return len(self._rows())
+
+    def __iter__(self):
+        return iter(self._rows())
+
+    def to_parquet(self, dest_dir):
+        """
+        Exports each table as a single Parquet file, e.g. for other tools.
+
+        :param dest_dir: Directory where the Parquet files are written.
+        :return: List of written file paths.
+        """
+        os.makedirs(dest_dir, exist_ok=True)
+        paths = []
+        for table in CORPUS_TABLES:
+            loaded = self.load_table(table)
+            if loaded.num_columns:
+                paths.append(os.path.join(dest_dir, f"{table}.parquet"))
+                pq.write_table(loaded, paths[-1])
+        return paths
+
+    def compact(self, table):
+        """
+        Rewrites a table as a single part file, keeping only the latest row of each article
+        (or metadata item) in the articles (or metadata) table.
+
+        :param table: Name of the table, one of CORPUS_TABLES.
+        """
+        old_parts = self._part_paths(table)
+        loaded = self.load_table(table)
+        key = {"articles": "article_id", "metadata": self.metadata_key}.get(table)
+        if key and key in loaded.column_names:
+            latest = {value: row for row, value in enumerate(loaded[key].to_pylist())}
+            loaded = loaded.take(sorted(latest.values()))
+        # memory-mapped parts are released before they are removed
+        self._tables.pop(table, None)
+        self.append(table, loaded)
+        del loaded
+        for part_path in old_parts:
+            os.remove(part_path)
@@ -0,0 +1,192 @@
+"""This module contains the FAISS index specs of the document store, i.e. the compressed and
+approximate index types that trade a bit of recall for memory and search latency on large
+corpora, and the evaluation of these specs against the exact (flat) index.
+"""
+
+import time
+
+import faiss
+import numpy as np
+
+# shorthand index specs, other specs are passed to faiss.index_factory as they are,
+# e.g. "HNSW32", "IVF1024,Flat", "IVF1024,PQ64", "PQ64" or "OPQ64,IVF1024,PQ64"
+INDEX_SPEC_ALIASES = {
+    "exact": "Flat",
+    "float16": "SQfp16",
+    "int8": "SQ8",
+}
+
+# indexes storing their codes in a flat array, IndexFlatCodes is their base class from faiss 1.7.3 on
+SEQUENTIAL_INDEX_TYPES = (
+    (faiss.IndexFlatCodes,) if hasattr(faiss, "IndexFlatCodes")
+    else (faiss.IndexFlat, faiss.IndexPQ, faiss.IndexScalarQuantizer)
+)
+
+
+def resolve_index_spec(index_spec):
+    """
+    Returns the faiss index factory string of an index spec.
+
+    :param index_spec: Alias in INDEX_SPEC_ALIASES or a faiss index factory string.
+    :return: Index factory string.
+    """
+    return INDEX_SPEC_ALIASES.get(index_spec, index_spec)
+
+
+def new_index(index_spec, embedding_dim):
+    """
+    Creates an empty inner product index of an index spec, the way FAISSDocumentStore does.
+
+    :param index_spec: Alias in INDEX_SPEC_ALIASES or a faiss index factory string.
+    :param embedding_dim: The embedding vector size.
+    :return: faiss Index, untrained for IVF and PQ specs.
+    """
+    index_factory = resolve_index_spec(index_spec)
+    if index_factory == "HNSW":
+        # same defaults as FAISSDocumentStore
+        index = faiss.IndexHNSWFlat(embedding_dim, 64, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efSearch = 20
+        index.hnsw.efConstruction = 80
+        return index
+    return faiss.index_factory(embedding_dim, index_factory, faiss.METRIC_INNER_PRODUCT)
+
+
+def prepare_index(index, search_params=None):
+    """
+    Prepares an index for the document store. IVF indexes get a direct map, so stored
+    embeddings can be reconstructed (e.g. to score the chunks of an article exactly), and
+    search parameters such as nprobe or efSearch are applied.
+
+    :param index: faiss Index.
+    :param search_params: Dictionary of faiss search parameters, e.g. {"nprobe": 16}.
+        If not set, default None (faiss defaults)
+    :return: The same index.
+    """
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and ivf.direct_map.type == faiss.DirectMap.NoMap:
+        ivf.make_direct_map()
+    if search_params:
+        parameter_space = faiss.ParameterSpace()
+        for name, value in search_params.items():
+            parameter_space.set_index_parameter(index, name, value)
+    return index
+
+
+def is_sequential(index):
+    """
+    Whether vector ids of the index are positions in a flat array of codes (Flat, PQ and SQ
+    indexes). Removing vectors from these indexes shifts the following ones, while other indexes
+    (IVF, HNSW) either keep the removed ids or cannot remove vectors at all.
+    """
+    return isinstance(index, SEQUENTIAL_INDEX_TYPES)
+
+
+def index_memory(index):
+    """
+    Returns the size of an index in bytes, measured as its serialized size. This covers the
+    stored codes, the trained quantizers and graph links, which dominate the index RAM.
+    """
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def sample_rows(n_rows, sample_size, seed=0):
+    """
+    Returns sorted row positions of a uniform sample without replacement.
+
+    :param n_rows: Number of rows to sample from.
+    :param sample_size: Number of rows to sample, all rows if None or larger than n_rows.
+    :param seed: Seed of the sample.
+        If not set, default 0
+    :return: 1-D array of row positions.
+    """
+    if sample_size is None or sample_size >= n_rows:
+        return np.arange(n_rows)
+    return np.sort(np.random.default_rng(seed).choice(n_rows, sample_size, replace=False))
+
+
+def train_index(index, embeddings, train_size=None, seed=0):
+    """
+    Trains an index on a sample of embeddings, if it needs training.
+
+    :param index: faiss Index.
+    :param embeddings: 2-D float32 array of embeddings.
+    :param train_size: Number of embeddings sampled for training.
+        If not set, default None (all embeddings)
+    :param seed: Seed of the training sample.
+        If not set, default 0
+    :return: Number of embeddings the index was trained on (0 if it needed no training).
+    """
+    if index.is_trained:
+        return 0
+    sample = np.ascontiguousarray(embeddings[sample_rows(len(embeddings), train_size, seed)], dtype=np.float32)
+    try:
+        index.train(sample)
+    except RuntimeError as error:
+        # e.g. fewer training vectors than IVF lists or PQ centroids
+        raise ValueError(
+            f"Could not train the index on {len(sample)} embeddings. Index more chunks at once "
+            "(e.g. with run_batch) or use an index spec with fewer lists or centroids."
+        ) from error
+    return len(sample)
+
+
+def evaluate_index_specs(
+    embeddings,
+    query_embeddings,
+    index_specs,
+    k: int = 10,
+    train_size: int = None,
+    search_params: dict = None,
+    seed: int = 0
+):
+    """
+    Builds an index of each spec over the embeddings and compares it with the exact inner product
+    search: memory footprint, build time, search latency and recall@k, i.e. the share of the
+    exact top k found in the approximate top k.
+
+    :param embeddings: 2-D float32 array of chunk embeddings.
+    :param query_embeddings: 2-D float32 array of query embeddings.
+    :param index_specs: List of index specs, see resolve_index_spec.
+    :param k: Number of neighbours compared.
+        If not set, default 10
+    :param train_size: Number of embeddings sampled to train IVF and PQ indexes.
+        If not set, default None (all embeddings)
+    :param search_params: Dictionary of search parameters per index spec, e.g.
+        {"IVF1024,PQ64": {"nprobe": 16}}.
+        If not set, default None (faiss defaults)
+    :param seed: Seed of the training sample.
+        If not set, default 0
+    :return: List of dictionaries, one per index spec, the exact index first.
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    query_embeddings = np.ascontiguousarray(query_embeddings, dtype=np.float32)
+    k = min(k, len(embeddings))
+    search_params = search_params or {}
+
+    results = []
+    exact_neighbours = None
+    for index_spec in ["Flat"] + [spec for spec in index_specs if resolve_index_spec(spec) != "Flat"]:
+        start = time.perf_counter()
+        index = prepare_index(new_index(index_spec, embeddings.shape[1]), search_params.get(index_spec))
+        n_train = train_index(index, embeddings, train_size, seed)
+        index.add(embeddings)
+        build_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        _, neighbours = index.search(query_embeddings, k)
+        search_seconds = time.perf_counter() - start
+        if exact_neighbours is None:
+            exact_neighbours = neighbours
+        recall = np.mean([
+            len(set(found) & set(exact)) / k for found, exact in zip(neighbours, exact_neighbours)
+        ])
+        results.append({
+            "index_spec": index_spec,
+            "memory_bytes": index_memory(index),
+            "bytes_per_vector": index_memory(index) / len(embeddings),
+            "train_size": n_train,
+            "build_seconds": build_seconds,
+            "query_ms": 1000 * search_seconds / len(query_embeddings),
+            f"recall@{k}": float(recall),
+        })
+    return results
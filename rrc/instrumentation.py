@@ -0,0 +1,296 @@
+"""This module contains the timing and profiling instrumentation shared by the rrc modules.
+
+Tracing is off by default, in which case spans cost a single attribute check. Once enabled,
+every span records its name, start, duration and attributes, and counters keep running totals
+of documents, pages, chunks and tokens. Spans can be exported as a JSON trace (viewable in
+chrome://tracing or Perfetto) or streamed to callbacks.
+"""
+
+import cProfile
+from contextlib import contextmanager, nullcontext
+import functools
+import json
+import os
+import pstats
+import threading
+import time
+from collections import defaultdict
+
+
+class Tracer():
+    """
+    Tracer collects timed spans and counters. Spans are nested per thread, so each span knows
+    its parent. Optionally, the functions decorated with profiled are run under cProfile.
+    """
+    def __init__(
+        self,
+        enabled: bool = True,
+        profile: bool = False,
+        profile_dir: str = None
+    ):
+        """
+        Creates a Tracer instance.
+
+        :param enabled: Whether spans and counters are recorded.
+            If not set, default True
+        :param profile: Whether to run the functions decorated with profiled (run_query,
+            mass_extract) under cProfile.
+            If not set, default False
+        :param profile_dir: Directory where the cProfile stats are dumped as .prof files.
+            If not set, default None (stats are only kept in memory, see profiles)
+        """
+        self.enabled = enabled
+        self.profile = profile
+        self.profile_dir = profile_dir
+        self.spans = []
+        self.counters = defaultdict(int)
+        self.callbacks = []
+        # name -> list of pstats.Stats, one per profiled call
+        self.profiles = defaultdict(list)
+        self._local = threading.local()
+        self._origin = time.perf_counter()
+
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def _emit(self, span):
+        self.spans.append(span)
+        for callback in self.callbacks:
+            callback(span)
+
+    @contextmanager
+    def _span(self, name, attributes):
+        stack = self._stack()
+        span = {
+            "name": name,
+            "parent": stack[-1]["name"] if stack else None,
+            "start": time.perf_counter() - self._origin,
+            "thread": threading.get_ident(),
+            "pid": os.getpid(),
+            "attributes": attributes
+        }
+        stack.append(span)
+        try:
+            yield span
+        finally:
+            stack.pop()
+            span["seconds"] = time.perf_counter() - self._origin - span["start"]
+            self._emit(span)
+
+    def span(self, name, **attributes):
+        """
+        Returns a context manager timing the enclosed block as a span.
+
+        :param name: Name of the span, e.g. "extract.page".
+        :param attributes: Attributes recorded with the span, e.g. page=3.
+        :return: Context manager yielding the span dictionary (or None when disabled), to which
+            attributes may be added while the block runs.
+        """
+        if not self.enabled:
+            return nullcontext()
+        return self._span(name, attributes)
+
+    def record(self, name, seconds, **attributes):
+        """
+        Records a span that was timed elsewhere, e.g. in a worker process.
+
+        :param name: Name of the span.
+        :param seconds: Duration of the span.
+        :param attributes: Attributes recorded with the span.
+        """
+        if not self.enabled:
+            return
+        stack = self._stack()
+        self._emit({
+            "name": name,
+            "parent": stack[-1]["name"] if stack else None,
+            "start": time.perf_counter() - self._origin - seconds,
+            "thread": threading.get_ident(),
+            "pid": os.getpid(),
+            "attributes": attributes,
+            "seconds": seconds
+        })
+
+    def count(self, name, value=1):
+        """
+        Adds value to the counter name, e.g. count("chunks", 12).
+        """
+        if self.enabled:
+            self.counters[name] += value
+
+    def add_callback(self, callback):
+        """
+        Registers a callable that receives every span dictionary as soon as the span ends.
+        """
+        self.callbacks.append(callback)
+
+    @contextmanager
+    def profiling(self, name):
+        """
+        Runs the enclosed block under cProfile if profile is set. The stats are kept in
+        profiles[name] and dumped to profile_dir if set.
+
+        :param name: Name of the profiled block, e.g. "run_query".
+        """
+        # nested profiled calls are covered by the outer profile
+        if not (self.enabled and self.profile) or getattr(self._local, "profiling", False):
+            yield
+            return
+        profiler = cProfile.Profile()
+        self._local.profiling = True
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            self._local.profiling = False
+            stats = pstats.Stats(profiler)
+            self.profiles[name].append(stats)
+            if self.profile_dir:
+                os.makedirs(self.profile_dir, exist_ok=True)
+                stats.dump_stats(os.path.join(
+                    self.profile_dir, f"{name}_{len(self.profiles[name])}.prof"))
+
+    def summary(self):
+        """
+        Returns the number of calls and the total, mean and max seconds of each span name,
+        along with the counters.
+
+        :return: Dictionary with "spans" (per span name) and "counters".
+        """
+        spans = {}
+        for span in self.spans:
+            stats = spans.setdefault(span["name"], {"calls": 0, "seconds": 0.0, "max_seconds": 0.0})
+            stats["calls"] += 1
+            stats["seconds"] += span["seconds"]
+            stats["max_seconds"] = max(stats["max_seconds"], span["seconds"])
+        for stats in spans.values():
+            stats["mean_seconds"] = stats["seconds"] / stats["calls"]
+        return {"spans": spans, "counters": dict(self.counters)}
+
+    def export_json(self, path):
+        """
+        Writes the spans as a JSON trace in the Trace Event Format, with the counters and the
+        summary in its metadata.
+
+        :param path: Path of the JSON trace.
+        """
+        events = [
+            {
+                "name": span["name"],
+                "ph": "X",
+                "ts": span["start"] * 1e6,
+                "dur": span["seconds"] * 1e6,
+                "pid": span["pid"],
+                "tid": span["thread"],
+                "args": {key: _jsonable(value) for key, value in span["attributes"].items()}
+            }
+            for span in self.spans
+        ]
+        with open(path, "w") as file:
+            json.dump({"traceEvents": events, "metadata": self.summary()}, file, indent=4)
+
+    def reset(self):
+        """
+        Drops the recorded spans, counters and profiles.
+        """
+        self.spans.clear()
+        self.counters.clear()
+        self.profiles.clear()
+
+
+def _jsonable(value):
+    return value if isinstance(value, (str, int, float, bool, type(None))) else str(value)
+
+
+# the tracer used by the rrc modules, disabled until enable_tracing is called
+_tracer = Tracer(enabled=False)
+
+
+def get_tracer():
+    """
+    Returns the tracer currently used by the rrc modules.
+    """
+    return _tracer
+
+
+def set_tracer(tracer):
+    """
+    Replaces the tracer used by the rrc modules.
+
+    :param tracer: Tracer instance.
+    :return: The previous tracer.
+    """
+    global _tracer
+    previous, _tracer = _tracer, tracer
+    return previous
+
+
+def enable_tracing(profile=False, profile_dir=None, callback=None):
+    """
+    Starts recording spans and counters with a new tracer.
+
+    :param profile: Whether to run run_query and mass_extract under cProfile.
+        If not set, default False
+    :param profile_dir: Directory where the cProfile stats are dumped.
+        If not set, default None
+    :param callback: Callable receiving every span as soon as it ends.
+        If not set, default None
+    :return: The new Tracer.
+    """
+    tracer = Tracer(profile=profile, profile_dir=profile_dir)
+    if callback is not None:
+        tracer.add_callback(callback)
+    set_tracer(tracer)
+    return tracer
+
+
+def disable_tracing():
+    """
+    Stops recording, restoring a disabled tracer.
+
+    :return: The tracer that was recording.
+    """
+    return set_tracer(Tracer(enabled=False))
+
+
+def span(name, **attributes):
+    """
+    Times the enclosed block with the current tracer. See Tracer.span.
+    """
+    return _tracer.span(name, **attributes)
+
+
+def record(name, seconds, **attributes):
+    """
+    Records a span timed elsewhere with the current tracer. See Tracer.record.
+    """
+    _tracer.record(name, seconds, **attributes)
+
+
+def count(name, value=1):
+    """
+    Adds value to a counter of the current tracer. See Tracer.count.
+    """
+    _tracer.count(name, value)
+
+
+def profiled(name):
+    """
+    Decorator timing each call as a span, and running it under cProfile when the current
+    tracer has profile set.
+
+    :param name: Name of the span and of the profile, e.g. "run_query".
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            tracer = _tracer
+            if not tracer.enabled:
+                return function(*args, **kwargs)
+            with tracer.span(name), tracer.profiling(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
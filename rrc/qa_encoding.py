@@ -1,4 +1,295 @@
 """This module contains the scripts used for encoding question-answer pairs.
 Questions are inputs specified by the user, while answers are generated from
 a corpus of text extracted from PDFs or reference manager metadata (e.g., title and abstracts).
-"""
\ No newline at end of file
+
+QAEncoder runs every (question, article) task of a review through a RapidReviewSession and
+streams the answers to an append-only JSONL file or a directory of Parquet files. Finished
+tasks are read back from the output, so a run that stops (or crashes) can be resumed without
+redoing them.
+"""
+
+import hashlib
+import json
+import os
+import time
+import uuid
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from tqdm import tqdm
+
+from rrc import instrumentation
+
+OUTPUT_FORMATS = ("jsonl", "parquet")
+
+# columns of the encoded question-answer pairs
+RESULT_COLUMNS = ("task_id", "question", "article_id", "answer", "chunk_ids", "scores", "encoded_at")
+
+# Parquet parts are written with this schema, so a part whose values are all empty or missing
+# (e.g. no chunk retrieved) does not infer a null type that other parts cannot be concatenated with
+RESULT_SCHEMA = pa.schema([
+    ("task_id", pa.string()),
+    ("question", pa.string()),
+    ("article_id", pa.string()),
+    ("answer", pa.string()),
+    ("chunk_ids", pa.list_(pa.string())),
+    ("scores", pa.list_(pa.float64())),
+    ("encoded_at", pa.string()),
+])
+
+
+def task_id(prompt, question, article_id):
+    """
+    Returns the id of a (question, article) task. The prompt is part of the id, so changing it
+    starts the affected tasks over.
+    """
+    return hashlib.sha256(f"{prompt}|{question}|{article_id}".encode("utf-8")).hexdigest()[:32]
+
+
+def load_results(output_path, output_format=None):
+    """
+    Loads the question-answer pairs encoded so far. A JSONL line cut short by a crash is skipped.
+
+    :param output_path: JSONL file or Parquet directory written by QAEncoder.
+    :param output_format: "jsonl" or "parquet".
+        If not set, default None (inferred from output_path)
+    :return: DataFrame with one row per encoded pair.
+    """
+    output_format = output_format or _infer_format(output_path)
+    if not os.path.exists(output_path):
+        return pd.DataFrame(columns=list(RESULT_COLUMNS))
+    if output_format == "parquet":
+        parts = _parquet_parts(output_path)
+        if not parts:
+            return pd.DataFrame(columns=list(RESULT_COLUMNS))
+        # parts written before RESULT_SCHEMA may hold null-typed columns, which are cast
+        return pa.concat_tables([
+            pq.read_table(part, columns=list(RESULT_COLUMNS)).cast(RESULT_SCHEMA) for part in parts
+        ]).to_pandas()
+    records = []
+    with open(output_path, encoding="utf-8") as file:
+        for line in file:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return pd.DataFrame(records, columns=list(RESULT_COLUMNS))
+
+
+def _infer_format(output_path):
+    return "jsonl" if output_path.endswith((".jsonl", ".json")) else "parquet"
+
+
+def _parquet_parts(output_dir):
+    if not os.path.isdir(output_dir):
+        return []
+    return sorted(
+        os.path.join(output_dir, name) for name in os.listdir(output_dir) if name.endswith(".parquet"))
+
+
+class QAEncoder():
+    """
+    QAEncoder encodes question-answer pairs over a corpus. Every (question, article) pair is a
+    task; pending tasks are answered with RapidReviewSession.run_batch, all pending questions of a
+    block of articles at a time, and each answer is appended to the output as soon as it is generated.
+    Chunks are sized for the longest question of the run, so the corpus is chunked and embedded once.
+    The output is made durable at every checkpoint, and a checkpoint file reports progress,
+    throughput and the estimated time left.
+    """
+    def __init__(
+        self,
+        session,
+        output_path: str,
+        output_format: str = None,
+        checkpoint_every: int = 50
+    ):
+        """
+        Creates a QAEncoder instance.
+
+        :param session: RapidReviewSession answering the questions.
+        :param output_path: JSONL file (e.g. "answers.jsonl") or directory of Parquet files.
+        :param output_format: "jsonl" or "parquet".
+            If not set, default None (inferred from output_path: .jsonl or .json files are JSONL)
+        :param checkpoint_every: The number of answers between checkpoints. JSONL answers are written
+            immediately and synced to disk at checkpoints, Parquet answers are written as one part per checkpoint.
+            If not set, default 50
+        """
+        self.session = session
+        self.output_path = output_path
+        self.output_format = output_format or _infer_format(output_path)
+        if self.output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Output format must be one of {', '.join(OUTPUT_FORMATS)}, got '{self.output_format}'.")
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint_path = output_path.rstrip("/\\") + ".checkpoint.json"
+        self.progress = {}
+        self.missing_articles = []
+        self._file = None
+        self._buffer = []
+
+    def completed(self):
+        """
+        Returns the ids of the tasks already encoded in the output.
+        """
+        if self.output_format == "parquet":
+            return {
+                task for part in _parquet_parts(self.output_path)
+                for task in pq.read_table(part, columns=["task_id"])["task_id"].to_pylist()
+            }
+        return set(load_results(self.output_path, "jsonl")["task_id"])
+
+    def _open(self):
+        if self.output_format == "parquet":
+            os.makedirs(self.output_path, exist_ok=True)
+            return
+        directory = os.path.dirname(os.path.abspath(self.output_path))
+        os.makedirs(directory, exist_ok=True)
+        self._file = open(self.output_path, "a+b")
+        # a line cut short by a crash is dropped, so the next answer starts on its own line;
+        # the file is read backwards from its end up to the last newline
+        size = self._file.seek(0, os.SEEK_END)
+        end = size
+        while end > 0:
+            block_start = max(end - (1 << 16), 0)
+            self._file.seek(block_start)
+            newline = self._file.read(end - block_start).rfind(b"\n")
+            if newline >= 0:
+                end = block_start + newline + 1
+                break
+            end = block_start
+        if end < size:
+            self._file.truncate(end)
+        self._file.seek(0, os.SEEK_END)
+
+    def _append(self, record):
+        if self.output_format == "parquet":
+            self._buffer.append(record)
+            return
+        self._file.write((json.dumps(record) + "\n").encode("utf-8"))
+
+    def _checkpoint(self, done, total, start, completed_before):
+        if self.output_format == "parquet":
+            if self._buffer:
+                part_path = os.path.join(
+                    self.output_path, f"part-{time.time_ns():020d}-{uuid.uuid4().hex[:8]}.parquet")
+                pq.write_table(pa.Table.from_pylist(self._buffer, schema=RESULT_SCHEMA), part_path + ".partial")
+                os.replace(part_path + ".partial", part_path)
+                self._buffer = []
+        elif self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        seconds = time.perf_counter() - start
+        tasks_per_second = done / seconds if seconds else 0.0
+        self.progress = {
+            "tasks": total,
+            "completed": completed_before + done,
+            "completed_this_run": done,
+            "seconds": seconds,
+            "tasks_per_second": tasks_per_second,
+            "eta_seconds": (total - completed_before - done) / tasks_per_second if tasks_per_second else None,
+            "missing_articles": len(self.missing_articles),
+            "updated_at": time.strftime("%Y-%m-%dT%H:%M:%S")
+        }
+        with open(self.checkpoint_path + ".partial", "w") as file:
+            json.dump(self.progress, file, indent=4)
+        os.replace(self.checkpoint_path + ".partial", self.checkpoint_path)
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def run(
+        self,
+        prompt: str,
+        questions,
+        article_ids=None,
+        top_k: int = 3,
+        batch_size: int = 8,
+        article_block_size: int = 64
+    ):
+        """
+        Encodes every pending (question, article) pair. Answers are appended to the output as they
+        are generated; tasks found in the output are skipped, so calling run again after an
+        interruption resumes where it stopped.
+
+        :param prompt: Prompt passed to RapidReviewSession.run_batch.
+        :param questions: List of questions.
+        :param article_ids: Ids of the articles to ask about. Articles missing from the session's corpus 
+            or source directory are skipped (see missing_articles) and left pending for a later run.
+            If not set, default None (all articles of the session's corpus or source directory)
+        :param top_k: Number of chunks retrieved per (question, article) pair.
+            If not set, default 3
+        :param batch_size: Number of pairs per retrieval and generator batch.
+            If not set, default 8
+        :param article_block_size: The number of articles answered before moving to the next block.
+            If not set, default 64
+        :return: Dictionary of progress: tasks, completed, tasks_per_second, eta_seconds and missing_articles.
+        """
+        if isinstance(questions, str):
+            questions = [questions]
+        article_ids = list(self.session.article_index) if article_ids is None else list(article_ids)
+        # articles that cannot be loaded would be answered without any context and marked complete
+        self.missing_articles = [
+            article_id for article_id in article_ids if article_id not in self.session.article_index]
+        if self.missing_articles:
+            print(
+                f"Skipping {len(self.missing_articles)} articles missing from the corpus, "
+                f"e.g. {', '.join(map(str, self.missing_articles[:5]))}")
+            missing = set(self.missing_articles)
+            article_ids = [article_id for article_id in article_ids if article_id not in missing]
+        completed = self.completed()
+        total = len(questions) * len(article_ids)
+        # work queue of pending questions per article
+        pending = {
+            article_id: tuple(
+                question for question in questions
+                if task_id(prompt, question, article_id) not in completed
+            )
+            for article_id in article_ids
+        }
+        n_pending = sum(len(pending_questions) for pending_questions in pending.values())
+        completed_before = total - n_pending
+
+        self._open()
+        start = time.perf_counter()
+        done = 0
+        try:
+            with tqdm(total=total, initial=completed_before, unit="pair", desc="Encoding") as progress_bar:
+                for block_start in range(0, len(article_ids), article_block_size):
+                    # articles of the block with the same pending questions are answered together,
+                    # after a resume usually all but the block the run stopped in are complete
+                    groups = {}
+                    for article_id in article_ids[block_start: block_start + article_block_size]:
+                        if pending[article_id]:
+                            groups.setdefault(pending[article_id], []).append(article_id)
+                    for group_questions, group_article_ids in groups.items():
+                        for result in self.session.run_batch(
+                                prompt, list(group_questions), group_article_ids, top_k=top_k,
+                                batch_size=batch_size, stream=True, chunk_queries=questions):
+                            self._append({
+                                "task_id": task_id(prompt, result["query"], result["article_id"]),
+                                "question": result["query"],
+                                "article_id": result["article_id"],
+                                "answer": result["answer"],
+                                "chunk_ids": result["chunk_ids"],
+                                "scores": [float(score) for score in result["scores"]],
+                                "encoded_at": time.strftime("%Y-%m-%dT%H:%M:%S")
+                            })
+                            done += 1
+                            progress_bar.update(1)
+                            instrumentation.count("encoded_pairs")
+                            if done % self.checkpoint_every == 0:
+                                self._checkpoint(done, total, start, completed_before)
+                                progress_bar.set_postfix(eta=f"{self.progress['eta_seconds'] or 0:.0f}s")
+        finally:
+            # everything generated so far is kept, also when the run is interrupted
+            self._checkpoint(done, total, start, completed_before)
+            self._close()
+        return self.progress
+
+    def results(self):
+        """
+        Returns the question-answer pairs encoded so far, see load_results.
+        """
+        return load_results(self.output_path, self.output_format)
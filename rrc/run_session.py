@@ -5,23 +5,544 @@
 ## 4. Demo a session in the tutorials notebook (NOTE: PDF extractor output json keys must be consistent with article_id and extracted_text keys, current: "article id" and "extracted id")
 
 from tqdm import tqdm
-from glob import glob
 import os
-from typing import Optional
+from typing import Optional, List
 
+import copy
+import hashlib
 import json
+import time
+import numpy as np
+import pandas as pd
 
 # for review
 from transformers import AutoTokenizer
 from haystack.pipelines import Pipeline
 from haystack.nodes import  PromptNode, PromptTemplate, AnswerParser
-from haystack.schema import Document
+from haystack.schema import Answer, Document
+
+import torch
 
 # document store
+import faiss
 from haystack.document_stores import FAISSDocumentStore
+from haystack.document_stores.sql import DocumentORM, MetaDocumentORM
+from haystack.document_stores.filter_utils import LogicalFilterClause
 
 # retriever
 from haystack.nodes import DensePassageRetriever
+from haystack.modeling.data_handler.dataloader import NamedDataLoader
+from torch.utils.data import SequentialSampler
+
+# extracted articles
+from rrc.text_extraction import ArticleIndex
+from rrc.corpus import CorpusStore
+
+# timing and profiling
+from rrc import instrumentation
+
+# session caches
+from rrc.caching import TokenCache, ModelCache, AnswerCache
+from rrc.chunking import TokenChunker
+
+# compressed and approximate index specs
+from rrc import indexing
+
+class FilteredFAISSDocumentStore(FAISSDocumentStore):
+    """
+    FAISSDocumentStore that applies metadata filters at query time. The stock FAISSDocumentStore 
+    ignores query filters, which only works while the store holds the chunks of a single article. 
+    With a persistent store holding many articles, the chunks matching the filters (e.g., one 
+    article_id) are scored exactly against the query embedding instead.
+    """
+
+    def __init__(
+        self,
+        sql_url: str = "sqlite:///faiss_document_store.db",
+        embedding_dim: int = 768,
+        faiss_index_factory_str: str = "Flat",
+        faiss_index=None,
+        similarity: str = "dot_product",
+        validate_index_sync: bool = True,
+        index_search_params: dict = None
+    ):
+        """
+        Creates a FilteredFAISSDocumentStore instance. Parameters are passed to FAISSDocumentStore;
+        declaring them here lets save() record them for load().
+
+        :param sql_url: SQL connection URL for the database storing chunk texts and metadata.
+        :param embedding_dim: The embedding vector size.
+        :param faiss_index_factory_str: FAISS index type to create, an alias in 
+            indexing.INDEX_SPEC_ALIASES (e.g. "float16") or a faiss index factory string.
+        :param faiss_index: A pre-existing FAISS index, e.g. loaded from disk.
+        :param similarity: Similarity function used to compare embeddings.
+        :param validate_index_sync: Checks if the document count equals the embedding count.
+        :param index_search_params: Dictionary of faiss search parameters, e.g. {"nprobe": 16} for IVF 
+            or {"efSearch": 64} for HNSW indexes.
+        """
+        # read by _create_new_index during FAISSDocumentStore.__init__
+        self.index_search_params = index_search_params
+        super().__init__(
+            sql_url=sql_url,
+            embedding_dim=embedding_dim,
+            faiss_index_factory_str=faiss_index_factory_str,
+            faiss_index=faiss_index,
+            similarity=similarity,
+            validate_index_sync=validate_index_sync)
+        for faiss_index in self.faiss_indexes.values():
+            indexing.prepare_index(faiss_index, index_search_params)
+
+    def _create_new_index(self, embedding_dim, metric_type, index_factory="Flat", **kwargs):
+        index = super()._create_new_index(
+            embedding_dim, metric_type, index_factory=indexing.resolve_index_spec(index_factory), **kwargs)
+        return indexing.prepare_index(index, self.index_search_params)
+
+    def set_search_params(self, search_params, index=None):
+        """
+        Applies faiss search parameters, e.g. {"nprobe": 16}, to the FAISS index.
+
+        :param search_params: Dictionary of faiss search parameters.
+        :param index: Index name. If None, the default index is used.
+        """
+        self.index_search_params = search_params
+        indexing.prepare_index(self.faiss_indexes[index or self.index], search_params)
+
+    @classmethod
+    def load(cls, index_path, config_path):
+        """
+        Load a saved FAISS index and its configuration, and connect to the SQL database.
+
+        :param index_path: The stored FAISS index file.
+        :param config_path: The stored configuration file.
+        :return: FilteredFAISSDocumentStore instance.
+        """
+        with open(config_path, 'r') as file:
+            init_params = json.load(file)
+        faiss_index = faiss.read_index(str(index_path))
+        init_params["faiss_index"] = faiss_index
+        init_params["embedding_dim"] = faiss_index.d
+        return cls(**init_params)
+
+    def delete_documents(self, index=None, ids=None, filters=None, headers=None):
+        """
+        Delete documents from the document store, as FAISSDocumentStore does, and renumber the 
+        vector ids of the remaining documents. A flat FAISS index shifts the vectors following 
+        a removed one, while FAISSDocumentStore keeps the stored vector ids, so embeddings added 
+        afterwards would collide with the ids of existing documents. IVF and HNSW indexes, 
+        which keep the removed ids or cannot remove vectors at all, are rebuilt from the 
+        remaining vectors instead.
+
+        :param index: Index name to delete the documents from.
+        :param ids: Optional list of IDs to narrow down the documents to be deleted.
+        :param filters: Optional filters to narrow down the documents to be deleted.
+        :param headers: Not supported by FAISS.
+        :return: None
+        """
+        index = index or self.index
+        faiss_index = self.faiss_indexes.get(index)
+        if not (ids or filters) or faiss_index is None:
+            super().delete_documents(index=index, ids=ids, filters=filters, headers=headers)
+            return
+        if indexing.is_sequential(faiss_index) or not faiss_index.ntotal:
+            super().delete_documents(index=index, ids=ids, filters=filters, headers=headers)
+        else:
+            vectors = faiss_index.reconstruct_n(0, faiss_index.ntotal)
+            # skips the FAISS removal, only the SQL rows are deleted
+            super(FAISSDocumentStore, self).delete_documents(index=index, ids=ids, filters=filters, headers=headers)
+        rows = self.session.query(DocumentORM.id, DocumentORM.vector_id).filter(
+            DocumentORM.index == index, DocumentORM.vector_id.isnot(None)).all()
+        rows.sort(key=lambda row: int(row.vector_id))
+        if not indexing.is_sequential(faiss_index) and faiss_index.ntotal != len(rows):
+            # the trained quantizers are kept, the remaining vectors are added again in vector id order
+            faiss_index.reset()
+            if rows:
+                faiss_index.add(vectors[[int(row.vector_id) for row in rows]])
+        vector_id_map = {
+            row.id: str(vector_id) for vector_id, row in enumerate(rows) 
+            if int(row.vector_id) != vector_id
+        }
+        if vector_id_map:
+            # vector ids are unique per index, so the shifted ones are cleared before being reassigned
+            self.update_vector_ids({document_id: None for document_id in vector_id_map}, index=index)
+            self.update_vector_ids(vector_id_map, index=index)
+
+    def query_by_embedding(
+        self,
+        query_emb,
+        filters=None,
+        top_k=10,
+        index=None,
+        return_embedding=None,
+        headers=None,
+        scale_score=True
+    ):
+        """
+        Find the documents matching the filters that are most similar to the query embedding.
+
+        :param query_emb: Embedding of the query (e.g. gathered from DPR).
+        :param filters: Metadata filters narrowing down the documents to score.
+        :param top_k: How many documents to return.
+        :param index: Index name to query the documents from.
+        :param return_embedding: To return document embedding.
+        :param headers: Not supported by FAISS.
+        :param scale_score: Whether to scale the similarity score to the unit interval.
+        :return: List of Documents sorted by score.
+        """
+        if not filters:
+            return super().query_by_embedding(
+                query_emb, filters=filters, top_k=top_k, index=index,
+                return_embedding=return_embedding, headers=headers, scale_score=scale_score)
+        return self.query_by_embedding_batch(
+            [query_emb], filters=filters, top_k=top_k, index=index,
+            return_embedding=return_embedding, headers=headers, scale_score=scale_score)[0]
+
+    def query_by_embedding_batch(
+        self,
+        query_embs,
+        filters=None,
+        top_k=10,
+        index=None,
+        return_embedding=None,
+        headers=None,
+        scale_score=True
+    ):
+        """
+        Find the most similar documents for each query embedding. Queries sharing the same 
+        filters are scored together against the matching chunks in a single matrix product, 
+        so the chunks of an article are fetched once for all questions asked about it.
+
+        :param query_embs: Embeddings of the queries (e.g. gathered from DPR).
+        :param filters: A single filter applied to each query or a list of filters (one per query).
+        :param top_k: How many documents to return per query.
+        :param index: Index name to query the documents from.
+        :param return_embedding: To return document embedding.
+        :param headers: Not supported by FAISS.
+        :param scale_score: Whether to scale the similarity score to the unit interval.
+        :return: List of Documents sorted by score, one list per query.
+        """
+        if not isinstance(filters, list):
+            filters = [filters] * len(query_embs)
+        if len(filters) != len(query_embs):
+            raise ValueError("Number of filters does not match number of query_embs.")
+        if return_embedding is None:
+            return_embedding = self.return_embedding
+
+        # group queries by identical filters
+        groups = {}
+        for position, query_filters in enumerate(filters):
+            key = json.dumps(query_filters, sort_keys=True, default=str)
+            groups.setdefault(key, []).append(position)
+
+        results = [[] for _ in query_embs]
+        for positions in groups.values():
+            query_filters = filters[positions[0]]
+            if not query_filters:
+                for position in positions:
+                    results[position] = super().query_by_embedding(
+                        query_embs[position], top_k=top_k, index=index,
+                        return_embedding=return_embedding, headers=headers, scale_score=scale_score)
+                continue
+
+            candidates = [
+                document for document in self.get_all_documents(
+                    index=index, filters=query_filters, return_embedding=True, headers=headers)
+                if document.embedding is not None
+            ]
+            if not candidates:
+                continue
+            embeddings = np.array([document.embedding for document in candidates], dtype=np.float32)
+            queries = np.array(
+                [np.asarray(query_embs[position]).ravel() for position in positions], dtype=np.float32)
+            if self.similarity == "cosine":
+                self.normalize_embedding(queries)
+            scores = queries @ embeddings.T
+
+            for row, position in enumerate(positions):
+                documents = []
+                for candidate in np.argsort(-scores[row])[:top_k]:
+                    document = copy.copy(candidates[candidate])
+                    score = float(scores[row, candidate])
+                    if scale_score:
+                        score = self.scale_to_unit_interval(score, self.similarity)
+                    document.score = score
+                    if not return_embedding:
+                        document.embedding = None
+                    documents.append(document)
+                results[position] = documents
+        return results
+
+
+    def query_by_embedding_grouped(
+        self,
+        query_embs,
+        group_by="article_id",
+        filters=None,
+        top_k=3,
+        index=None,
+        scale_score=True
+    ):
+        """
+        Find the top_k documents of every group (e.g. every article) for each query embedding in 
+        one pass. The stored vectors matching the filters are scored against all queries in a 
+        single matrix product, and the documents are ranked within their group by sorting the 
+        scores by group and score, so the cost does not grow with one search per group. Only the 
+        selected documents are loaded from the database.
+
+        :param query_embs: Embeddings of the queries (e.g. gathered from DPR).
+        :param group_by: Metadata field grouping the documents.
+            If not set, default "article_id"
+        :param filters: Metadata filters narrowing down the documents to score, e.g. {"chunk_key": [...]}.
+        :param top_k: How many documents to return per query and group.
+        :param index: Index name to query the documents from.
+        :param scale_score: Whether to scale the similarity score to the unit interval.
+        :return: List of dictionaries mapping each group value to its Documents sorted by score, 
+            one dictionary per query.
+        """
+        index = index or self.index
+        rows = self.session.query(DocumentORM.id, DocumentORM.vector_id, MetaDocumentORM.value).join(
+            MetaDocumentORM,
+            (MetaDocumentORM.document_id == DocumentORM.id) & (MetaDocumentORM.document_index == DocumentORM.index)
+        ).filter(
+            DocumentORM.index == index, DocumentORM.vector_id.isnot(None), MetaDocumentORM.name == group_by)
+        if filters:
+            rows = rows.filter(DocumentORM.id.in_(LogicalFilterClause.parse(filters).convert_to_sql(MetaDocumentORM)))
+        rows = rows.all()
+        if not rows:
+            return [{} for _ in query_embs]
+
+        faiss_index = self.faiss_indexes[index]
+        vector_ids = np.array([int(row.vector_id) for row in rows], dtype=np.int64)
+        if hasattr(faiss_index, "reconstruct_batch"):
+            embeddings = faiss_index.reconstruct_batch(vector_ids)
+        else:
+            embeddings = faiss_index.reconstruct_n(0, faiss_index.ntotal)[vector_ids]
+        group_values, codes = np.unique(np.array([str(row.value) for row in rows]), return_inverse=True)
+        queries = np.array([np.asarray(query_emb).ravel() for query_emb in query_embs], dtype=np.float32)
+        if self.similarity == "cosine":
+            self.normalize_embedding(queries)
+        scores = queries @ embeddings.T
+
+        # rank of each document within its group: sort by group, then by descending score
+        selected = []
+        for query_scores in scores:
+            order = np.lexsort((-query_scores, codes))
+            sorted_codes = codes[order]
+            group_starts = np.searchsorted(sorted_codes, np.arange(len(group_values)))
+            ranks = np.arange(len(order)) - group_starts[sorted_codes]
+            selected.append(order[ranks < top_k])
+
+        document_ids = list(dict.fromkeys(rows[row].id for keep in selected for row in keep))
+        documents = {
+            document.id: document for document in self.get_documents_by_id(document_ids, index=index)
+        }
+        results = []
+        for query_scores, keep in zip(scores, selected):
+            groups = {}
+            for row in keep:
+                document = copy.copy(documents[rows[row].id])
+                score = float(query_scores[row])
+                document.score = self.scale_to_unit_interval(score, self.similarity) if scale_score else score
+                document.embedding = None
+                groups.setdefault(str(group_values[codes[row]]), []).append(document)
+            results.append(groups)
+        return results
+
+def _to_cacheable(value):
+    """
+    Converts a pipeline output to JSON serializable values for the answer cache. Documents and
+    Answers are tagged with their type, so _from_cacheable can restore them.
+    """
+    if isinstance(value, (Document, Answer)):
+        return {"__type__": type(value).__name__, "value": _to_cacheable(value.to_dict())}
+    if isinstance(value, dict):
+        return {str(key): _to_cacheable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_cacheable(item) for item in value]
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (str, int, float, bool, type(None))):
+        return value
+    return str(value)
+
+
+def _from_cacheable(value):
+    """
+    Restores a pipeline output converted by _to_cacheable.
+    """
+    if isinstance(value, dict):
+        if value.get("__type__") == "Document":
+            return Document.from_dict(_from_cacheable(value["value"]))
+        if value.get("__type__") == "Answer":
+            return Answer.from_dict(_from_cacheable(value["value"]))
+        return {key: _from_cacheable(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_from_cacheable(item) for item in value]
+    return value
+
+
+def _truncate_prompt(tokenizer, prompt, max_tokens):
+    """
+    Truncates a prompt to its first max_tokens tokens of the given tokenizer, special tokens excluded.
+    Fast tokenizers cut the original text through the offset mappings, slow ones decode the kept tokens.
+
+    :param tokenizer: Hugging Face tokenizer of the generator model.
+    :param prompt: Filled prompt text.
+    :param max_tokens: The maximum number of prompt tokens.
+    :return: The prompt itself when it fits, else the truncated prompt.
+    """
+    encoding = tokenizer(prompt, add_special_tokens=False, return_offsets_mapping=tokenizer.is_fast)
+    if len(encoding["input_ids"]) <= max_tokens:
+        return prompt
+    if max_tokens == 0:
+        return ""
+    if tokenizer.is_fast:
+        return prompt[:encoding["offset_mapping"][max_tokens - 1][1]]
+    return tokenizer.decode(encoding["input_ids"][:max_tokens])
+
+
+class TracedPipeline(Pipeline):
+    """
+    Pipeline that times each node run as a span of the rrc tracer, e.g. retrieval and generation.
+    """
+    node_spans = {"retriever": "retrieve", "prompt_node": "generate"}
+
+    def _run_node(self, node_id, node_input):
+        with instrumentation.span(self.node_spans.get(node_id, f"node.{node_id}"), node=node_id):
+            return super()._run_node(node_id, node_input)
+
+
+class ScheduledDensePassageRetriever(DensePassageRetriever):
+    """
+    DensePassageRetriever with throughput controls for CPU hosts. The stock retriever pads every 
+    passage to max_seq_len_passage; here inputs are sorted by length and each batch is cut to 
+    its longest sequence, so short chunks do not pay for padding. The encoders can be quantized 
+    to int8 and run with their own torch thread count. Embedding throughput is recorded per call.
+    """
+
+    def __init__(
+        self,
+        *args,
+        sort_by_length: bool = True,
+        quantize: bool = False,
+        num_threads: int = None,
+        **kwargs
+    ):
+        """
+        Creates a ScheduledDensePassageRetriever instance. Other parameters are passed to 
+        DensePassageRetriever, e.g. batch_size.
+
+        :param sort_by_length: Whether to batch inputs of similar length together.
+        :param quantize: Whether to apply dynamic int8 quantization to the linear layers of both 
+            encoders. CPU only; embeddings change slightly, so an index should not mix quantized 
+            and full precision embeddings.
+        :param num_threads: The number of torch threads used while embedding, restored afterwards.
+        """
+        super().__init__(*args, **kwargs)
+        self.sort_by_length = sort_by_length
+        self.quantize = quantize
+        self.num_threads = num_threads
+        if quantize:
+            if self.devices[0].type != "cpu":
+                raise ValueError("Dynamic int8 quantization runs on CPU only, set use_gpu=False.")
+            torch.quantization.quantize_dynamic(
+                self.model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        self.throughput = []
+
+    @staticmethod
+    def _input_length(input_dict):
+        if "query" in input_dict:
+            return len(input_dict["query"])
+        return sum(len(passage["title"]) + len(passage["text"]) for passage in input_dict["passages"])
+
+    def _get_predictions(self, dicts):
+        """
+        Feeds queries or passages to the encoders in length-sorted batches cut to their longest 
+        sequence, as DensePassageRetriever._get_predictions does otherwise.
+
+        :param dicts: List of query or passage dictionaries.
+        :return: Dictionary of "query" or "passages" embeddings, in the order of dicts.
+        """
+        start = time.perf_counter()
+        order = list(range(len(dicts)))
+        if self.sort_by_length:
+            # longest first, so the peak memory is reached in the first batch
+            order.sort(key=lambda position: -self._input_length(dicts[position]))
+        dataset, tensor_names, _, _ = self.processor.dataset_from_dicts(
+            [dicts[position] for position in order], indices=list(range(len(dicts))), return_baskets=True)
+        data_loader = NamedDataLoader(
+            dataset=dataset, sampler=SequentialSampler(dataset), batch_size=self.batch_size, tensor_names=tensor_names)
+
+        embeddings = {"query": [], "passages": []}
+        tokens, padded_tokens = 0, 0
+        previous_threads = torch.get_num_threads()
+        if self.num_threads:
+            torch.set_num_threads(self.num_threads)
+        self.model.eval()
+        try:
+            for raw_batch in data_loader:
+                batch = {key: raw_batch[key].to(self.devices[0]) for key in raw_batch}
+                for prefix in ("query", "passage"):
+                    mask = batch.get(f"{prefix}_attention_mask")
+                    if mask is None:
+                        continue
+                    # padding is at the end, the attention mask gives the longest sequence of the batch
+                    length = max(int(mask.sum(-1).max()), 1)
+                    for name in ("input_ids", "segment_ids", "attention_mask"):
+                        batch[f"{prefix}_{name}"] = batch[f"{prefix}_{name}"][..., :length].contiguous()
+                    tokens += int(mask.sum())
+                    padded_tokens += batch[f"{prefix}_attention_mask"].numel()
+                with torch.inference_mode():
+                    query_embeddings, passage_embeddings = self.model.forward(
+                        query_input_ids=batch.get("query_input_ids", None),
+                        query_segment_ids=batch.get("query_segment_ids", None),
+                        query_attention_mask=batch.get("query_attention_mask", None),
+                        passage_input_ids=batch.get("passage_input_ids", None),
+                        passage_segment_ids=batch.get("passage_segment_ids", None),
+                        passage_attention_mask=batch.get("passage_attention_mask", None),
+                    )[0]
+                if query_embeddings is not None:
+                    embeddings["query"].append(query_embeddings.cpu().numpy())
+                if passage_embeddings is not None:
+                    embeddings["passages"].append(passage_embeddings.cpu().numpy())
+        finally:
+            torch.set_num_threads(previous_threads)
+
+        # back to the order of dicts
+        inverse = np.argsort(order)
+        all_embeddings = {
+            key: np.concatenate(batches)[inverse] for key, batches in embeddings.items() if batches
+        }
+        seconds = time.perf_counter() - start
+        self.throughput.append({
+            "kind": "query" if "query" in all_embeddings else "passages",
+            "inputs": len(dicts),
+            "seconds": seconds,
+            "inputs_per_second": len(dicts) / seconds if seconds else 0.0,
+            "padding_ratio": 1 - tokens / padded_tokens if padded_tokens else 0.0
+        })
+        return all_embeddings
+
+    def get_throughput(self, kind="passages"):
+        """
+        Returns the embedding throughput over all calls so far.
+
+        :param kind: "passages" (chunks) or "query".
+            If not set, default "passages"
+        :return: Dictionary of inputs, seconds, inputs_per_second and the mean padding_ratio, 
+            i.e. the share of padding tokens left in the cut batches.
+        """
+        calls = [call for call in self.throughput if call["kind"] == kind]
+        inputs = sum(call["inputs"] for call in calls)
+        seconds = sum(call["seconds"] for call in calls)
+        return {
+            "inputs": inputs,
+            "seconds": seconds,
+            "inputs_per_second": inputs / seconds if seconds else 0.0,
+            "padding_ratio": float(np.mean([call["padding_ratio"] for call in calls])) if calls else 0.0
+        }
+
 
 class RapidReviewSession():
     """
@@ -48,12 +569,32 @@ class RapidReviewSession():
         max_ans_length: Optional[int] = 100,
         min_context_size: Optional[int] = 200, 
         seq_length_buffer: Optional[int] = 50,
-        use_gpu: Optional[bool] = None
+        use_gpu: Optional[bool] = None,
+        index_path: Optional[str] = "./doc_store_index.faiss",
+        config_path: Optional[str] = "./doc_store_config.json",
+        sql_url: Optional[str] = "sqlite:///faiss_document_store.db",
+        token_cache_size: Optional[int] = 5_000_000,
+        token_cache_dir: Optional[str] = None,
+        chunk_overlap: Optional[int] = 0,
+        snap_to_sentence: Optional[bool] = False,
+        model_cache: Optional[ModelCache] = None,
+        qa_model_kwargs: Optional[dict] = None,
+        corpus: Optional[CorpusStore] = None,
+        corpus_embeddings: Optional[bool] = False,
+        index_spec: Optional[str] = "Flat",
+        index_search_params: Optional[dict] = None,
+        index_train_size: Optional[int] = 50_000,
+        embedding_batch_size: Optional[int] = 16,
+        embedding_sort_by_length: Optional[bool] = True,
+        embedding_threads: Optional[int] = None,
+        quantize_embeddings: Optional[bool] = False,
+        answer_cache_size: Optional[int] = 1_000,
+        answer_cache_dir: Optional[str] = None
     ):
         """ 
         Creates a RapidReview instance. 
         
-        :param src_dir: The name of the source directory where JSON files are being stored.
+        :param src_dir: The name of the source directory where JSON files are being stored. Not used when corpus is set.
         :param ret_models: Tuple of retriever models. First element to be the Query Embedding model, 
             second element to be the Context Embedding model
         :param qa_model: The name of the model to use or an instance of the PromptModel.
@@ -65,34 +606,325 @@ class RapidReviewSession():
             If not set, default 50
         :param use_gpu: Whether to use GPU or not.
             If not set, default None
+        :param index_path: Path of the persistent FAISS index. An existing index is reused across sessions.
+            If not set, default "./doc_store_index.faiss"
+        :param config_path: Path of the document store configuration saved alongside the index.
+            If not set, default "./doc_store_config.json"
+        :param sql_url: SQL database where the document store keeps chunk texts and metadata.
+            If not set, default "sqlite:///faiss_document_store.db"
+        :param token_cache_size: The maximum number of token IDs kept in the session's tokenization cache.
+            If not set, default 5_000_000
+        :param token_cache_dir: Directory where the token IDs of articles are persisted across sessions.
+            If not set, default None (token IDs are only cached in memory)
+        :param chunk_overlap: The number of tokens shared by consecutive chunks of an article.
+            If not set, default 0
+        :param snap_to_sentence: Whether to end chunks on the last sentence boundary within the chunk size.
+            If not set, default False
+        :param model_cache: Cache of loaded tokenizers and models, e.g. to share them between sessions.
+            If not set, default None (the session holds its own cache)
+        :param qa_model_kwargs: Additional keyword arguments of the generator model, e.g. {"task_name": "text-generation"} 
+            for local models whose task cannot be inferred.
+            If not set, default None
+        :param corpus: CorpusStore to read articles from instead of the JSON files in src_dir. 
+            Chunks indexed by the session are appended to it.
+            If not set, default None
+        :param corpus_embeddings: Whether to also append the embeddings of indexed chunks to the corpus.
+            If not set, default False
+        :param index_spec: FAISS index type of a new document store, e.g. "HNSW32", "IVF1024,Flat", 
+            "IVF1024,PQ64" or "float16" (see rrc.indexing). An existing index keeps the type it was built 
+            with, so a different spec needs a new index_path and sql_url.
+            If not set, default "Flat" (exact search)
+        :param index_search_params: faiss search parameters of the index, e.g. {"nprobe": 16} for IVF 
+            or {"efSearch": 64} for HNSW indexes.
+            If not set, default None (faiss defaults)
+        :param index_train_size: The number of chunk embeddings sampled to train IVF and PQ indexes, 
+            taken from the first chunks indexed.
+            If not set, default 50_000
+        :param embedding_batch_size: The number of chunks (or queries) per retriever forward pass.
+            If not set, default 16
+        :param embedding_sort_by_length: Whether to batch chunks of similar length together, which cuts 
+            padding since every batch is cut to its longest chunk.
+            If not set, default True
+        :param embedding_threads: The number of torch threads used while embedding.
+            If not set, default None (torch default)
+        :param quantize_embeddings: Whether to run the retriever encoders with dynamic int8 quantization (CPU only). 
+            Quantized embeddings differ slightly, so use a separate index_path.
+            If not set, default False
+        :param answer_cache_size: The maximum number of generated answers kept in memory. Answers are keyed by 
+            the prompt, query, article, retrieved chunk ids, generator model and generation settings, so a 
+            repeated question is only generated again when one of these changes. 0 disables the cache.
+            If not set, default 1_000
+        :param answer_cache_dir: Directory where generated answers are persisted across sessions.
+            If not set, default None (answers are only cached in memory)
         """
-        # session text sources
+        # session text sources, indexed by article id
         self.src_dir = src_dir
+        self.corpus = corpus
+        self.corpus_embeddings = corpus_embeddings
+        self.article_index = corpus if corpus is not None else ArticleIndex(src_dir)
 
         # retriever models 
         self.query_embedding_model = ret_models[0]
         self.context_embedding_model = ret_models[1]
-        self.ret_tokenizer = AutoTokenizer.from_pretrained(
-            self.context_embedding_model
-        )
 
         # generative model
         self.qa_model = qa_model
-        self.qa_tokenizer = AutoTokenizer.from_pretrained(
-            self.qa_model
-        )
+        self.qa_model_kwargs = qa_model_kwargs
+
+        # tokenizers and models are loaded on first use and reused across queries
+        self.model_cache = model_cache if model_cache is not None else ModelCache()
+        self.retriever = None
+        self.pipeline = None
+        self.pipeline_components = None
+        self.query_timings = []
 
         # other session parameters
-        self.ret_max_length = self.ret_tokenizer.model_max_length
-        self.qa_max_length = self.qa_tokenizer.model_max_length
         self.max_ans_length = max_ans_length
         self.seq_length_buffer = seq_length_buffer
         self.min_context_size = min_context_size
         self.use_gpu  = use_gpu
 
-        print(f"Retriever MAX SEQ LENGTH: {self.ret_max_length}")
-        print(f"QA model MAX SEQ LENGTH (Input limit): {self.qa_max_length}")
+        # persistent document store
+        self.index_path = index_path
+        self.config_path = config_path
+        self.sql_url = sql_url
+        self.document_store = None
+        self.index_spec = index_spec
+        self.index_search_params = index_search_params
+        self.index_train_size = index_train_size
+
+        # embedding throughput controls
+        self.embedding_batch_size = embedding_batch_size
+        self.embedding_sort_by_length = embedding_sort_by_length
+        self.embedding_threads = embedding_threads
+        self.quantize_embeddings = quantize_embeddings
+
+        # tokenization cache shared by all queries of the session
+        self.token_cache = TokenCache(max_tokens=token_cache_size, cache_dir=token_cache_dir)
+
+        # generated answers, skipping the generator for repeated questions
+        self.answer_cache = (
+            AnswerCache(max_entries=answer_cache_size, cache_dir=answer_cache_dir)
+            if answer_cache_size or answer_cache_dir else None)
+
+        # chunking parameters, the chunker itself depends on the chunk size of the query
+        self.chunk_overlap = chunk_overlap
+        self.snap_to_sentence = snap_to_sentence
+        self.chunker = None
+
+    # lazily loaded tokenizers and models
+    @property
+    def device(self):
+        """
+        The device the retriever and generator models run on, used in the model cache keys.
+        """
+        use_gpu = torch.cuda.is_available() if self.use_gpu is None else self.use_gpu
+        return "cuda" if use_gpu else "cpu"
+
+    def _get_tokenizer(self, model_name, label):
+        def load():
+            tokenizer = AutoTokenizer.from_pretrained(model_name)
+            print(f"{label} MAX SEQ LENGTH: {tokenizer.model_max_length}")
+            return tokenizer
+        return self.model_cache.get("tokenizer", model_name, None, load)
+
+    @property
+    def ret_tokenizer(self):
+        return self._get_tokenizer(self.context_embedding_model, "Retriever")
+
+    @property
+    def qa_tokenizer(self):
+        return self._get_tokenizer(self.qa_model, "QA model (Input limit)")
+
+    @property
+    def ret_max_length(self):
+        return self.ret_tokenizer.model_max_length
+
+    @property
+    def qa_max_length(self):
+        return self.qa_tokenizer.model_max_length
+
+    def _get_retriever(self, quantize=None):
+        """
+        Returns the session's Dense Passage Retriever (DPR), loading it on first use. 
+        The retriever is attached to the session's document store.
+
+        :param quantize: Whether to return the int8 quantized retriever.
+            If not set, default the session's quantize_embeddings
+        """
+        quantize = self.quantize_embeddings if quantize is None else quantize
+        # every argument of the loader is part of the key
+        self.retriever = self.model_cache.get(
+            "retriever",
+            (self.query_embedding_model, self.context_embedding_model, "int8" if quantize else "float", self.use_gpu),
+            self.device,
+            lambda: ScheduledDensePassageRetriever(
+                document_store=self.document_store,
+                query_embedding_model=self.query_embedding_model,
+                passage_embedding_model=self.context_embedding_model,
+                embed_title=True,
+                use_gpu=self.use_gpu,
+                quantize=quantize))
+        # a shared model cache may hold a retriever attached to another session's store
+        self.retriever.document_store = self.document_store
+        # batching controls apply per call, so a shared retriever follows the session's settings
+        self.retriever.batch_size = self.embedding_batch_size
+        self.retriever.sort_by_length = self.embedding_sort_by_length
+        self.retriever.num_threads = self.embedding_threads
+        return self.retriever
+
+    def _get_prompt_node(self, prompt_template):
+        """
+        Returns the session's PromptNode, loading the generator model on first use. 
+        Only the prompt template is replaced between calls.
+
+        :param prompt_template: PromptTemplate used by the PromptNode from now on.
+        :return: PromptNode.
+        """
+        # every argument of the loader except the template, which is replaced below, is part of the key
+        prompt_node = self.model_cache.get(
+            "prompt_node",
+            (
+                self.qa_model, self.max_ans_length, self.use_gpu,
+                json.dumps(_to_cacheable(self.qa_model_kwargs), sort_keys=True)
+            ),
+            self.device,
+            lambda: PromptNode(
+                model_name_or_path=self.qa_model,
+                default_prompt_template=prompt_template,
+                max_length = self.max_ans_length,
+                use_gpu=self.use_gpu,
+                model_kwargs=self.qa_model_kwargs))
+        prompt_node.default_prompt_template = prompt_template
+        return prompt_node
+
+    def _get_pipeline(self, prompt_template):
+        """
+        Returns the generation pipeline, built once and reused while the PromptNode is unchanged. 
+        Retrieval runs before the pipeline, so its documents can be looked up in the answer cache.
+
+        :param prompt_template: PromptTemplate used by the PromptNode.
+        :return: Pipeline.
+        """
+        prompt_node = self._get_prompt_node(prompt_template)
+        components = (prompt_node,)
+        if self.pipeline is None or self.pipeline_components != components:
+            pipe = TracedPipeline()
+            pipe.add_node(component=prompt_node,
+                          name="prompt_node", inputs=["Query"])
+            self.pipeline = pipe
+            self.pipeline_components = components
+        return self.pipeline
+
+    def _answer_key(self, kind, prompt, query, article_id, documents, generation_params=None):
+        """
+        Returns the answer cache key of a question, from everything the generated answer depends on.
+
+        :param kind: "run_query" or "run_batch", whose answers are generated and stored differently.
+        :param prompt: Prompt template text.
+        :param query: Question to be answered by the generator model.
+        :param article_id: The article id filter of the question.
+        :param documents: Retrieved Documents, whose content-addressed ids cover the chunk texts.
+        :param generation_params: Params passed to the PromptNode, e.g. generation_kwargs.
+        :return: Cache key.
+        """
+        return self.answer_cache.key(
+            kind=kind,
+            prompt=prompt,
+            query=query,
+            article_id=article_id,
+            chunk_ids=[document.id for document in documents],
+            model=str(self.qa_model),
+            model_kwargs=self.qa_model_kwargs,
+            max_ans_length=self.max_ans_length,
+            generation_params=generation_params)
+
+    def get_model_timings(self):
+        """
+        Returns the cold load times of the session's models and the latency of each query. 
+        Queries that loaded a model are flagged as cold, the following ones run warm.
+
+        :return: Dictionary with the "models" stats of the model cache and the "queries" timings.
+        """
+        return {"models": self.model_cache.stats(), "queries": list(self.query_timings)}
     
+
+    def get_embedding_throughput(self):
+        """
+        Returns the chunk and query embedding throughput of the session's retriever so far.
+
+        :return: Dictionary with "chunks" and "queries" stats, see ScheduledDensePassageRetriever.get_throughput.
+        """
+        if self.retriever is None:
+            return {}
+        return {
+            "chunks": self.retriever.get_throughput("passages"),
+            "queries": self.retriever.get_throughput("query")
+        }
+
+    def benchmark_embedding(
+        self,
+        article_ids: List[str],
+        batch_sizes: Optional[tuple] = (8, 16, 32, 64),
+        thread_counts: Optional[tuple] = (None,),
+        quantize: Optional[tuple] = (False,),
+        sort_by_length: Optional[tuple] = (True,),
+        chunk_size: Optional[int] = None
+    ):
+        """
+        Embeds the chunks of the given articles with each combination of settings and reports 
+        chunks/sec, to choose the embedding settings of a machine. Nothing is written to the 
+        document store and the session's settings are left unchanged.
+
+        :param article_ids: The ids of the articles to chunk and embed.
+        :param batch_sizes: Retriever batch sizes to try.
+            If not set, default (8, 16, 32, 64)
+        :param thread_counts: torch thread counts to try, None being the torch default.
+            If not set, default (None,)
+        :param quantize: Whether to try the full precision and/or the int8 quantized encoders.
+            If not set, default (False,)
+        :param sort_by_length: Whether to try length-sorted and/or unsorted batches.
+            If not set, default (True,)
+        :param chunk_size: The chunk size in retriever tokens.
+            If not set, default the chunk size of the last query
+        :return: DataFrame with one row per combination of settings.
+        """
+        chunk_size = chunk_size or getattr(self, "chunk_size", None)
+        if chunk_size is None:
+            raise RuntimeError("Run a query or pass chunk_size to benchmark embedding.")
+        documents = self._chunk_articles(
+            {"retriever": {"filters": {"article_id": list(article_ids)}}}, self._new_chunker(chunk_size))
+        settings = (
+            self.embedding_batch_size, self.embedding_threads, self.quantize_embeddings, self.embedding_sort_by_length)
+        results = []
+        try:
+            for quantized in quantize:
+                # warm up, so the first setting does not pay for one-off allocations
+                self._get_retriever(quantize=quantized).embed_documents(documents[:max(batch_sizes)])
+                for batch_size in batch_sizes:
+                    for threads in thread_counts:
+                        for sort in sort_by_length:
+                            self.embedding_batch_size, self.embedding_threads = batch_size, threads
+                            self.embedding_sort_by_length = sort
+                            retriever = self._get_retriever(quantize=quantized)
+                            retriever.embed_documents(documents)
+                            throughput = retriever.throughput[-1]
+                            results.append({
+                                "batch_size": batch_size,
+                                "threads": threads or torch.get_num_threads(),
+                                "quantize": quantized,
+                                "sort_by_length": sort,
+                                "chunks": len(documents),
+                                "seconds": throughput["seconds"],
+                                "chunks_per_second": throughput["inputs_per_second"],
+                                "padding_ratio": throughput["padding_ratio"]
+                            })
+        finally:
+            (self.embedding_batch_size, self.embedding_threads, 
+             self.quantize_embeddings, self.embedding_sort_by_length) = settings
+            self._get_retriever()
+        return pd.DataFrame(results)
+
     # check for token length
     def _get_context_size(
         self,
@@ -107,12 +939,13 @@ class RapidReviewSession():
         :param query: Question to be answered by the generator model
         :return None
         """
-        self.query_length = self.qa_tokenizer(query, return_tensors="pt")
-        self.prompt_length = self.qa_tokenizer(prompt, return_tensors="pt")
+        # token counts, not the batch dimension of the tokenized tensors
+        self.query_length = self.token_cache.n_input_ids(self.qa_tokenizer, query)
+        self.prompt_length = self.token_cache.n_input_ids(self.qa_tokenizer, prompt)
         self.context_size = (
             self.qa_max_length
-            - len(self.query_length["input_ids"]) 
-            - len(self.prompt_length["input_ids"])
+            - self.query_length
+            - self.prompt_length
             - self.seq_length_buffer 
             - self.max_ans_length
         )
@@ -129,89 +962,234 @@ class RapidReviewSession():
             RuntimeError(
                 f"Chunk size ({self.chunk_size}) is longer than QA model MAX SEQ LENGTH")
         pass
+    # key shared by all chunks of the same chunk size and context embedding model
+    def _chunk_key(self, chunk_size=None):
+        """
+        Returns the key of the current chunking configuration. Chunks are only comparable 
+        (and retrievable together) when they share the chunk size, overlap, sentence snapping 
+        and the context embedding model.
+
+        :param chunk_size: The chunk size in retriever tokens.
+            If not set, default the session's chunk size
+        :return: String key of the chunking configuration.
+        """
+        key = f"{self.context_embedding_model}:{chunk_size or self.chunk_size}"
+        if self.chunk_overlap:
+            key += f":overlap={self.chunk_overlap}"
+        if self.snap_to_sentence:
+            key += ":sentence"
+        return key
+
+    def _get_chunker(self):
+        """
+        Returns the chunker of the current chunk size, reusing it while the chunk size is unchanged.
+        """
+        if self.chunker is None or self.chunker.chunk_size != self.chunk_size:
+            self.chunker = self._new_chunker(self.chunk_size)
+        return self.chunker
+
+    def _new_chunker(self, chunk_size):
+        """
+        Returns a new chunker of the given chunk size and the session's chunking settings, 
+        leaving the session's chunk size and chunker unchanged.
+
+        :param chunk_size: The chunk size in retriever tokens.
+        :return: TokenChunker.
+        """
+        return TokenChunker(
+            self.ret_tokenizer,
+            chunk_size=chunk_size,
+            overlap=self.chunk_overlap,
+            snap_to_sentence=self.snap_to_sentence,
+            token_cache=self.token_cache)
+
+    # content-addressed chunk ids
+    def _chunk_document_id(self, article_id, counter, chunk_text, chunk_key=None):
+        """
+        Derives a content-addressed Document id from the chunking configuration, the article 
+        and the chunk text. The same chunk always maps to the same id, so chunks that are 
+        already stored (and embedded) can be recognized across queries and sessions.
+
+        :param article_id: The id of the article the chunk belongs to.
+        :param counter: The position of the chunk within the article.
+        :param chunk_text: The text of the chunk.
+        :param chunk_key: The key of the chunking configuration.
+            If not set, default the key of the current chunking configuration
+        :return: Hex digest used as Document id.
+        """
+        key = f"{chunk_key or self._chunk_key()}|{article_id}|{counter}|{chunk_text}"
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
     # chunking articles (in certain format) based on chunk size 
-    def _chunk_articles(self, params, fmt="json"):
-        """ """
+    def _chunk_articles(self, params, chunker=None):
+        """
+        Chunks the articles selected by the article_id retriever filter in params. 
+        Articles are looked up in the session's article index, so only their own files are read.
+        Chunks are cut on the extracted text itself, their character span is kept in the metadata.
+
+        :param params: Dictionary of top k and article id. The article id filter may be a 
+            single id or a list of ids.
+        :param chunker: TokenChunker to use.
+            If not set, default the session's chunker of the current chunk size
+        :return: List of chunks as Documents.
+        """
         documents = []
-        # Obtain chosen article
-        chosen_article_id = params["retriever"]["filters"]['article_id']
-        doc_paths = glob(os.path.join(self.src_dir, f'*.{fmt}'))
-        for path in tqdm(doc_paths):
-            with open(path, 'r') as file:
-                data = json.load(file)
-                article_id = data.get("article_id")
-                # check for article
-                if (article_id == chosen_article_id):
-                    extracted_context = data.get("extracted_text")
-                    # NOTE: QA tokenizer is used to get the correct seq lengths
-                    tokenized_context = self.ret_tokenizer(
-                        extracted_context, return_tensors="pt").input_ids
-                    counter = 0
-                    for tokenized_list in tokenized_context:
-                        for start_index in range(
-                                0, len(tokenized_list), self.chunk_size):
-                            # handles contexts with length not divisible by chunk_size
-                            if start_index + self.chunk_size >= len(tokenized_list):
-                                tokenized_chunk = tokenized_list[start_index:]
-                            else:
-                                tokenized_chunk = tokenized_list[start_index: start_index + self.chunk_size]
-                            chunk_text = self.ret_tokenizer.decode(tokenized_chunk)
-                            meta = data.copy()
-                            meta["chunk_id"] = f"{article_id}_{counter}"
-                            # using a linux path to file, extract file name e.g., some_title.pdf
-                            meta["filename"] = os.path.basename(
-                                os.path.realpath(path)
-                            ) # verify if this works in windows paths
-                        
-                            chunk_data = Document(content=chunk_text, meta=meta)
-                            documents.append(chunk_data)
-                            counter += 1
+        # Obtain chosen article(s)
+        chosen_article_ids = params["retriever"]["filters"]['article_id']
+        if isinstance(chosen_article_ids, str):
+            chosen_article_ids = [chosen_article_ids]
+        articles = []
+        for article_id in dict.fromkeys(chosen_article_ids):
+            data = self.article_index.load(article_id)
+            if data is not None:
+                articles.append((article_id, data))
+
+        # all articles are tokenized in one batched call, offsets are cached (and persisted) per article text
+        chunker = chunker or self._get_chunker()
+        # keys follow the chunker's chunk size, which may not be the session's
+        chunk_key = self._chunk_key(chunker.chunk_size)
+        with instrumentation.span("chunk", articles=len(articles)):
+            article_chunks = chunker.chunk_batch([data.get("extracted_text") for _, data in articles])
+        instrumentation.count("documents", len(articles))
+        instrumentation.count("chunks", sum(len(chunks) for chunks in article_chunks))
+        for (article_id, data), chunks in zip(tqdm(articles), article_chunks):
+            path = self.article_index.path(article_id)
+            for counter, chunk in enumerate(chunks):
+                # the full text is not copied into every chunk's metadata
+                meta = {
+                    key: value for key, value in data.items() 
+                    if key != "extracted_text"
+                }
+                meta["chunk_id"] = f"{article_id}_{counter}"
+                meta["chunk_key"] = chunk_key
+                meta["start_char"] = chunk["start_char"]
+                meta["end_char"] = chunk["end_char"]
+                # using a linux path to file, extract file name e.g., some_title.pdf
+                meta["filename"] = os.path.basename(
+                    os.path.realpath(path)
+                ) # verify if this works in windows paths
+            
+                chunk_data = Document(
+                    content=chunk["text"], 
+                    meta=meta,
+                    id=self._chunk_document_id(article_id, counter, chunk["text"], chunk_key))
+                documents.append(chunk_data)
         return documents
+
+    def _scoped_params(self, params):
+        """
+        Returns a copy of params whose retriever filters are restricted to chunks of the 
+        current chunking configuration, since the persistent store holds chunks of several 
+        chunk sizes and models.
+
+        :param params: Dictionary of top k and article id.
+        :return: Dictionary of scoped params.
+        """
+        params = copy.deepcopy(params)
+        filters = params["retriever"].setdefault("filters", {})
+        filters["chunk_key"] = self._chunk_key()
+        return params
     
-    def _init_document_store(
-        self,
-        params,
-        index_path="./doc_store_index.faiss", 
-        config_path="./doc_store_config.json"
-    ):
+    def _train_index(self, documents):
+        """
+        Trains the FAISS index (e.g. IVF lists or PQ codebooks) on the embeddings of a sample 
+        of documents.
+
+        :param documents: Documents to sample from, usually the first chunks indexed.
+        :return: The sampled Documents, with their embeddings set.
+        """
+        sample = [documents[row] for row in indexing.sample_rows(len(documents), self.index_train_size)]
+        embeddings = np.array(self.retriever.embed_documents(sample), dtype=np.float32)
+        for document, embedding in zip(sample, embeddings):
+            document.embedding = embedding
+        train_embeddings = embeddings.copy()
+        if self.document_store.similarity == "cosine":
+            self.document_store.normalize_embedding(train_embeddings)
+        with instrumentation.span("train_index", vectors=len(sample)):
+            indexing.train_index(
+                self.document_store.faiss_indexes[self.document_store.index], train_embeddings)
+        return sample
+
+    def _init_document_store(self, params):
         """ 
-        Creates a FAISS document store to store all chunks from articles as Documents. 
-        Dense Passage Retriever (DPR) is used to produce embeddings for Documents 
+        Loads (or creates) the persistent FAISS document store and indexes the chunks of the 
+        articles selected in params. Dense Passage Retriever (DPR) is used to produce embeddings 
+        for Documents.
+
+        Chunks are content-addressed, so only chunks that are not yet stored are written 
+        and embedded. Stored chunks of the selected articles that no longer match the article 
+        text (e.g., after re-extraction) are removed. The index is saved to disk and stays 
+        valid across queries and sessions. Index specs that need training (IVF, PQ) are trained 
+        on a sample of the first chunks indexed.
         
-        :param index_path: Path to save the index.
-        :param config_path: Path to save the configuration file. 
-                This is the JSON file that contains all the parameters to initialize the DocumentStore.
+        :param params: Dictionary of top k and article id.
         :return: None
         """
-        
-        self.index_path = index_path
-        self.config_path = config_path
-        
         # Run this if document store not initialize
-        if not hasattr(self, 'document_store') or self.document_store is None:
-            # Load document store 
-            self.document_store = FAISSDocumentStore(
-                sql_url="sqlite:///faiss_document_store.db",)
-        else: 
-            self.document_store = FAISSDocumentStore.load(
-                index_path=self.index_path, 
-                config_path=self.config_path)
+        if self.document_store is None:
+            if os.path.exists(self.index_path) and os.path.exists(self.config_path):
+                self.document_store = FilteredFAISSDocumentStore.load(
+                    index_path=self.index_path, 
+                    config_path=self.config_path)
+                stored_spec = self.document_store.faiss_index_factory_str
+                if indexing.resolve_index_spec(stored_spec) != indexing.resolve_index_spec(self.index_spec):
+                    raise ValueError(
+                        f"The index at {self.index_path} was built as '{stored_spec}', not '{self.index_spec}'. "
+                        "Pass a new index_path, config_path and sql_url to build another index type.")
+                if self.index_search_params:
+                    self.document_store.set_search_params(self.index_search_params)
+            else:
+                self.document_store = FilteredFAISSDocumentStore(
+                    sql_url=self.sql_url,
+                    faiss_index_factory_str=self.index_spec,
+                    index_search_params=self.index_search_params)
         
-        # Writing and saving embeddings to document store
         documents = self._chunk_articles(params)
-        # Set up retriever
-        self.retriever = DensePassageRetriever(
-            document_store=self.document_store,
-            query_embedding_model=self.query_embedding_model,
-            passage_embedding_model=self.context_embedding_model,
-            embed_title=True,
-            use_gpu=self.use_gpu)
-        # Delete document store before writing
-        # Vectors changed when token length changes, delete the file to flush 
-        self.document_store.delete_documents() 
-        self.document_store.write_documents(documents)
-        # Update embeddings
-        self.document_store.update_embeddings(retriever=self.retriever)
+        # Set up retriever, loaded once per session
+        self._get_retriever()
+
+        # Compare with the chunks already stored for the selected articles
+        indexed_documents = self.document_store.get_all_documents(
+            filters=self._scoped_params(params)["retriever"]["filters"],
+            return_embedding=False)
+        indexed_ids = {document.id for document in indexed_documents}
+        chunk_ids = {document.id for document in documents}
+        stale_ids = indexed_ids - chunk_ids
+        new_documents = [
+            document for document in documents if document.id not in indexed_ids
+        ]
+        if not stale_ids and not new_documents:
+            return
+
+        if stale_ids:
+            self.document_store.delete_documents(ids=list(stale_ids))
+        # Writing new chunks and embedding only those without embeddings
+        with instrumentation.span("embed", chunks=len(new_documents)):
+            faiss_index = self.document_store.faiss_indexes[self.document_store.index]
+            if new_documents and not faiss_index.is_trained:
+                # the training sample is written with its embeddings, so it is not embedded twice
+                self.document_store.write_documents(self._train_index(new_documents))
+            self.document_store.write_documents(
+                [document for document in new_documents if document.embedding is None])
+            self.document_store.update_embeddings(
+                retriever=self.retriever, update_existing_embeddings=False)
+        instrumentation.count("embedded_chunks", len(new_documents))
+        if self.corpus is not None:
+            self.corpus.add_chunks(new_documents)
+            if self.corpus_embeddings and new_documents:
+                # FAISSDocumentStore.get_documents_by_id reconstructs embeddings only when
+                # the store returns embeddings
+                return_embedding = self.document_store.return_embedding
+                self.document_store.return_embedding = True
+                try:
+                    embedded = self.document_store.get_documents_by_id(
+                        [document.id for document in new_documents])
+                finally:
+                    self.document_store.return_embedding = return_embedding
+                self.corpus.add_embeddings(
+                    [document.id for document in embedded],
+                    [document.embedding for document in embedded],
+                    model=self.context_embedding_model)
         # Save after updating embeddings
         self.document_store.save(index_path=self.index_path, config_path=self.config_path)
         pass
@@ -219,11 +1197,55 @@ class RapidReviewSession():
     def _reset_document_store(self):
         """
         Flush all existing documents, followed by saving document store. 
-        To be called after obtaining answers from query
+        Only needed to rebuild the persistent index from scratch.
         """
         self.document_store.delete_documents()
         self.document_store.save(index_path=self.index_path, config_path=self.config_path)
 
+    def evaluate_index_specs(
+        self,
+        index_specs: List[str],
+        queries: Optional[List[str]] = None,
+        k: Optional[int] = 10,
+        n_queries: Optional[int] = 100,
+        search_params: Optional[dict] = None
+    ):
+        """
+        Compares index specs with exact search over the chunk embeddings indexed so far: memory 
+        footprint, build time, search latency and recall@k. Embeddings are taken from the corpus 
+        when corpus_embeddings is set, else from the document store, which should then use the 
+        exact "Flat" index.
+
+        :param index_specs: Index specs to compare, e.g. ["HNSW32", "IVF256,Flat", "IVF256,PQ64", "float16"].
+        :param queries: Questions embedded as search queries.
+            If not set, default None (a sample of chunk embeddings is used as queries)
+        :param k: Number of neighbours compared.
+            If not set, default 10
+        :param n_queries: Number of chunk embeddings sampled as queries when queries is not set.
+            If not set, default 100
+        :param search_params: Dictionary of search parameters per index spec, e.g. {"IVF256,Flat": {"nprobe": 8}}.
+            If not set, default None (faiss defaults)
+        :return: DataFrame with one row per index spec, the exact index first.
+        """
+        if self.corpus is not None and self.corpus_embeddings:
+            _, embeddings = self.corpus.load_embeddings(self.context_embedding_model)
+        else:
+            if self.document_store is None:
+                raise RuntimeError("Run a query before evaluating index specs.")
+            embeddings = np.array([
+                document.embedding for document in self.document_store.get_all_documents(return_embedding=True)
+                if document.embedding is not None
+            ], dtype=np.float32)
+        if not len(embeddings):
+            raise RuntimeError("No chunk embeddings to evaluate index specs on.")
+        if queries:
+            query_embeddings = self._get_retriever().embed_queries(queries=list(queries))
+        else:
+            query_embeddings = embeddings[indexing.sample_rows(len(embeddings), n_queries)]
+        return pd.DataFrame(indexing.evaluate_index_specs(
+            embeddings, query_embeddings, index_specs, k=k,
+            train_size=self.index_train_size, search_params=search_params))
+
     # Obtain document chunk ids
     def get_document_chunks_ids(
         self,
@@ -246,6 +1268,41 @@ class RapidReviewSession():
             # document.id may not be required
             chunk_ids.append([document.id, document.meta['chunk_id']])
         return chunk_ids
+
+    # chunk size statistics for tuning min_context_size and seq_length_buffer
+    def get_chunk_stats(self, article_ids, chunk_size=None):
+        """
+        Chunks the given articles and reports chunk size statistics in retriever tokens and in 
+        generator tokens. The excess of generator tokens over retriever tokens per chunk, times 
+        the retriever top_k, is the seq_length_buffer these articles actually need.
+
+        :param article_ids: The ids of the articles to chunk.
+        :param chunk_size: The chunk size in retriever tokens.
+            If not set, default the chunk size of the last query
+        :return: Dictionary of chunk size statistics.
+        """
+        chunk_size = chunk_size or getattr(self, "chunk_size", None)
+        if chunk_size is None:
+            raise RuntimeError("Run a query or pass chunk_size to get chunk statistics.")
+        chunker = self._new_chunker(chunk_size)
+        documents = self._chunk_articles({"retriever": {"filters": {"article_id": list(article_ids)}}}, chunker)
+        stats = chunker.chunk_stats()
+        if documents:
+            contents = [document.content for document in documents]
+            # special tokens are counted once per prompt, not per chunk
+            ret_lengths = np.array([
+                len(input_ids) for input_ids in self.ret_tokenizer(contents, add_special_tokens=False)["input_ids"]])
+            qa_lengths = np.array([
+                len(input_ids) for input_ids in self.qa_tokenizer(contents, add_special_tokens=False)["input_ids"]])
+            excess = qa_lengths - ret_lengths
+            stats["qa_tokens_mean"] = float(qa_lengths.mean())
+            stats["qa_tokens_max"] = int(qa_lengths.max())
+            stats["qa_excess_p95"] = float(np.percentile(excess, 95))
+            stats["qa_excess_max"] = int(excess.max())
+            stats["seq_length_buffer"] = self.seq_length_buffer
+        return stats
+
+    @instrumentation.profiled("run_query")
     def run_query(
         self, 
         prompt: str, 
@@ -261,6 +1318,9 @@ class RapidReviewSession():
         :param params: Dictionary of top k and article id. 
         :return [Dictionary] of query and answers.
         """
+        start = time.perf_counter()
+        loads = self.model_cache.misses
+
         # initialize chunking dependencies
         self._get_context_size(prompt, query)
         self.ret_top_k = params.get("retriever").get("top_k")
@@ -269,29 +1329,333 @@ class RapidReviewSession():
             
         self._get_chunk_size()
         
-        # Init or Load doc store 
+        # Init or Load doc store, embedding only chunks not indexed yet
         self._init_document_store(params)
+        params = self._scoped_params(params)
         
         # Init PromptTemplate
         prompt_template = PromptTemplate(
             prompt=prompt
         )
         
-        # Init PromptNode, provide answer limit
-        prompt_node = PromptNode(
-            model_name_or_path=self.qa_model,
-            default_prompt_template=prompt_template,
-            max_length = self.max_ans_length,
-            use_gpu=self.use_gpu
-        )
-        
-        # Init Pipeline
-        pipe = Pipeline()
-        pipe.add_node(component=self.retriever,
-                      name="retriever", inputs=["Query"])
-        pipe.add_node(component=prompt_node,
-                      name="prompt_node", inputs=["retriever"])
-        output = pipe.run(query=query, params=params)
-        # resets document store
-        self._reset_document_store()
+        # Retrieve first, the retrieved chunks are part of the answer cache key
+        with instrumentation.span("retrieve", node="retriever"):
+            retrieval, _ = self._get_retriever().run(root_node="Query", query=query, **params["retriever"])
+        generation_params = {key: value for key, value in params.items() if key != "retriever"}
+        key = None
+        if self.answer_cache is not None:
+            key = self._answer_key(
+                "run_query", prompt, query, params["retriever"]["filters"].get("article_id"),
+                retrieval["documents"], generation_params)
+            cached = self.answer_cache.get(key)
+            if cached is not None:
+                instrumentation.count("cached_answers")
+                self.query_timings.append({
+                    "seconds": time.perf_counter() - start,
+                    "cold": self.model_cache.misses > loads,
+                    "cached": True
+                })
+                return _from_cacheable(cached)
+
+        # Reuse the pipeline and PromptNode, only the prompt template changes
+        pipe = self._get_pipeline(prompt_template)
+        output = pipe.run(query=query, documents=retrieval["documents"], params=generation_params)
+        if key is not None:
+            self.answer_cache.put(key, _to_cacheable(output))
+        self.query_timings.append({
+            "seconds": time.perf_counter() - start,
+            "cold": self.model_cache.misses > loads,
+            "cached": False
+        })
         return output
+
+    def _generate_batch(
+        self,
+        prompt_node,
+        prompt_template,
+        queries: List[str],
+        documents: list,
+        batch_size: int
+    ):
+        """
+        Generate one answer per (query, documents) pair. Prompts are filled from the template and 
+        fed to the local Hugging Face pipeline in padded batches. Models without a local pipeline 
+        (e.g., API-based models) are prompted one by one.
+
+        :param prompt_node: PromptNode holding the generator model.
+        :param prompt_template: PromptTemplate to fill with queries and documents.
+        :param queries: Questions to be answered by the generator model.
+        :param documents: Retrieved Documents, one list per query.
+        :param batch_size: Number of prompts per generator batch.
+        :return: List of answers, one per query.
+        """
+        pipe = getattr(prompt_node.prompt_model.model_invocation_layer, "pipe", None)
+        if pipe is None:
+            # PromptNode fills and truncates the prompts itself
+            answers = []
+            for query, query_documents in zip(queries, documents):
+                answers.extend(prompt_node.prompt(prompt_template, query=query, documents=query_documents))
+            return answers
+
+        # prompts are truncated so that the answer still fits within the model max length
+        max_prompt_tokens = max(0, pipe.tokenizer.model_max_length - self.max_ans_length)
+        prompts = []
+        n_truncated = 0
+        for query, query_documents in zip(queries, documents):
+            for filled_prompt in prompt_template.fill(query=query, documents=query_documents):
+                prompts.append(_truncate_prompt(pipe.tokenizer, filled_prompt, max_prompt_tokens))
+                n_truncated += prompts[-1] is not filled_prompt
+        if n_truncated:
+            print(f"Truncated {n_truncated} prompts to {max_prompt_tokens} tokens to fit the answer length.")
+
+        generation_kwargs = {}
+        # the tokenizer is shared with the PromptNode, its settings are restored after the batch
+        tokenizer_settings = (pipe.tokenizer.pad_token, pipe.tokenizer.padding_side)
+        try:
+            if pipe.task == "text-generation":
+                # decoder-only models need left padding to generate in batches
+                if pipe.tokenizer.pad_token is None:
+                    pipe.tokenizer.pad_token = pipe.tokenizer.eos_token
+                pipe.tokenizer.padding_side = "left"
+                generation_kwargs["max_new_tokens"] = self.max_ans_length
+                generation_kwargs["return_full_text"] = False
+            else:
+                generation_kwargs["max_length"] = self.max_ans_length
+            outputs = pipe(prompts, batch_size=batch_size, **generation_kwargs)
+        finally:
+            pipe.tokenizer.pad_token, pipe.tokenizer.padding_side = tokenizer_settings
+        return [output[0]["generated_text"] for output in outputs]
+
+    def _prepare_batch(self, prompt, queries, article_ids, top_k, chunk_queries=None):
+        """
+        Sizes the chunks for the longest query (of chunk_queries, if given), indexes the articles 
+        and embeds all queries in one batched pass.
+
+        :return: Tuple of the PromptTemplate and the query embeddings.
+        """
+        # a single chunk size for the batch, sized for the longest query
+        longest_query = max(
+            chunk_queries or queries, key=lambda query: self.token_cache.n_input_ids(self.qa_tokenizer, query))
+        self._get_context_size(prompt, longest_query)
+        self.ret_top_k = top_k
+        self._get_chunk_size()
+
+        # index all articles at once, embedding only chunks not indexed yet
+        params = {"retriever": {"filters": {"article_id": list(article_ids)}, "top_k": top_k}}
+        self._init_document_store(params)
+
+        # the generator model is loaded once per session, on the first answer missing from the cache
+        prompt_template = PromptTemplate(prompt=prompt)
+
+        # embed all queries in one batched pass
+        with instrumentation.span("embed_queries", queries=len(queries)):
+            query_embs = self.retriever.embed_queries(queries=list(queries))
+        return prompt_template, query_embs
+
+    def _answer_pairs(self, prompt, prompt_template, queries, article_ids, documents, batch_size):
+        """
+        Answers (query, article) pairs from their retrieved Documents. Answers found in the 
+        answer cache are reused, the others are generated in one batch and cached.
+
+        :return: List of answers, one per pair.
+        """
+        answers = [None] * len(queries)
+        keys = [None] * len(queries)
+        if self.answer_cache is not None:
+            for position, (query, article_id, pair_documents) in enumerate(zip(queries, article_ids, documents)):
+                keys[position] = self._answer_key("run_batch", prompt, query, article_id, pair_documents)
+                cached = self.answer_cache.get(keys[position])
+                if cached is not None:
+                    answers[position] = cached["answer"]
+            instrumentation.count("cached_answers", sum(answer is not None for answer in answers))
+        missing = [position for position, answer in enumerate(answers) if answer is None]
+        if missing:
+            with instrumentation.span("generate", pairs=len(missing)):
+                generated = self._generate_batch(
+                    self._get_prompt_node(prompt_template), prompt_template,
+                    [queries[position] for position in missing],
+                    [documents[position] for position in missing], batch_size)
+            for position, answer in zip(missing, generated):
+                answers[position] = answer
+                if keys[position] is not None:
+                    self.answer_cache.put(keys[position], {"answer": answer})
+        return answers
+
+    @staticmethod
+    def _batch_result(query, article_id, documents, answer):
+        return {
+            "query": query,
+            "article_id": article_id,
+            "answer": answer,
+            "chunk_ids": [document.meta["chunk_id"] for document in documents],
+            "scores": [document.score for document in documents],
+            "documents": documents
+        }
+
+    def _iter_batch(
+        self,
+        prompt: str,
+        queries: List[str],
+        article_ids: List[str],
+        top_k: int,
+        batch_size: int,
+        chunk_queries: Optional[List[str]] = None
+    ):
+        """
+        Generator behind run_batch, yielding one result per (query, article) pair as soon as 
+        its generator batch is done.
+        """
+        prompt_template, query_embs = self._prepare_batch(prompt, queries, article_ids, top_k, chunk_queries)
+        pairs = [
+            (query_position, article_id)
+            for query_position in range(len(queries))
+            for article_id in article_ids
+        ]
+        for start in range(0, len(pairs), batch_size):
+            batch_pairs = pairs[start: start + batch_size]
+            with instrumentation.span("retrieve", pairs=len(batch_pairs)):
+                batch_documents = self.document_store.query_by_embedding_batch(
+                    query_embs=[query_embs[query_position] for query_position, _ in batch_pairs],
+                    filters=[
+                        self._scoped_params(
+                            {"retriever": {"filters": {"article_id": article_id}}}
+                        )["retriever"]["filters"]
+                        for _, article_id in batch_pairs
+                    ],
+                    top_k=top_k,
+                    scale_score=self.retriever.scale_score)
+            batch_queries = [queries[query_position] for query_position, _ in batch_pairs]
+            batch_article_ids = [article_id for _, article_id in batch_pairs]
+            answers = self._answer_pairs(
+                prompt, prompt_template, batch_queries, batch_article_ids, batch_documents, batch_size)
+            for query, article_id, documents, answer in zip(
+                    batch_queries, batch_article_ids, batch_documents, answers):
+                yield self._batch_result(query, article_id, documents, answer)
+
+    def run_batch(
+        self,
+        prompt: str,
+        queries: List[str],
+        article_ids: List[str],
+        top_k: Optional[int] = 3,
+        batch_size: Optional[int] = 8,
+        stream: Optional[bool] = False,
+        chunk_queries: Optional[List[str]] = None
+    ):
+        """
+        Generate answers for every pair of queries and articles. The generator model and the 
+        retriever are loaded once per session, all queries are embedded in one batched pass, chunks are 
+        retrieved for all (query, article) pairs and the generator is fed in padded batches.
+
+        :param prompt: The name of hard coded prompts in prompt_template module: https://docs.haystack.deepset.ai/docs/prompt_node#prompttemplate-structure:~:text=List%20of%20legacy,translation%0ATranslates%20documents.
+            Else, user can specify their own prompts.
+        :param queries: Questions to be answered by the generator model.
+        :param article_ids: Ids of the articles each question is asked about.
+        :param top_k: Number of chunks retrieved per (query, article) pair.
+            If not set, default 3
+        :param batch_size: Number of (query, article) pairs per retrieval and generator batch.
+            If not set, default 8
+        :param stream: Whether to return a generator of results instead of a DataFrame.
+            If not set, default False
+        :param chunk_queries: Queries the chunk size is sized for, e.g. all questions of a run made of 
+            several run_batch calls, so the articles are chunked and embedded once.
+            If not set, default None (the queries of this call)
+        :return: DataFrame (or generator of dictionaries) of query, article_id, answer, 
+            chunk_ids, scores and documents.
+        """
+        if not top_k:
+            raise RuntimeError("Retriever top_k must be specified.")
+        results = self._iter_batch(prompt, queries, article_ids, top_k, batch_size, chunk_queries)
+        if stream:
+            return results
+        return pd.DataFrame(list(results))
+
+    def _iter_corpus(
+        self,
+        prompt: str,
+        queries: List[str],
+        article_ids: List[str],
+        top_k: int,
+        score_threshold: float,
+        batch_size: int
+    ):
+        """
+        Generator behind run_corpus. Results of articles below the score threshold are yielded 
+        first, then the generated answers as soon as their generator batch is done.
+        """
+        prompt_template, query_embs = self._prepare_batch(prompt, queries, article_ids, top_k)
+        # one grouped search over all chunks of the current chunking configuration
+        with instrumentation.span("retrieve", queries=len(queries), articles=len(article_ids)):
+            grouped = self.document_store.query_by_embedding_grouped(
+                query_embs=query_embs,
+                group_by="article_id",
+                filters={"chunk_key": [self._chunk_key()]},
+                top_k=top_k,
+                scale_score=self.retriever.scale_score)
+        selected = []
+        for query, article_documents in zip(queries, grouped):
+            for article_id in article_ids:
+                documents = article_documents.get(article_id)
+                if not documents:
+                    continue
+                result = self._batch_result(query, article_id, documents, None)
+                result["score"] = documents[0].score
+                if score_threshold is None or result["score"] >= score_threshold:
+                    selected.append(result)
+                else:
+                    yield result
+        instrumentation.count("selected_pairs", len(selected))
+        for start in range(0, len(selected), batch_size):
+            batch = selected[start: start + batch_size]
+            answers = self._answer_pairs(
+                prompt, prompt_template,
+                [result["query"] for result in batch],
+                [result["article_id"] for result in batch],
+                [result["documents"] for result in batch],
+                batch_size)
+            for result, answer in zip(batch, answers):
+                result["answer"] = answer
+                yield result
+
+    def run_corpus(
+        self,
+        prompt: str,
+        queries,
+        article_ids: Optional[List[str]] = None,
+        top_k: Optional[int] = 3,
+        score_threshold: Optional[float] = None,
+        batch_size: Optional[int] = 8,
+        stream: Optional[bool] = False
+    ):
+        """
+        Ask questions of every article in one pass, e.g. screening questions. The articles are 
+        indexed once, all queries are embedded in one batched pass and a single grouped search 
+        returns the top_k chunks of each article. Only articles whose best chunk scores at least 
+        score_threshold are passed to the generator.
+
+        :param prompt: The name of hard coded prompts in prompt_template module: https://docs.haystack.deepset.ai/docs/prompt_node#prompttemplate-structure:~:text=List%20of%20legacy,translation%0ATranslates%20documents.
+            Else, user can specify their own prompts.
+        :param queries: Question (or list of questions) to be answered by the generator model.
+        :param article_ids: Ids of the articles to ask about.
+            If not set, default None (all articles of the session)
+        :param top_k: Number of chunks retrieved per (query, article) pair.
+            If not set, default 3
+        :param score_threshold: Minimum score of the best chunk of an article for its answer to be generated. 
+            Scores are scaled to the unit interval unless the retriever's scale_score is off.
+            If not set, default None (every article is answered)
+        :param batch_size: Number of (query, article) pairs per generator batch.
+            If not set, default 8
+        :param stream: Whether to return a generator of results instead of a DataFrame.
+            If not set, default False
+        :return: DataFrame (or generator of dictionaries) of query, article_id, score (of the best chunk), 
+            answer (None below the threshold), chunk_ids, scores and documents.
+        """
+        if not top_k:
+            raise RuntimeError("Retriever top_k must be specified.")
+        if isinstance(queries, str):
+            queries = [queries]
+        article_ids = list(self.article_index) if article_ids is None else list(article_ids)
+        results = self._iter_corpus(prompt, queries, article_ids, top_k, score_threshold, batch_size)
+        if stream:
+            return results
+        return pd.DataFrame(list(results))
@@ -0,0 +1,110 @@
+"""Shared fixtures: a local mock of the Zotero web API."""
+
+import json
+import os
+import re
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+# run from a checkout without installing rrc
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class MockZotero():
+    """
+    In-memory Zotero library served over HTTP: versioned items with "since" and
+    If-Modified-Since-Version handling, deleted items, attachment files and scripted failures.
+    """
+    def __init__(self):
+        self.version = 0
+        self.items = {}
+        self.deleted = {}
+        self.files = {}
+        # (status, headers) returned by the next requests, before any routing
+        self.failures = []
+        # (path, query, headers, status) of every request
+        self.log = []
+        self.lock = threading.Lock()
+
+    def add_item(self, key, **data):
+        with self.lock:
+            self.version += 1
+            self.items[key] = {
+                "key": key, "version": self.version,
+                "data": {"key": key, "version": self.version, "collections": [], **data}
+            }
+
+    def delete_item(self, key):
+        with self.lock:
+            self.version += 1
+            self.items.pop(key)
+            self.deleted[key] = self.version
+
+    def add_attachment(self, key, parent_key, content):
+        self.add_item(
+            key, itemType="attachment", parentItem=parent_key, contentType="application/pdf",
+            linkMode="imported_file")
+        self.files[key] = content
+
+    def handle(self, path, query, headers):
+        """
+        Returns the status, headers and body of a request.
+        """
+        with self.lock:
+            if self.failures:
+                status, failure_headers = self.failures.pop(0)
+                return status, failure_headers, b""
+            version_headers = {"Last-Modified-Version": str(self.version)}
+            since = int(query.get("since", 0))
+            match = re.fullmatch(r"/users/1/items/(\w+)/file", path)
+            if match:
+                return 200, {"Content-Type": "application/pdf"}, self.files[match.group(1)]
+            if path == "/users/1/deleted":
+                keys = [key for key, version in self.deleted.items() if version > since]
+                return 200, version_headers, json.dumps({"items": keys}).encode()
+            if path == "/users/1/items":
+                if int(headers.get("If-Modified-Since-Version", -1)) >= self.version:
+                    return 304, version_headers, b""
+                items = [item for item in self.items.values() if item["version"] > since]
+                if "itemType" in query:
+                    items = [item for item in items if item["data"].get("itemType") == query["itemType"]]
+                start, limit = int(query.get("start", 0)), int(query.get("limit", 25))
+                return 200, {**version_headers, "Total-Results": str(len(items))}, \
+                    json.dumps(items[start: start + limit]).encode()
+            return 404, {}, b""
+
+
+@pytest.fixture
+def zotero_server():
+    """
+    Yields a MockZotero instance served on localhost, with its base URL in base_url.
+    """
+    library = MockZotero()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = {key: values[0] for key, values in parse_qs(url.query).items()}
+            status, headers, body = library.handle(url.path, query, self.headers)
+            library.log.append((url.path, query, dict(self.headers), status))
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    library.base_url = f"http://127.0.0.1:{server.server_port}"
+    yield library
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,81 @@
+"""Tests of the theme analysis over the chunks and embeddings of a small CorpusStore."""
+
+import numpy as np
+import pytest
+
+pytest.importorskip("faiss")
+pytest.importorskip("sklearn")
+
+from rrc.analysis import ThemeModel, iter_corpus_chunks
+from rrc.corpus import CorpusStore
+
+MODEL = "context-encoder"
+TOPICS = [
+    ["queue", "waiting", "arrival", "server"],
+    ["surgery", "operating", "theatre", "schedule"],
+    ["emergency", "triage", "ambulance", "department"],
+]
+
+
+def _chunks(topic, n_chunks, first_id, rng):
+    # each topic has its own words and its own direction in the embedding space
+    centre = np.zeros(16, dtype=np.float32)
+    centre[topic * 5] = 1.0
+    ids = [f"chunk-{first_id + position}" for position in range(n_chunks)]
+    texts = [" ".join(rng.choice(TOPICS[topic], size=6)) for _ in ids]
+    vectors = centre + rng.normal(scale=0.05, size=(n_chunks, 16)).astype(np.float32)
+    return ids, texts, vectors
+
+
+def _add(corpus, ids, texts, vectors, model=MODEL):
+    corpus.append("chunks", [
+        {"id": id_, "chunk_id": id_, "article_id": "article", "content": text} for id_, text in zip(ids, texts)])
+    corpus.add_embeddings(ids, vectors, model)
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    rng = np.random.default_rng(0)
+    corpus = CorpusStore(str(tmp_path / "corpus"))
+    for topic in range(3):
+        _add(corpus, *_chunks(topic, 20, topic * 20, rng))
+    return corpus
+
+
+def test_corpus_chunks_are_read_in_batches(corpus):
+    ids, vectors = corpus.load_embeddings(MODEL)
+    # embeddings of another model and superseded embeddings are left out
+    corpus.add_embeddings(ids[:5], np.zeros((5, 16)), "other-model")
+    corpus.add_embeddings(ids[:2], vectors[:2] * 2, MODEL)
+    batches = list(iter_corpus_chunks(corpus, MODEL, batch_size=7))
+    assert all(len(batch_ids) <= 7 for batch_ids, _, _ in batches)
+    batch_ids = np.concatenate([batch_ids for batch_ids, _, _ in batches])
+    assert sorted(batch_ids) == sorted(ids)
+    by_id = {id_: (vector, text) for batch in batches for id_, vector, text in zip(*batch)}
+    np.testing.assert_array_equal(by_id[ids[0]][0], vectors[0] * 2)
+    np.testing.assert_array_equal(by_id[ids[10]][0], vectors[10])
+    contents = dict(zip(*corpus.load_table("chunks", columns=["id", "content"]).to_pydict().values()))
+    assert all(text == contents[id_] for id_, (_, text) in by_id.items())
+
+
+def test_theme_model_fit_and_update(corpus, tmp_path):
+    model = ThemeModel(n_themes=3, n_keywords=2).fit(iter_corpus_chunks(corpus, MODEL, batch_size=16))
+    labels = model.labels()
+    assert len(labels) == 60 and model.sizes.sum() == 60
+    # the chunks of each topic share a theme
+    topics = labels["id"].map(lambda id_: int(id_.split("-")[1]) // 20)
+    assert labels.groupby(topics)["theme"].nunique().tolist() == [1, 1, 1]
+    theme = labels["theme"][topics == 1].iloc[0]
+    assert {term for term, _ in model.keywords(theme)} <= set(TOPICS[1])
+
+    # chunks of new articles, e.g. from the corpus of a later session, join the theme of their topic
+    centroids = model.centroids.copy()
+    new_corpus = CorpusStore(str(tmp_path / "new_corpus"))
+    new_ids, new_texts, new_vectors = _chunks(1, 10, 60, np.random.default_rng(1))
+    _add(new_corpus, new_ids, new_texts, new_vectors)
+    model.update(iter_corpus_chunks(new_corpus, MODEL))
+    assert model.sizes.sum() == 70
+    assert model.sizes[theme] == 30
+    labels = model.labels()
+    assert set(labels["theme"][labels["id"].isin(new_ids)]) == {theme}
+    assert not np.allclose(model.centroids[theme], centroids[theme])
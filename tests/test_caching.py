@@ -0,0 +1,107 @@
+"""Tests of the session caches: token IDs with a stand-in tokenizer that counts its calls, and generated answers."""
+
+import os
+import re
+
+import numpy as np
+
+from rrc.caching import AnswerCache, TokenCache
+
+
+class CountingTokenizer():
+    """
+    Splits on whitespace, with one token ID per word (its length) between [CLS] and [SEP] IDs.
+    """
+    name_or_path = "stub/tokenizer"
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, texts, add_special_tokens=True, return_offsets_mapping=False, **kwargs):
+        self.calls.append(texts)
+        if isinstance(texts, str):
+            return {"input_ids": [101] + [len(word) for word in texts.split()] + [102]}
+        return {"offset_mapping": [
+            [match.span() for match in re.finditer(r"\S+", text)] for text in texts]}
+
+
+def test_token_cache_evicts_least_recently_used():
+    tokenizer = CountingTokenizer()
+    # 5 token IDs per text, two texts fit
+    cache = TokenCache(max_tokens=10)
+    for text in ("a b c", "d e f"):
+        cache.input_ids(tokenizer, text)
+    cache.input_ids(tokenizer, "a b c")
+    cache.input_ids(tokenizer, "g h i")
+    assert cache.n_tokens == 10
+    assert (cache.hits, cache.misses) == (1, 3)
+    # "d e f" was the least recently used
+    cache.input_ids(tokenizer, "a b c")
+    cache.input_ids(tokenizer, "d e f")
+    assert tokenizer.calls == ["a b c", "d e f", "g h i", "d e f"]
+    # an entry larger than the bound is still kept, alone
+    cache.input_ids(tokenizer, " ".join("x" * 20))
+    assert len(cache._entries) == 1 and cache.n_tokens == 22
+
+
+def test_token_cache_persists_across_sessions(tmp_path):
+    tokenizer = CountingTokenizer()
+    cache = TokenCache(cache_dir=str(tmp_path))
+    input_ids = cache.input_ids(tokenizer, "patient flow model", persist=True)
+    offsets = cache.offsets_batch(tokenizer, ["patient flow", "queue"], persist=True)
+    np.testing.assert_array_equal(offsets[0], [[0, 7], [8, 12]])
+    assert len(tokenizer.calls) == 2
+
+    # a later session reads the persisted entries instead of tokenizing
+    cache = TokenCache(cache_dir=str(tmp_path))
+    np.testing.assert_array_equal(cache.input_ids(tokenizer, "patient flow model", persist=True), input_ids)
+    reloaded = cache.offsets_batch(tokenizer, ["patient flow", "queue", "new text"], persist=True)
+    np.testing.assert_array_equal(reloaded[1], offsets[1])
+    assert tokenizer.calls[2:] == [["new text"]]
+
+    # clear only empties memory; entries that were not persisted are tokenized again
+    cache.clear()
+    assert cache.n_tokens == 0
+    cache.input_ids(tokenizer, "patient flow model", persist=True)
+    cache.input_ids(tokenizer, "not persisted")
+    cache.input_ids(tokenizer, "not persisted")
+    assert tokenizer.calls[3:] == ["not persisted"]
+
+
+def _key(query, chunk_ids=("a_0",)):
+    return AnswerCache.key(prompt="p", query=query, article_id="a", chunk_ids=list(chunk_ids), model="m")
+
+
+def test_answer_cache_evicts_least_recently_used():
+    cache = AnswerCache(max_entries=2)
+    cache.put(_key("q1"), {"answer": "1"})
+    cache.put(_key("q2"), {"answer": "2"})
+    assert cache.get(_key("q1")) == {"answer": "1"}
+    cache.put(_key("q3"), {"answer": "3"})
+    assert cache.get(_key("q2")) is None
+    assert cache.get(_key("q1")) == {"answer": "1"}
+    assert cache.stats() == {"hits": 2, "misses": 1, "entries": 2}
+    # other retrieved chunks are another key
+    assert _key("q1", ("a_1",)) != _key("q1")
+
+
+def test_answer_cache_persists_and_bounds_the_disk(tmp_path):
+    cache = AnswerCache(cache_dir=str(tmp_path), max_disk_entries=10)
+    keys = [_key(f"q{position}") for position in range(10)]
+    for position, key in enumerate(keys):
+        cache.put(key, {"answer": str(position)})
+        # persisted answers are ordered by last use, oldest first
+        os.utime(tmp_path / f"{key}.json", (1_000 + position, 1_000 + position))
+
+    # a later session reads the persisted answers; reading one marks it as recently used
+    cache = AnswerCache(max_entries=1, cache_dir=str(tmp_path), max_disk_entries=10)
+    assert cache.get(keys[0]) == {"answer": "0"}
+    cache.put(_key("q10"), {"answer": "10"})
+    # over the bound, the least recently used files are removed down to 90% of it
+    remaining = {name[:-len(".json")] for name in os.listdir(tmp_path)}
+    assert remaining == {keys[0], _key("q10"), *keys[3:]}
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[5]) == {"answer": "5"}
+
+    cache.clear(persisted=True)
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,83 @@
+"""Tests of TokenChunker with a small WordPiece tokenizer trained on the test text."""
+
+import random
+
+import numpy as np
+import pytest
+
+pytest.importorskip("tokenizers")
+transformers = pytest.importorskip("transformers")
+
+from tokenizers import BertWordPieceTokenizer
+
+from rrc.chunking import TokenChunker
+
+
+def _text(n_words=4000, seed=0):
+    rng = random.Random(seed)
+    syllables = ["pa", "ti", "ent", "flow", "sim", "ula", "tion", "queue", "de", "part", "ment", "emer", "gen", "cy"]
+    words = []
+    for _ in range(n_words):
+        word = "".join(rng.choice(syllables) for _ in range(rng.randint(1, 6)))
+        words.append(word + rng.choice(["", "", "", ",", ".", "-based", "'s"]))
+    # a run of text without spaces, as extracted from some PDFs
+    words.insert(n_words // 2, "".join(rng.choice(syllables) for _ in range(300)))
+    return " ".join(words)
+
+
+@pytest.fixture(scope="module")
+def tokenizer():
+    # rare syllable combinations split into several subword tokens
+    wordpiece = BertWordPieceTokenizer(lowercase=True)
+    wordpiece.train_from_iterator([_text(seed=seed) for seed in range(3)], vocab_size=120)
+    return transformers.BertTokenizerFast(
+        tokenizer_object=wordpiece._tokenizer,
+        unk_token="[UNK]", sep_token="[SEP]", pad_token="[PAD]", cls_token="[CLS]", mask_token="[MASK]")
+
+
+@pytest.mark.parametrize("options", [{}, {"overlap": 20}, {"snap_to_sentence": True}])
+def test_chunks_tokenize_within_chunk_size(tokenizer, options):
+    text = _text(seed=7)
+    chunker = TokenChunker(tokenizer, 64, **options)
+    chunks = chunker.chunk(text)
+    assert chunks
+    for chunk in chunks:
+        assert chunk["text"] == text[chunk["start_char"]:chunk["end_char"]]
+        assert len(tokenizer(chunk["text"], add_special_tokens=False)["input_ids"]) <= 64
+
+
+@pytest.mark.parametrize("options", [{}, {"overlap": 20}])
+def test_chunks_are_cut_on_word_boundaries(tokenizer, options):
+    text = _text(seed=7)
+    chunks = TokenChunker(tokenizer, 64, **options).chunk(text)
+    run_start = text.index(max(text.split(" "), key=len))
+    run_end = run_start + len(max(text.split(" "), key=len))
+    for chunk in chunks:
+        start, end = chunk["start_char"], chunk["end_char"]
+        # only the run without spaces is longer than a chunk and may be cut inside
+        if not run_start < start < run_end:
+            assert start == 0 or text[start - 1] == " "
+        if not run_start < end < run_end:
+            assert end == len(text) or not text[end].isalnum()
+    # every character outside the overlaps is in exactly one chunk
+    if not options:
+        assert "".join(text[chunk["start_char"]:chunk["end_char"]] for chunk in chunks).replace(" ", "") \
+            == text.replace(" ", "")
+
+
+def test_chunk_stats_match_the_chunk_lengths_in_bounded_memory(tokenizer):
+    chunker = TokenChunker(tokenizer, 64, overlap=10, snap_to_sentence=True)
+    assert chunker.chunk_stats() == {"chunks": 0}
+    lengths = []
+    for seed in range(3):
+        lengths.extend(chunk["n_tokens"] for chunk in chunker.chunk(_text(n_words=1500, seed=seed)))
+    lengths.extend(chunk["n_tokens"] for text_chunks in chunker.chunk_batch(["flow", ""]) for chunk in text_chunks)
+
+    stats = chunker.chunk_stats()
+    assert stats["chunks"] == len(lengths)
+    assert (stats["min"], stats["max"]) == (min(lengths), max(lengths))
+    assert stats["mean"] == pytest.approx(np.mean(lengths))
+    for q in (5, 50, 95):
+        assert stats[f"p{q}"] == pytest.approx(np.percentile(lengths, q))
+    # one count per possible chunk length, however many chunks were produced
+    assert chunker.length_counts.shape == (65,)
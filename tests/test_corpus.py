@@ -0,0 +1,72 @@
+"""Tests of CorpusStore: metadata joins, superseded rows and compaction."""
+
+import os
+
+import numpy as np
+
+from rrc.corpus import CorpusStore
+
+
+def _parts(corpus, table):
+    return [name for name in os.listdir(os.path.join(corpus.corpus_dir, table)) if name.endswith(".arrow")]
+
+
+def test_articles_are_joined_with_metadata_and_superseded(tmp_path):
+    corpus = CorpusStore(str(tmp_path))
+    corpus.add_metadata([
+        {"key": "K1", "title": "Patient flow", "creators": [{"lastName": "Allen"}]},
+        {"key": "K2", "title": "Triage"},
+    ])
+    corpus.add_articles([
+        {"article_id": "A1", "extracted_text": "first text", "source_path": "a1.pdf", "key": "K1"},
+        {"article_id": "A2", "extracted_text": "second text", "source_path": "a2.pdf", "key": "K2"},
+    ])
+    article = corpus.load("A1")
+    assert article["title"] == "Patient flow"
+    assert article["creators"] == '[{"lastName": "Allen"}]'
+
+    # re-extraction and newer metadata supersede the earlier rows
+    corpus.add_metadata([{"key": "K1", "title": "Patient flow, revised"}])
+    corpus.add_articles([{"article_id": "A1", "extracted_text": "re-extracted", "source_path": "b1.pdf", "key": "K1"}])
+    assert len(corpus) == 2 and sorted(corpus) == ["A1", "A2"]
+    article = corpus.load("A1")
+    assert (article["extracted_text"], article["title"]) == ("re-extracted", "Patient flow, revised")
+    assert corpus.path("A1") == "b1.pdf"
+    assert corpus.load("missing") is None and "missing" not in corpus
+
+
+def test_compact_keeps_the_latest_rows(tmp_path):
+    corpus = CorpusStore(str(tmp_path))
+    for version in range(3):
+        corpus.add_articles([
+            {"article_id": "A1", "extracted_text": f"version {version}"},
+            {"article_id": f"B{version}", "extracted_text": "other"},
+        ])
+    corpus.add_metadata([{"key": "K1", "title": "old"}])
+    corpus.add_metadata([{"key": "K1", "title": "new"}])
+    assert len(_parts(corpus, "articles")) == 3
+
+    corpus.compact("articles")
+    corpus.compact("metadata")
+    assert len(_parts(corpus, "articles")) == 1 and len(_parts(corpus, "metadata")) == 1
+    assert corpus.load_table("articles").num_rows == 4
+    assert corpus.load("A1")["extracted_text"] == "version 2"
+    assert corpus.load_table("metadata").to_pylist() == [{"key": "K1", "title": "new"}]
+
+    # reopened from disk
+    corpus = CorpusStore(str(tmp_path))
+    assert sorted(corpus) == ["A1", "B0", "B1", "B2"]
+    assert corpus.load("A1")["extracted_text"] == "version 2"
+
+
+def test_later_embeddings_supersede_earlier_ones(tmp_path):
+    corpus = CorpusStore(str(tmp_path))
+    corpus.add_embeddings(["c1", "c2"], np.ones((2, 4)), "model")
+    corpus.add_embeddings(["c1"], np.full((1, 4), 2.0), "model")
+    corpus.add_embeddings(["c1"], np.full((1, 4), 3.0), "other-model")
+    ids, embeddings = corpus.load_embeddings("model")
+    assert sorted(ids) == ["c1", "c2"]
+    np.testing.assert_array_equal(embeddings[ids.index("c1")], [2.0] * 4)
+    corpus.compact("embeddings")
+    ids, embeddings = corpus.load_embeddings("model")
+    np.testing.assert_array_equal(embeddings[ids.index("c1")], [2.0] * 4)
@@ -0,0 +1,56 @@
+"""Tests of FilteredFAISSDocumentStore with small random embeddings."""
+
+import numpy as np
+import pytest
+
+pytest.importorskip("haystack")
+pytest.importorskip("torch")
+
+from haystack.schema import Document
+
+from rrc import indexing
+from rrc.run_session import FilteredFAISSDocumentStore
+
+DIM = 16
+
+
+def _documents(article_id, n_documents, rng):
+    embeddings = rng.normal(size=(n_documents, DIM)).astype(np.float32)
+    return [
+        Document(content=f"{article_id} chunk {position}", id=f"{article_id}_{position}",
+                 embedding=embedding, meta={"article_id": article_id})
+        for position, embedding in enumerate(embeddings)
+    ]
+
+
+@pytest.mark.parametrize("index_spec", ["Flat", "float16", "HNSW32", "IVF2,Flat"])
+def test_delete_documents_renumbers_vector_ids(tmp_path, index_spec):
+    rng = np.random.default_rng(0)
+    store = FilteredFAISSDocumentStore(
+        sql_url=f"sqlite:///{tmp_path / 'store.db'}", embedding_dim=DIM, faiss_index_factory_str=index_spec)
+    documents = {document.id: document for article_id in ("A", "B", "C") for document in _documents(article_id, 6, rng)}
+    indexing.train_index(
+        store.faiss_indexes[store.index], np.stack([document.embedding for document in documents.values()]))
+    store.write_documents(list(documents.values()))
+
+    # the deleted vectors are in the middle of the index
+    store.delete_documents(filters={"article_id": ["B"]})
+    store.delete_documents(ids=["A_0", "C_5"])
+    # embeddings added afterwards must not take the vector ids of remaining documents
+    new_documents = _documents("D", 4, rng)
+    store.write_documents(new_documents)
+    documents.update((document.id, document) for document in new_documents)
+
+    stored = store.get_all_documents(return_embedding=True)
+    vector_ids = sorted(int(document.meta["vector_id"]) for document in stored)
+    assert vector_ids == list(range(len(stored))) == list(range(store.faiss_indexes[store.index].ntotal))
+    assert sorted(document.id for document in stored) == sorted(
+        [f"A_{position}" for position in range(1, 6)] + [f"C_{position}" for position in range(5)]
+        + [f"D_{position}" for position in range(4)])
+    for document in stored:
+        np.testing.assert_allclose(document.embedding, documents[document.id].embedding, atol=1e-2)
+
+    # a stored embedding finds its own document
+    for document_id in ("A_1", "C_4", "D_3"):
+        found = store.query_by_embedding(documents[document_id].embedding, top_k=1)
+        assert found[0].id == document_id
@@ -0,0 +1,90 @@
+"""Tests of the PDF extraction pool fed by a lazy source, e.g. concurrent downloads."""
+
+import glob
+import os
+import time
+
+import pytest
+
+from rrc.corpus import CorpusStore
+from rrc.text_extraction import PDFExtractor, ZoteroAPIMetaExtractor
+
+PDF_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tutorials", "articles")
+
+
+class StubExtractor(PDFExtractor):
+    """
+    Extracts nothing: PDFs named hang*.pdf never finish, the others finish at once.
+    """
+    def _extract_to_file(self, extractor, path, dest_dir, article_id=None, output_format="json"):
+        if os.path.basename(path).startswith("hang"):
+            time.sleep(60)
+        return {"path": path, "json_file_name": os.path.basename(path) + ".json"}
+
+
+def _slow_source(paths, delay):
+    # the second PDF arrives after a delay, like a download in progress
+    yield paths[0]
+    time.sleep(delay)
+    yield from paths[1:]
+
+
+def _timed_results(results):
+    start = time.monotonic()
+    return [(time.monotonic() - start, result) for result in results]
+
+
+def test_pool_times_out_while_waiting_for_the_source(tmp_path):
+    extractor = StubExtractor(str(tmp_path))
+    paths = [str(tmp_path / "hang.pdf"), str(tmp_path / "ok.pdf")]
+    results = _timed_results(extractor._run_pool(
+        "PdfReader", _slow_source(paths, 3), str(tmp_path), {}, workers=2, timeout=0.5))
+    seconds, result = results[0]
+    assert result["path"] == paths[0] and "Timed out" in result["error"]
+    assert seconds < 2
+    assert [result["path"] for _, result in results] == paths
+
+
+def test_pool_collects_results_while_waiting_for_the_source(tmp_path):
+    extractor = StubExtractor(str(tmp_path))
+    paths = [str(tmp_path / "first.pdf"), str(tmp_path / "second.pdf")]
+    results = _timed_results(extractor._run_pool(
+        "PdfReader", _slow_source(paths, 2), str(tmp_path), {}, workers=2))
+    assert results[0][1] == {"path": paths[0], "json_file_name": "first.pdf.json"}
+    assert results[0][0] < 1.5
+
+
+def test_pool_raises_errors_of_the_source(tmp_path):
+    def failing_source():
+        yield str(tmp_path / "ok.pdf")
+        raise RuntimeError("download failed")
+
+    extractor = StubExtractor(str(tmp_path))
+    with pytest.raises(RuntimeError, match="download failed"):
+        list(extractor._run_pool("PdfReader", failing_source(), str(tmp_path), {}, workers=2))
+
+
+def test_download_and_extract(zotero_server, tmp_path):
+    pytest.importorskip("PyPDF2")
+    pdf_paths = sorted(glob.glob(os.path.join(PDF_DIR, "*.pdf")))[:2]
+    if len(pdf_paths) < 2:
+        pytest.skip("tutorial PDFs not available")
+    for position, pdf_path in enumerate(pdf_paths):
+        zotero_server.add_item(f"P{position}", title=f"Parent {position}")
+        with open(pdf_path, "rb") as pdf_file:
+            zotero_server.add_attachment(f"F{position}", f"P{position}", pdf_file.read())
+    corpus = CorpusStore(str(tmp_path / "corpus"))
+    (tmp_path / "pdfs").mkdir()
+    (tmp_path / "extracted").mkdir()
+
+    zotero = ZoteroAPIMetaExtractor("json", base_url=zotero_server.base_url)
+    filename_list = zotero.download_and_extract(
+        PDFExtractor(str(tmp_path / "pdfs")), "PdfReader", "1", "user", "key",
+        pdf_dir=str(tmp_path / "pdfs"), dest_dir=str(tmp_path / "extracted"), workers=2, timeout=120,
+        corpus=corpus)
+
+    assert len(filename_list) == 2
+    assert all(not result.get("error") for result in zotero.download_results)
+    # articles are keyed by the Zotero key of their parent item
+    articles = corpus.load_table("articles", columns=["key", "source_path"]).to_pylist()
+    assert sorted(article["key"] for article in articles) == ["P0", "P1"]
@@ -0,0 +1,51 @@
+"""Tests of the Tracer spans, counters and JSON trace export."""
+
+import json
+import time
+
+from rrc import instrumentation
+from rrc.instrumentation import Tracer
+
+
+def test_export_json_writes_a_trace_event_file(tmp_path):
+    tracer = Tracer()
+    with tracer.span("extract.pdf", path="a.pdf") as outer:
+        with tracer.span("extract.page", page=1) as inner:
+            time.sleep(0.01)
+            # attributes added while the span runs, values that are not JSON are written as strings
+            inner["attributes"]["fallback"] = None
+            inner["attributes"]["bbox"] = (1.0, 2.0)
+        tracer.record("extract.worker", 0.5, worker=7)
+        tracer.count("pages")
+        tracer.count("pages", 2)
+    assert inner["parent"] == "extract.pdf" and outer["parent"] is None
+
+    path = tmp_path / "trace.json"
+    tracer.export_json(str(path))
+    with open(path) as file:
+        trace = json.load(file)
+    events = {event["name"]: event for event in trace["traceEvents"]}
+    assert set(events) == {"extract.pdf", "extract.page", "extract.worker"}
+    assert all(event["ph"] == "X" for event in events.values())
+    # microseconds, the inner span within the outer one
+    page, pdf = events["extract.page"], events["extract.pdf"]
+    assert page["dur"] >= 10_000
+    assert pdf["ts"] <= page["ts"] and page["ts"] + page["dur"] <= pdf["ts"] + pdf["dur"]
+    assert events["extract.worker"]["dur"] == 500_000
+    assert page["args"] == {"page": 1, "fallback": None, "bbox": "(1.0, 2.0)"}
+    assert trace["metadata"]["counters"] == {"pages": 3}
+    assert trace["metadata"]["spans"]["extract.page"]["calls"] == 1
+
+
+def test_disabled_tracing_records_nothing(tmp_path):
+    previous = instrumentation.disable_tracing()
+    try:
+        with instrumentation.span("chunk") as span:
+            assert span is None
+        instrumentation.count("chunks", 5)
+        tracer = instrumentation.get_tracer()
+        tracer.export_json(str(tmp_path / "trace.json"))
+        with open(tmp_path / "trace.json") as file:
+            assert json.load(file) == {"traceEvents": [], "metadata": {"spans": {}, "counters": {}}}
+    finally:
+        instrumentation.set_tracer(previous)
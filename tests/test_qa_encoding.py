@@ -0,0 +1,101 @@
+"""Tests of QAEncoder runs, interrupted and resumed, with a stand-in RapidReviewSession."""
+
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from rrc.qa_encoding import QAEncoder, load_results, task_id
+
+PROMPT = "Answer {query} from {join(documents)}"
+QUESTIONS = ["Which methods?", "Which outcomes?"]
+ARTICLES = [f"article-{position}" for position in range(5)]
+
+
+class StubSession():
+    """
+    Answers every (question, article) pair like RapidReviewSession.run_batch(stream=True), and
+    raises KeyboardInterrupt instead of the answer number fail_at, like a run stopped by the user.
+    """
+    def __init__(self, article_ids=ARTICLES, fail_at=None):
+        self.article_index = list(article_ids)
+        self.fail_at = fail_at
+        self.answered = []
+
+    def run_batch(self, prompt, queries, article_ids, top_k=3, batch_size=8, stream=False, chunk_queries=None):
+        assert stream
+        for query in queries:
+            for article_id in article_ids:
+                if len(self.answered) == self.fail_at:
+                    raise KeyboardInterrupt
+                self.answered.append((query, article_id))
+                # the first article has no chunks, so nothing is retrieved
+                retrieved = article_id != ARTICLES[0]
+                yield {
+                    "query": query,
+                    "article_id": article_id,
+                    "answer": f"{query} {article_id}" if retrieved else None,
+                    "chunk_ids": [f"{article_id}_0"] if retrieved else [],
+                    "scores": [0.5] if retrieved else [],
+                    "documents": []
+                }
+
+
+def _output_path(tmp_path, output_format):
+    return str(tmp_path / ("answers.jsonl" if output_format == "jsonl" else "answers"))
+
+
+@pytest.mark.parametrize("output_format", ["jsonl", "parquet"])
+def test_interrupted_run_resumes_without_duplicates(tmp_path, output_format):
+    output_path = _output_path(tmp_path, output_format)
+    with pytest.raises(KeyboardInterrupt):
+        QAEncoder(StubSession(fail_at=7), output_path, checkpoint_every=3).run(PROMPT, QUESTIONS, article_block_size=2)
+    # everything answered before the interruption is kept
+    assert len(load_results(output_path)) == 7
+    if output_format == "jsonl":
+        # a line cut short by a crash
+        with open(output_path, "ab") as file:
+            file.write(b'{"task_id": "cut sh')
+
+    session = StubSession()
+    progress = QAEncoder(session, output_path, checkpoint_every=3).run(PROMPT, QUESTIONS, article_block_size=2)
+    assert len(session.answered) == 3
+    assert progress["completed"] == progress["tasks"] == 10
+    results = load_results(output_path)
+    assert not results["task_id"].duplicated().any()
+    assert set(results["task_id"]) == {
+        task_id(PROMPT, question, article_id) for question in QUESTIONS for article_id in ARTICLES}
+    assert len(results) == 10
+
+
+@pytest.mark.parametrize("output_format", ["jsonl", "parquet"])
+def test_missing_articles_are_skipped(tmp_path, output_format):
+    output_path = _output_path(tmp_path, output_format)
+    session = StubSession(article_ids=ARTICLES[:3])
+    progress = QAEncoder(session, output_path).run(PROMPT, QUESTIONS, article_ids=ARTICLES[:4])
+    assert progress["missing_articles"] == 1
+    assert {article_id for _, article_id in session.answered} == set(ARTICLES[:3])
+    assert set(load_results(output_path)["article_id"]) == set(ARTICLES[:3])
+
+    # the article is answered once it is in the corpus
+    session = StubSession(article_ids=ARTICLES[:4])
+    progress = QAEncoder(session, output_path).run(PROMPT, QUESTIONS, article_ids=ARTICLES[:4])
+    assert session.answered == [(question, ARTICLES[3]) for question in QUESTIONS]
+    assert progress["completed"] == 8 and progress["missing_articles"] == 0
+
+
+def test_parquet_parts_without_retrieved_chunks_are_loaded(tmp_path):
+    output_path = _output_path(tmp_path, "parquet")
+    # a part whose pairs have no chunks and no answer
+    QAEncoder(StubSession(), output_path).run(PROMPT, QUESTIONS, article_ids=ARTICLES[:1])
+    QAEncoder(StubSession(), output_path).run(PROMPT, QUESTIONS, article_ids=ARTICLES[1:])
+    # a part written without a schema infers null types
+    legacy = [{
+        "task_id": "legacy", "question": "q", "article_id": "a", "answer": None,
+        "chunk_ids": [], "scores": [], "encoded_at": "2026-01-01T00:00:00"}]
+    pq.write_table(pa.Table.from_pylist(legacy), os.path.join(output_path, "part-0.parquet"))
+    results = load_results(output_path)
+    assert len(results) == 11
+    assert list(results.loc[results["article_id"] == ARTICLES[1], "chunk_ids"].iloc[0]) == [f"{ARTICLES[1]}_0"]
+    assert list(results.loc[results["task_id"] == "legacy", "chunk_ids"].iloc[0]) == []
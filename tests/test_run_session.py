@@ -0,0 +1,134 @@
+"""Tests of RapidReviewSession model reuse, chunking and generation, with stand-in models instead of downloaded ones."""
+
+import types
+
+import pytest
+
+pytest.importorskip("haystack")
+pytest.importorskip("torch")
+
+from haystack.nodes import PromptTemplate
+from haystack.schema import Document
+
+from tokenizers import BertWordPieceTokenizer
+from transformers import BertTokenizerFast
+
+from rrc import run_session
+from rrc.caching import ModelCache
+from rrc.corpus import CorpusStore
+from rrc.run_session import RapidReviewSession
+
+
+class StubPromptNode():
+    """
+    Records the arguments each PromptNode is loaded with.
+    """
+    loaded = []
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.default_prompt_template = kwargs["default_prompt_template"]
+        StubPromptNode.loaded.append(kwargs)
+
+
+def _tokenizer(text):
+    wordpiece = BertWordPieceTokenizer(lowercase=True)
+    wordpiece.train_from_iterator([text], vocab_size=100)
+    return BertTokenizerFast(
+        tokenizer_object=wordpiece._tokenizer,
+        unk_token="[UNK]", sep_token="[SEP]", pad_token="[PAD]", cls_token="[CLS]", mask_token="[MASK]")
+
+
+def _session(tmp_path, model_cache, **options):
+    return RapidReviewSession(
+        str(tmp_path), ("query-encoder", "context-encoder"), "generator", model_cache=model_cache,
+        sql_url=f"sqlite:///{tmp_path / 'store.db'}", **options)
+
+
+def test_prompt_node_is_reused_only_with_the_same_loader_arguments(tmp_path, monkeypatch):
+    monkeypatch.setattr(run_session, "PromptNode", StubPromptNode)
+    StubPromptNode.loaded = []
+    model_cache = ModelCache()
+    template = PromptTemplate(prompt="Answer {query}")
+
+    prompt_node = _session(
+        tmp_path, model_cache, qa_model_kwargs={"task_name": "text-generation", "model_max_length": 512}
+    )._get_prompt_node(template)
+    # the same arguments in another session, in another key order, reuse the loaded node
+    other_template = PromptTemplate(prompt="Summarize {query}")
+    session = _session(tmp_path, model_cache, qa_model_kwargs={"model_max_length": 512, "task_name": "text-generation"})
+    assert session._get_prompt_node(other_template) is prompt_node
+    assert prompt_node.default_prompt_template is other_template
+    assert len(StubPromptNode.loaded) == 1
+
+    # any other loader argument loads another node
+    for options in ({"qa_model_kwargs": {"task_name": "text2text-generation"}}, {"qa_model_kwargs": None},
+                    {"qa_model_kwargs": {"task_name": "text-generation"}, "use_gpu": False},
+                    {"qa_model_kwargs": {"task_name": "text-generation"}, "max_ans_length": 20}):
+        assert _session(tmp_path, model_cache, **options)._get_prompt_node(template) is not prompt_node
+    assert [loaded["model_kwargs"] for loaded in StubPromptNode.loaded] == [
+        {"task_name": "text-generation", "model_max_length": 512}, {"task_name": "text2text-generation"}, None,
+        {"task_name": "text-generation"}, {"task_name": "text-generation"}]
+    assert StubPromptNode.loaded[3]["use_gpu"] is False and StubPromptNode.loaded[4]["max_length"] == 20
+
+
+def test_chunk_stats_leave_the_session_chunk_size_unchanged(tmp_path):
+    text = " ".join(f"patient flow {position} in the emergency department." for position in range(200))
+    corpus = CorpusStore(str(tmp_path / "corpus"))
+    corpus.add_articles([{"article_id": "A1", "extracted_text": text, "source_path": "a1.pdf"}])
+    model_cache = ModelCache()
+    tokenizer = _tokenizer(text)
+    for model_name in ("context-encoder", "generator"):
+        model_cache.get("tokenizer", model_name, None, lambda: tokenizer)
+    session = _session(tmp_path, model_cache, corpus=corpus)
+    session.chunk_size = 64
+    chunker = session._get_chunker()
+
+    stats = session.get_chunk_stats(["A1"], chunk_size=32)
+    assert stats["chunk_size"] == 32 and stats["max"] <= 32
+    assert session.chunk_size == 64 and session._get_chunker() is chunker
+
+    # chunks of another chunk size are keyed by their own chunk size, not the session's
+    documents = session._chunk_articles({"retriever": {"filters": {"article_id": "A1"}}}, session._new_chunker(32))
+    assert {document.meta["chunk_key"] for document in documents} == {session._chunk_key(32)}
+    assert session._chunk_key(32) != session._chunk_key()
+    session_ids = {document.id for document in session._chunk_articles({"retriever": {"filters": {"article_id": "A1"}}})}
+    assert session_ids.isdisjoint(document.id for document in documents)
+
+
+class StubPipe():
+    """
+    Text generation pipeline that records the prompts and the tokenizer padding side it is called with.
+    """
+    task = "text-generation"
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.calls = []
+
+    def __call__(self, prompts, batch_size, **kwargs):
+        self.calls.append((prompts, self.tokenizer.padding_side, kwargs))
+        return [[{"generated_text": f"answer {position}"}] for position in range(len(prompts))]
+
+
+def test_generate_batch_truncates_prompts_and_restores_the_tokenizer(tmp_path):
+    text = " ".join(f"patient flow {position} in the emergency department." for position in range(100))
+    tokenizer = _tokenizer(text)
+    tokenizer.model_max_length = 80
+    pipe = StubPipe(tokenizer)
+    prompt_node = types.SimpleNamespace(
+        prompt_model=types.SimpleNamespace(model_invocation_layer=types.SimpleNamespace(pipe=pipe)))
+    session = _session(tmp_path, ModelCache(), max_ans_length=30)
+    template = PromptTemplate(prompt="Context: {join(documents)} Question: {query}")
+    documents = [[Document(content=text)], [Document(content="Short context.")]]
+
+    answers = session._generate_batch(prompt_node, template, ["Which flow?", "Why?"], documents, batch_size=2)
+    assert answers == ["answer 0", "answer 1"]
+    (prompts, padding_side, kwargs), = pipe.calls
+    assert padding_side == "left" and kwargs["max_new_tokens"] == 30
+    # the long prompt is cut on the original text to the tokens left for the answer, the short one is unchanged
+    assert len(tokenizer(prompts[0], add_special_tokens=False)["input_ids"]) == 50
+    assert text.startswith(prompts[0][len("Context: "):])
+    assert prompts[1] == "Context: Short context. Question: Why?"
+    # the shared tokenizer is left as it was
+    assert tokenizer.padding_side == "right" and tokenizer.pad_token == "[PAD]"
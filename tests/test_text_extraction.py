@@ -0,0 +1,238 @@
+"""Tests of the page-level PDF extraction on small PDFs written with PyPDF2."""
+
+import io
+import json
+import os
+import random
+
+import pytest
+
+PyPDF2 = pytest.importorskip("PyPDF2")
+
+from PyPDF2.generic import ArrayObject, DecodedStreamObject, DictionaryObject, NameObject, NumberObject
+
+from rrc.text_extraction import (
+    ArticleIndex, PDFExtractor, _count_rules, _not_within_bboxes, iter_extracted_pages, load_extracted)
+
+TEXT = b"BT /F1 11 Tf 72 700 Td (Patient flow was simulated with a discrete event model of the department.) Tj ET\n"
+# clipping path of the page, a page border and two underlines: no table
+DECORATION = b"0 0 612 792 re W n\n36 36 540 720 re S\n72 690 m 300 690 l S\n72 650 m 300 650 l S\n"
+
+
+def _grid(rows, cols, x=72, y=400, width=60, height=20):
+    lines = [b"%d %d m %d %d l S" % (x, y + row * height, x + cols * width, y + row * height) for row in range(rows + 1)]
+    lines += [b"%d %d m %d %d l S" % (x + col * width, y, x + col * width, y + rows * height) for col in range(cols + 1)]
+    return b"\n".join(lines) + b"\n"
+
+
+def _pdf(*contents, form_content=None):
+    # one page per content stream
+    writer = PyPDF2.PdfWriter()
+    for content in contents:
+        writer.add_page(_page(writer, content, form_content))
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+def _page(writer, content, form_content):
+    page = PyPDF2.PageObject.create_blank_page(width=612, height=792)
+    font = DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/Helvetica"),
+    })
+    resources = DictionaryObject({
+        NameObject("/Font"): DictionaryObject({NameObject("/F1"): writer._add_object(font)})
+    })
+    if form_content is not None:
+        form = DecodedStreamObject()
+        form.set_data(form_content)
+        form.update({
+            NameObject("/Type"): NameObject("/XObject"),
+            NameObject("/Subtype"): NameObject("/Form"),
+            NameObject("/BBox"): ArrayObject([NumberObject(n) for n in (0, 0, 612, 792)]),
+        })
+        resources[NameObject("/XObject")] = DictionaryObject({NameObject("/Fm1"): writer._add_object(form)})
+        content += b"/Fm1 Do\n"
+    stream = DecodedStreamObject()
+    stream.set_data(content)
+    page[NameObject("/Resources")] = resources
+    page[NameObject("/Contents")] = writer._add_object(stream)
+    return page
+
+
+def _fallbacks(tmp_path, pdf_bytes):
+    path = tmp_path / "article.pdf"
+    path.write_bytes(pdf_bytes)
+    pages = list(PDFExtractor(str(tmp_path)).iter_pages("auto", path=str(path)))
+    return [page["extractor"] for page in pages]
+
+
+def test_count_rules_skips_clipping_paths():
+    assert _count_rules(b"0 0 612 792 re W n 10 10 100 50 re W* n") == (0, 0, 0)
+    assert _count_rules(DECORATION) == (2, 0, 1)
+    assert _count_rules(b"72 400 200 .5 re f 72 400 .5 80 re f 72 400 200 80 re f") == (1, 1, 1)
+    assert _count_rules(_grid(3, 3)) == (4, 4, 0)
+
+
+def test_table_free_page_is_kept(tmp_path):
+    assert _fallbacks(tmp_path, _pdf(DECORATION + TEXT)) == ["PdfReader"]
+
+
+@pytest.mark.parametrize("in_form", [False, True])
+def test_ruled_table_falls_back(tmp_path, in_form):
+    pytest.importorskip("pdfplumber")
+    if in_form:
+        pdf_bytes = _pdf(DECORATION + TEXT, form_content=_grid(3, 3))
+    else:
+        pdf_bytes = _pdf(DECORATION + TEXT + _grid(3, 3))
+    assert _fallbacks(tmp_path, pdf_bytes) == ["pdfplumber"]
+
+
+@pytest.mark.parametrize("extractor", ["PdfReader", "pdfplumber", "auto"])
+def test_json_and_jsonl_give_the_same_text(tmp_path, extractor):
+    if extractor != "PdfReader":
+        pytest.importorskip("pdfplumber")
+    # the second page holds a table, so "auto" mixes both backends
+    (tmp_path / "article.pdf").write_bytes(_pdf(TEXT, TEXT + _grid(3, 3), TEXT))
+    extractor_instance = PDFExtractor(str(tmp_path))
+    pages = [
+        extractor_instance._extract_to_file(extractor, str(tmp_path / "article.pdf"), str(tmp_path), output_format=fmt)
+        for fmt in ("json", "jsonl")
+    ]
+    json_data, jsonl_data = (load_extracted(str(tmp_path / page["json_file_name"])) for page in pages)
+    assert jsonl_data["extracted_text"] == json_data["extracted_text"]
+    assert jsonl_data["article_id"] == json_data["article_id"]
+    assert jsonl_data["extracted_text"].count("discrete event model") == 3
+
+
+def test_jsonl_pages_are_readable_during_extraction(tmp_path):
+    (tmp_path / "article.pdf").write_bytes(_pdf(*[DECORATION + TEXT] * 3))
+    jsonl_path = str(tmp_path / "article.jsonl")
+    seen = []
+
+    class WatchedExtractor(PDFExtractor):
+        def iter_pages(self, *args, **kwargs):
+            for page in super().iter_pages(*args, **kwargs):
+                # pages written so far are visible, a torn last line is left out
+                seen.append([record["page"] for record in iter_extracted_pages(jsonl_path)])
+                yield page
+
+    result = WatchedExtractor(str(tmp_path))._extract_to_file(
+        "PdfReader", str(tmp_path / "article.pdf"), str(tmp_path), output_format="jsonl")
+    assert result["pages"] == 3
+    assert seen == [[], [1], [1, 2]]
+    with open(jsonl_path, "a") as jsonl_file:
+        jsonl_file.write('{"article_id": "x", "pa')
+    assert [record["page"] for record in iter_extracted_pages(jsonl_path)] == [1, 2, 3]
+
+
+def _closure_filter(bboxes):
+    # the per-object filter _not_within_bboxes replaces
+    def not_within_bboxes(obj):
+        def obj_in_bbox(_bbox):
+            v_mid = (obj["top"] + obj["bottom"]) / 2
+            h_mid = (obj["x0"] + obj["x1"]) / 2
+            x0, top, x1, bottom = _bbox
+            return (h_mid >= x0) and (h_mid < x1) and (v_mid >= top) and (v_mid < bottom)
+        return not any(obj_in_bbox(__bbox) for __bbox in bboxes)
+    return not_within_bboxes
+
+
+def test_bbox_filter_matches_the_per_object_check():
+    rng = random.Random(0)
+    bboxes = [(100.0, 200.0, 300.0, 260.0), (50.5, 400.25, 120.75, 500.0)]
+    chars = [
+        {"x0": x, "x1": x + width, "top": top, "bottom": top + height}
+        for x, width, top, height in (
+            (rng.uniform(0, 400), rng.uniform(1, 10), rng.uniform(150, 550), rng.uniform(5, 12))
+            for _ in range(2000))
+    ]
+    # midpoints on every edge: the left and top edges are within a box, the right and bottom ones are not
+    for x0, top, x1, bottom in bboxes:
+        for h_mid, v_mid in ((x0, top), (x1, top), (x0, bottom), (x1, bottom), ((x0 + x1) / 2, top)):
+            chars.append({"x0": h_mid - 2, "x1": h_mid + 2, "top": v_mid - 5, "bottom": v_mid + 5})
+    kept, expected = _not_within_bboxes(chars, bboxes), _closure_filter(bboxes)
+    assert [kept(char) for char in chars] == [expected(char) for char in chars]
+    assert [kept(char) for char in chars[-10:]] == [False, True, True, True, False] * 2
+    assert _not_within_bboxes([], bboxes)({"x0": 0, "x1": 1, "top": 0, "bottom": 1})
+
+
+def _mass_extract(src_dir, dest_dir, **options):
+    extractor = PDFExtractor(str(src_dir))
+    extractor.mass_extract("PdfReader", dest_dir=str(dest_dir), **options)
+    return extractor.extraction_summary
+
+
+def test_manifest_skips_unchanged_pdfs(tmp_path):
+    src_dir, dest_dir = tmp_path / "pdfs", tmp_path / "extracted"
+    src_dir.mkdir()
+    dest_dir.mkdir()
+    for name in ("first", "second"):
+        (src_dir / f"{name}.pdf").write_bytes(_pdf(TEXT + b"% " + name.encode() + b"\n"))
+    summary = _mass_extract(src_dir, dest_dir)
+    assert (summary["extracted"], summary["skipped"]) == (2, 0)
+    assert _mass_extract(src_dir, dest_dir)["skipped"] == 2
+
+    # touched but unchanged: the content hash is compared and the PDF is skipped
+    first = src_dir / "first.pdf"
+    os.utime(first, (first.stat().st_atime, first.stat().st_mtime + 10))
+    assert _mass_extract(src_dir, dest_dir)["skipped"] == 2
+    article_id = load_extracted(str(dest_dir / "first.json"))["article_id"]
+
+    # changed content is re-extracted under the article id of the new content
+    first.write_bytes(_pdf(TEXT + b"% changed\n"))
+    os.utime(first, (first.stat().st_atime, first.stat().st_mtime + 20))
+    summary = _mass_extract(src_dir, dest_dir)
+    assert (summary["extracted"], summary["skipped"]) == (1, 1)
+    assert load_extracted(str(dest_dir / "first.json"))["article_id"] != article_id
+
+    # a removed output and force re-extract
+    os.remove(dest_dir / "second.json")
+    assert _mass_extract(src_dir, dest_dir)["skipped"] == 1
+    assert _mass_extract(src_dir, dest_dir, force=True)["skipped"] == 0
+
+
+def _write_article(path, article_id, text="text"):
+    mtime = os.stat(path).st_mtime if os.path.exists(path) else None
+    if str(path).endswith(".jsonl"):
+        path.write_text(json.dumps({"article_id": article_id, "page": 1, "text": text, "extractor": "pdfplumber"}) + "\n")
+    else:
+        path.write_text(json.dumps({"article_id": article_id, "extracted_text": text}))
+    if mtime is not None:
+        # a rewrite within the timestamp resolution still changes the modification time
+        os.utime(path, (mtime + 1, mtime + 1))
+
+
+def test_article_index_refreshes_incrementally(tmp_path, monkeypatch):
+    _write_article(tmp_path / "a.json", "A")
+    _write_article(tmp_path / "b.jsonl", "B")
+    index = ArticleIndex(str(tmp_path))
+    assert sorted(index) == ["A", "B"]
+    assert index.load("B")["extracted_text"] == "text"
+
+    reads = []
+    read_article_id = ArticleIndex._read_article_id
+
+    def counted_read(self, path):
+        reads.append(path)
+        return read_article_id(self, path)
+
+    monkeypatch.setattr(ArticleIndex, "_read_article_id", counted_read)
+
+    # a new file is found on a lookup miss, only that file is read
+    _write_article(tmp_path / "c.json", "C")
+    assert index.path("C") == str(tmp_path / "c.json")
+    assert reads == [str(tmp_path / "c.json")]
+
+    # a file rewritten with another article is re-read when it is loaded
+    _write_article(tmp_path / "a.json", "A2", text="new text")
+    assert index.load("A") is None
+    assert index.load("A2")["extracted_text"] == "new text"
+    assert "A" not in index
+
+    # removed files leave the index on refresh
+    os.remove(tmp_path / "b.jsonl")
+    index.refresh()
+    assert sorted(index) == ["A2", "C"]
@@ -0,0 +1,114 @@
+"""Tests of the incremental Zotero sync and the retries of ZoteroAPIMetaExtractor against a local mock server."""
+
+import hashlib
+import json
+import os
+import queue
+
+import pytest
+
+requests = pytest.importorskip("requests")
+
+from rrc import text_extraction
+from rrc.text_extraction import ZoteroAPIMetaExtractor
+
+
+def _synced_items(dest_dir):
+    with open(os.path.join(dest_dir, "ZoteroMetadata.json")) as json_file:
+        return {item["key"]: item for item in json.load(json_file)}
+
+
+def test_sync_fetches_only_modified_items(zotero_server, tmp_path, monkeypatch):
+    # several pages, fetched concurrently
+    monkeypatch.setattr(text_extraction, "ZOTERO_PAGE_SIZE", 2)
+    for key in "ABCDE":
+        zotero_server.add_item(key, title=f"Title {key}")
+    extractor = ZoteroAPIMetaExtractor("json", base_url=zotero_server.base_url)
+    dest_dir = str(tmp_path)
+
+    result = extractor.sync("1", "user", "key", dest_dir=dest_dir)
+    assert result == {"version": 5, "updated": 5, "deleted": 0, "items": 5}
+    assert set(_synced_items(dest_dir)) == set("ABCDE")
+    assert zotero_server.log[0][2].get("If-Modified-Since-Version") is None
+
+    # nothing changed: a single conditional request answered with 304 Not Modified
+    zotero_server.log.clear()
+    result = extractor.sync("1", "user", "key", dest_dir=dest_dir)
+    assert result == {"version": 5, "updated": 0, "deleted": 0, "items": 5}
+    assert [(path, status) for path, _, _, status in zotero_server.log] == [("/users/1/items", 304)]
+    assert zotero_server.log[0][2]["If-Modified-Since-Version"] == "5"
+
+    # only the items modified since version 5 are fetched, deletions are applied
+    zotero_server.add_item("B", title="New title B")
+    zotero_server.add_item("F", title="Title F")
+    zotero_server.delete_item("A")
+    zotero_server.log.clear()
+    result = extractor.sync("1", "user", "key", dest_dir=dest_dir)
+    assert result == {"version": 8, "updated": 2, "deleted": 1, "items": 5}
+    item_requests = [query for path, query, _, _ in zotero_server.log if path == "/users/1/items"]
+    assert item_requests and all(query["since"] == "5" for query in item_requests)
+    items = _synced_items(dest_dir)
+    assert set(items) == set("BCDEF")
+    assert items["B"]["title"] == "New title B"
+
+
+def test_sync_starts_over_for_another_library(zotero_server, tmp_path):
+    zotero_server.add_item("A", title="Title A")
+    extractor = ZoteroAPIMetaExtractor("json", base_url=zotero_server.base_url)
+    extractor.sync("1", "user", "key", dest_dir=str(tmp_path))
+    # a stored state of another library is not used
+    with open(os.path.join(tmp_path, text_extraction.ZOTERO_SYNC_STATE_FILE_NAME), "w") as state_file:
+        json.dump({"library": "groups/2", "version": 1}, state_file)
+    zotero_server.log.clear()
+    result = extractor.sync("1", "user", "key", dest_dir=str(tmp_path))
+    assert result["updated"] == 1
+    assert zotero_server.log[0][1]["since"] == "0"
+
+
+def test_request_retries_rate_limited_and_unavailable_responses(zotero_server, tmp_path):
+    zotero_server.add_item("A", title="Title A")
+    zotero_server.failures = [(429, {"Retry-After": "0.2"}), (503, {"Retry-After": "0"})]
+    extractor = ZoteroAPIMetaExtractor("json", base_url=zotero_server.base_url, max_retries=3)
+    result = extractor.sync("1", "user", "key", dest_dir=str(tmp_path))
+    assert result["updated"] == 1
+    assert [status for _, _, _, status in zotero_server.log] == [429, 503, 200]
+
+
+def test_request_honours_backoff(zotero_server):
+    zotero_server.add_item("A", title="Title A")
+    zotero_server.failures = [(429, {"Retry-After": "0.3"})]
+    extractor = ZoteroAPIMetaExtractor("json", base_url=zotero_server.base_url)
+    with requests.Session() as session:
+        start = text_extraction.time.monotonic()
+        response = extractor._request(session, f"{zotero_server.base_url}/users/1/items")
+        assert response.status_code == 200
+        assert text_extraction.time.monotonic() - start >= 0.3
+
+
+def test_request_gives_up_after_max_retries(zotero_server):
+    zotero_server.failures = [(429, {"Retry-After": "0"})] * 3
+    extractor = ZoteroAPIMetaExtractor("json", base_url=zotero_server.base_url, max_retries=2)
+    with requests.Session() as session:
+        with pytest.raises(requests.HTTPError):
+            extractor._request(session, f"{zotero_server.base_url}/users/1/items")
+    assert len(zotero_server.log) == 3
+
+
+def test_download_attachments_skips_unchanged_files(zotero_server, tmp_path):
+    zotero_server.add_item("P1", title="Parent 1")
+    for key, content in (("F1", b"%PDF-1.4 first"), ("F2", b"%PDF-1.4 second")):
+        zotero_server.add_attachment(key, "P1", content)
+        zotero_server.items[key]["data"]["md5"] = hashlib.md5(content).hexdigest()
+    extractor = ZoteroAPIMetaExtractor("json", base_url=zotero_server.base_url)
+    file_queue = queue.Queue()
+
+    results = extractor.download_attachments("1", "user", "key", dest_dir=str(tmp_path), file_queue=file_queue)
+    assert sorted((result["key"], result["skipped"]) for result in results) == [("F1", False), ("F2", False)]
+    with open(os.path.join(tmp_path, "F2.pdf"), "rb") as pdf_file:
+        assert pdf_file.read() == b"%PDF-1.4 second"
+    assert sorted(iter(file_queue.get, None)) == sorted(result["path"] for result in results)
+
+    zotero_server.log.clear()
+    results = extractor.download_attachments("1", "user", "key", dest_dir=str(tmp_path))
+    assert all(result["skipped"] for result in results)
+    assert not any(path.endswith("/file") for path, _, _, _ in zotero_server.log)